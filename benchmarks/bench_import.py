@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_workflow import RESULTS_DIR, git_commit
+
+MODULES = ('deus_flow', 'model.deus_flow_model', 'deus_utils')
+# Imported on the first LLM call or when a feature is used, never by importing the package
+LAZY_MODULES = ('openai', 'aiohttp', 'dotenv', 'deus_client', 'asyncio', 'http.server', 'cProfile', 'tracemalloc')
+DEFAULT_TARGET = 0.15
+
+def _environment() -> Dict[str, str]:
+    # The subprocesses import from the repository root, whatever the caller's working directory
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.getenv("PYTHONPATH")])))
+
+def import_times(module: str) -> Dict[str, List[int]]:
+    # -X importtime reports "self | cumulative | name" in microseconds for every module, on stderr
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True, cwd=ROOT, env=_environment(), check=True)
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = [int(self_time), int(cumulative)]
+    return times
+
+def loaded_lazy_modules(module: str) -> List[str]:
+    code = f"import sys, json, {module}; print(json.dumps([name for name in {LAZY_MODULES!r} if name in sys.modules]))"
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT, env=_environment(), check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def measure(module: str, runs: int, top_n: int) -> Dict:
+    # Every run is a fresh interpreter, so each one is a cold import (apart from the OS file cache)
+    samples = [import_times(module) for _ in range(runs)]
+    cumulative = [sample[module][1] / 1e6 for sample in samples]
+    slowest = sorted(samples[-1].items(), key=lambda item: item[1][0], reverse=True)[:top_n]
+    return {"module": module,
+            "runs": runs,
+            "median_seconds": statistics.median(cumulative),
+            "min_seconds": min(cumulative),
+            "slowest_imports": [{"module": name, "self_seconds": self_time / 1e6} for name, (self_time, _) in slowest],
+            "lazy_modules_loaded": loaded_lazy_modules(module)}
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Cold import time of the deus modules")
+    parser.add_argument("--module", action="append", help="Module to import (default: deus_flow, model.deus_flow_model, deus_utils)")
+    parser.add_argument("--runs", type=int, default=7, help="Fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports listed per module")
+    parser.add_argument("--target", type=float, default=DEFAULT_TARGET, help="Median import time in seconds that no module may exceed")
+    parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/import-<commit>.json)")
+    args = parser.parse_args(argv)
+
+    commit = git_commit()
+    results = {"commit": commit,
+               "timestamp": time.time(),
+               "python": platform.python_version(),
+               "target_seconds": args.target,
+               "imports": [measure(module, args.runs, args.top) for module in (args.module or MODULES)]}
+
+    output = args.output or os.path.join(RESULTS_DIR, f"import-{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    failed = False
+    for result in results["imports"]:
+        over = result["median_seconds"] > args.target
+        failed = failed or over or bool(result["lazy_modules_loaded"])
+        print(f"{result['module']:<24} median={result['median_seconds'] * 1e3:.1f}ms min={result['min_seconds'] * 1e3:.1f}ms "
+              f"{'OVER TARGET ' if over else ''}lazy modules loaded={result['lazy_modules_loaded'] or 'none'}")
+        print("    slowest: " + ", ".join(f"{item['module']} {item['self_seconds'] * 1e3:.1f}ms" for item in result["slowest_imports"]))
+    print(f"Results written to {output}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.feedback_model import Feedback, FeedbackBundle, DataBundle
+from model.information_model import Scope, Requirements, Step, Action, Tool, Plan, PlanHistory
+from model.deus_flow_model import LLMLog, ValidationLog, PlanUpdateLog, ExecutionLog, IterationLog
+from benchmarks.bench_workflow import RESULTS_DIR, git_commit
+
+def sample_objects() -> Dict[str, Any]:
+    # One representative instance per model class, filled the way a run fills them
+    feedback = Feedback("The plan covers every requirement", True)
+    requirements = Requirements(["Render the board", "Validate moves", "Detect checkmate"])
+    tool = Tool("python", "python", "Runs a python snippet", print, "python code")
+    step = Step("step_1", "Write the board renderer", tools=[tool], feedback=feedback)
+    blocked = Step("step_2", "Write the move validator", tools=[tool])
+    blocked.add_blocker(step)
+    action = Action(step, tool, "print('board')", feedback)
+    step.action = action
+    snapshot = Plan([step, blocked]).snapshot()
+    return {"Feedback": feedback,
+            "FeedbackBundle": FeedbackBundle([feedback, feedback]),
+            "DataBundle": DataBundle({"validation_instructions": ""}, feedback),
+            "Scope": Scope("Make me a program that can play chess", "A chess program", requirements, "A chess program"),
+            "Requirements": requirements,
+            "Tool": tool,
+            "Step": step,
+            "Action": action,
+            "LLMLog": LLMLog("prompt", "response", "planner"),
+            "ValidationLog": ValidationLog("prompt", "response", feedback, "instructions"),
+            "PlanUpdateLog": PlanUpdateLog("prompt", "response", snapshot, snapshot),
+            "ExecutionLog": ExecutionLog(action, DataBundle({}), feedback),
+            "IterationLog": IterationLog()}
+
+def field_names(obj: Any) -> List[str]:
+    return [name for klass in reversed(type(obj).__mro__) for name in vars(klass).get('__slots__', ())
+            if not name.startswith("__")]
+
+def per_object_bytes(make: Callable[[], Any], count: int) -> float:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    objects = [make() for _ in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return (after - before) / count
+
+def compare_memory(name: str, obj: Any, count: int) -> Dict:
+    # Both sides hold the same attribute values, so only the object itself is measured: the slotted
+    # class against an ordinary class whose instances keep the same fields in a __dict__
+    fields = [(field, getattr(obj, field)) for field in field_names(obj)]
+    plain_class = type(name, (), {})
+
+    def clone(cls):
+        def make():
+            clone = object.__new__(cls)
+            for field, value in fields:
+                setattr(clone, field, value)
+            return clone
+        return make
+
+    slotted = per_object_bytes(clone(type(obj)), count)
+    plain = per_object_bytes(clone(plain_class), count)
+    return {"class": name, "fields": len(fields), "slots_bytes": slotted, "dict_bytes": plain,
+            "saving": 1 - slotted / plain if plain else 0.0}
+
+def time_call(func: Callable, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+def compare_copies(objects: Dict[str, Any], number: int) -> List[Dict]:
+    results = []
+    for name in ("Feedback", "FeedbackBundle", "Scope", "Requirements", "Tool", "Step", "Action"):
+        obj = objects[name]
+        results.append({"operation": f"{name}.copy", "seconds": time_call(obj.copy, number),
+                        "deepcopy_seconds": time_call(lambda: copy.deepcopy(obj), number)})
+    # Plan.copy used to deep-copy its steps
+    plan = Plan([objects["Step"]] + objects["Step"].blocking)
+    results.append({"operation": "Plan.copy", "seconds": time_call(plan.copy, number),
+                    "deepcopy_seconds": time_call(lambda: Plan(copy.deepcopy(plan.steps)), number)})
+    return results
+
+def compare_history(steps: int, iterations: int) -> Dict:
+    # One step changes per iteration, as when the task handler completes a step, and every version is kept
+    tool = Tool("python", "python", "Runs a python snippet", print, "python code")
+    plan = Plan([Step(f"step_{index}", f"Goal of step {index}", tools=[tool]) for index in range(steps)])
+    for step, blocker in zip(plan.steps[1:], plan.steps):
+        step.add_blocker(blocker)
+
+    def keep(record: Callable[[Plan], Any]) -> Dict:
+        for step in plan.steps:
+            step.accomplished = False
+        tracemalloc.start()
+        start = time.perf_counter()
+        versions = []
+        for iteration in range(iterations):
+            step = plan.steps[iteration % steps]
+            step.accomplished = not step.accomplished
+            versions.append(record(plan))
+        elapsed = time.perf_counter() - start
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {"bytes": memory, "seconds": elapsed}
+
+    history = PlanHistory()
+    copies = keep(lambda plan: plan.copy())
+    snapshots = keep(history.record)
+    return {"steps": steps, "iterations": iterations,
+            "copies_bytes": copies["bytes"], "copies_seconds": copies["seconds"],
+            "snapshots_bytes": snapshots["bytes"], "snapshots_seconds": snapshots["seconds"]}
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Per-object memory and copy time of the model classes")
+    parser.add_argument("--count", type=int, default=20000, help="Objects allocated per class for the memory figures")
+    parser.add_argument("--number", type=int, default=2000, help="Calls per timing repeat")
+    parser.add_argument("--plan-steps", type=int, default=20, help="Steps in the plan whose history is kept")
+    parser.add_argument("--iterations", type=int, default=200, help="Plan versions kept in the history comparison")
+    parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/models-<commit>.json)")
+    args = parser.parse_args(argv)
+
+    objects = sample_objects()
+    commit = git_commit()
+    results = {"commit": commit,
+               "timestamp": time.time(),
+               "python": platform.python_version(),
+               "memory": [compare_memory(name, obj, args.count) for name, obj in objects.items()],
+               "copies": compare_copies(objects, args.number),
+               "history": compare_history(args.plan_steps, args.iterations)}
+
+    output = args.output or os.path.join(RESULTS_DIR, f"models-{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for row in results["memory"]:
+        print(f"{row['class']:<16} fields={row['fields']:<3} slots={row['slots_bytes']:>6.0f}B "
+              f"dict={row['dict_bytes']:>6.0f}B saving={row['saving']:.0%}")
+    for row in results["copies"]:
+        print(f"{row['operation']:<22} copy={row['seconds'] * 1e6:>8.2f}us deepcopy={row['deepcopy_seconds'] * 1e6:>8.2f}us "
+              f"speedup={row['deepcopy_seconds'] / row['seconds']:.1f}x")
+    history = results["history"]
+    print(f"Plan history ({history['steps']} steps, {history['iterations']} versions): "
+          f"copies={history['copies_bytes'] / 1024:.0f}KiB in {history['copies_seconds'] * 1e3:.1f}ms "
+          f"snapshots={history['snapshots_bytes'] / 1024:.0f}KiB in {history['snapshots_seconds'] * 1e3:.1f}ms")
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deus_utils
+import deus_flow
+from model.deus_flow_model import ContextManager
+from model.workflow_model import WorkflowExecutor, WorkflowStep
+from model.feedback_model import Feedback, FeedbackBundle, DataBundle
+from benchmarks.simulated_backend import (SimulatedTransport, LatencyDistribution, CHESS_SCRIPT, RETRY_SCRIPT,
+                                          PARALLEL_SCRIPT, scripted_answers, simulated_toolkit)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Generate/validate loop -> the generator called once per iteration
+LOOP_GENERATORS = {'_get_user_goal': '_retrieve_goal_llm_call',
+                   'set_scope': 'validate_scope_completeness_llm_call',
+                   '_get_requirements': '_retrieve_requirements_llm_call',
+                   '_merge_requirements': '_merge_requirements_llm_call',
+                   '_get_scope_description': '_describe_scope_llm_call',
+                   '_get_plan_creation': '_create_plan_llm_call',
+                   '_get_plan_update': '_update_plan_llm_call'}
+
+SPECULATIVE_LOOPS = ('user_goal', 'requirements', 'merge_requirements', 'scope_description', 'plan_creation', 'plan_update')
+
+SCENARIOS = {'happy_path': CHESS_SCRIPT,
+             'validation_retries': RETRY_SCRIPT,
+             'parallel_plan': PARALLEL_SCRIPT}
+
+LATENCIES = {'none': LatencyDistribution("constant", value=0.0),
+             'constant': LatencyDistribution("constant", value=0.05),
+             'uniform': LatencyDistribution("uniform", low=0.02, high=0.1),
+             'lognormal': LatencyDistribution("lognormal", mu=-3.0, sigma=0.6)}
+
+class PhaseTrackingExecutor(WorkflowExecutor):
+    transport: SimulatedTransport
+
+    def __init__(self, transport: SimulatedTransport):
+        self.transport = transport
+        self.phases = []
+
+    def execute_step(self, step: WorkflowStep, data: DataBundle) -> Feedback:
+        self.transport.phase = step.name
+        start = time.perf_counter()
+        feedback = super().execute_step(step, data)
+        self.phases.append({"phase": step.name, "duration": time.perf_counter() - start, "success": feedback.success})
+        return feedback
+
+@contextlib.contextmanager
+def count_loop_iterations(iterations: Counter):
+    originals = {}
+    for loop, generator in LOOP_GENERATORS.items():
+        original = originals[generator] = getattr(ContextManager, generator)
+
+        def counted(self, *args, loop_name=loop, generate=original, **kwargs):
+            iterations[loop_name] += 1
+            return generate(self, *args, **kwargs)
+        setattr(ContextManager, generator, counted)
+    try:
+        yield
+    finally:
+        for generator, original in originals.items():
+            setattr(ContextManager, generator, original)
+
+def run_scenario(scenario: str, latency: str, speculation: int = 1) -> Dict:
+    transport = SimulatedTransport(SCENARIOS[scenario], LATENCIES[latency])
+    deus_utils.configure_llm_client(cache=False, transport=transport)
+    executor = PhaseTrackingExecutor(transport)
+    data = DataBundle({"user_query": "Make me a program that can play chess",
+                       "ask_user": scripted_answers(),
+                       "toolkit": simulated_toolkit(),
+                       "speculation": {loop: speculation for loop in SPECULATIVE_LOOPS}},
+                      FeedbackBundle())
+    iterations = Counter()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with count_loop_iterations(iterations), contextlib.redirect_stdout(io.StringIO()):
+        executor.execute_workflow(deus_flow.deus_flow, data)
+    wall_time = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    calls_per_phase = Counter(call["phase"] for call in transport.calls)
+    calls_per_prompt = Counter(call["key"] for call in transport.calls)
+    network_time = transport.network_time()
+    return {"scenario": scenario,
+            "latency": latency,
+            "latency_distribution": LATENCIES[latency].describe(),
+            "speculation": speculation,
+            "wall_time": wall_time,
+            "network_time": network_time,
+            "time_outside_network": wall_time - network_time,
+            "llm_calls": len(transport.calls),
+            "llm_calls_per_phase": dict(calls_per_phase),
+            "llm_calls_per_prompt": dict(calls_per_prompt),
+            "loop_iterations": dict(iterations),
+            "workflow_steps": len(executor.phases),
+            "peak_memory_bytes": peak_memory,
+            "usage": data.usage.summary(),
+            "finished": bool(data['context_manager'] and data['context_manager'].context.finished)}
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: Dict, baseline: Dict) -> List[str]:
+    lines = []
+    baseline_runs = {(run["scenario"], run["latency"]): run for run in baseline["runs"]}
+    for run in results["runs"]:
+        base = baseline_runs.get((run["scenario"], run["latency"]))
+        if base is None:
+            continue
+        for metric in ("wall_time", "time_outside_network", "llm_calls", "peak_memory_bytes"):
+            before, after = base[metric], run[metric]
+            change = (after - before) / before * 100 if before else 0.0
+            lines.append(f"{run['scenario']:<20} {run['latency']:<10} {metric:<22} {before:>14.4f} -> {after:>14.4f} ({change:+.1f}%)")
+    return lines
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the deus_flow workflow against a simulated LLM")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario to run (default: all)")
+    parser.add_argument("--latency", action="append", choices=sorted(LATENCIES), help="Latency distribution (default: constant)")
+    parser.add_argument("--speculation", type=int, default=1, help="Candidates generated concurrently per generate/validate loop")
+    parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    commit = git_commit()
+    results = {"commit": commit,
+               "timestamp": time.time(),
+               "python": platform.python_version(),
+               "runs": [run_scenario(scenario, latency, args.speculation)
+                        for scenario in (args.scenario or sorted(SCENARIOS))
+                        for latency in (args.latency or ["constant"])]}
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit or 'workflow'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for run in results["runs"]:
+        print(f"{run['scenario']:<20} {run['latency']:<10} wall={run['wall_time']:.3f}s "
+              f"outside_network={run['time_outside_network']:.3f}s calls={run['llm_calls']} "
+              f"peak_mem={run['peak_memory_bytes'] / 1024:.0f}KiB loops={run['loop_iterations']}")
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(results, json.load(f))))
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
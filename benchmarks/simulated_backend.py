@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Callable, Dict, List
+
+from deus_client import Transport, LLMRequest, LLMResponse
+from deus_scheduler import estimate_tokens
+from model.information_model import Tool
+from model.feedback_model import Feedback, DataBundle
+
+PASS = {"feedback": {"success": True, "message": "Looks good"}, "validation_instructions": ""}
+FAIL = {"feedback": {"success": False, "message": "Missing details"}, "validation_instructions": "Add the missing details"}
+
+# Responses per prompt key, served in order and repeating the last one
+CHESS_SCRIPT = {
+    'retrieve_goal': [{"user_goal": "Build a program that can play chess against a human"}],
+    'first_ask_user': [{"questions": ["Should the program play against a human or itself?", "Do you need a graphical board?"]}],
+    'next_ask_user': [{"questions": ["Should the program support different difficulty levels?"]}],
+    'retrieve_requirements': [{"requirements": ["Play against a human", "Show the board in the terminal"]}],
+    'merge_requirements': [{"requirements": ["Play against a human", "Show the board in the terminal"]}],
+    'describe_scope': ["A terminal chess program where a human plays against the computer."],
+    'create_plan': [{"plan": {"step_1": "Write the board renderer", "step_2": "Write the move validator", "step_3": "Write the game loop"}}],
+    'update_plan': [{"plan": {"step_1": "Write the board renderer", "step_2": "Write the move validator", "step_3": "Write the game loop"}}],
+    'tool_selection': [{"tool": "python", "feedback": {"success": True, "message": "Python can write the code"}}],
+    'turn_to_action': [{"action": {"tool_input": "print('chess')"}, "feedback": {"success": True, "message": "Action ready"}}],
+}
+
+# Every validator rejects its first candidate, doubling the generate/validate round trips
+RETRY_SCRIPT = dict(CHESS_SCRIPT, **{key: [FAIL, PASS] for key in ('validate_goal',
+                                                                  'validate_requirements_retrieved',
+                                                                  'validate_requirements_merged',
+                                                                  'validate_scope_description',
+                                                                  'validate_create_plan',
+                                                                  'validate_update_plan')})
+
+# The renderer and the validator are independent, the game loop needs both
+PARALLEL_PLAN = {"plan": {"step_1": {"description": "Write the board renderer", "blocked_by": []},
+                          "step_2": {"description": "Write the move validator", "blocked_by": []},
+                          "step_3": {"description": "Write the game loop", "blocked_by": ["step_1", "step_2"]}}}
+PARALLEL_SCRIPT = dict(CHESS_SCRIPT, create_plan=[PARALLEL_PLAN], update_plan=[PARALLEL_PLAN])
+
+class LatencyDistribution:
+    kind: str
+    params: Dict[str, float]
+
+    def __init__(self, kind: str = "constant", seed: int = 0, **params):
+        self.kind = kind
+        self.params = params
+        self._random = random.Random(seed)
+
+    def sample(self) -> float:
+        if self.kind == "constant":
+            return self.params.get("value", 0.0)
+        if self.kind == "uniform":
+            return self._random.uniform(self.params.get("low", 0.0), self.params.get("high", 0.0))
+        if self.kind == "lognormal":
+            return self._random.lognormvariate(self.params.get("mu", -1.0), self.params.get("sigma", 0.5))
+        raise ValueError(f"Unknown latency distribution: {self.kind}")
+
+    def describe(self) -> Dict:
+        return dict(kind=self.kind, **self.params)
+
+class SimulatedTransport(Transport):
+    script: Dict[str, List]
+    latency: LatencyDistribution
+    phase: str
+    calls: List[Dict]
+
+    def __init__(self, script: Dict[str, List] = None, latency: LatencyDistribution = None):
+        self.script = script or CHESS_SCRIPT
+        self.latency = latency or LatencyDistribution()
+        self.phase = None
+        self.calls = []
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    async def send(self, request: LLMRequest) -> LLMResponse:
+        key = request.prompt_key
+        with self._lock:
+            responses = self.script.get(key, [PASS])
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            delay = self.latency.sample()
+        start = time.perf_counter()
+        await asyncio.sleep(delay)
+        with self._lock:
+            self.calls.append({"key": key, "phase": self.phase, "start": start, "end": time.perf_counter()})
+        response = responses[min(position, len(responses) - 1)]
+        content = response if isinstance(response, str) else json.dumps(response)
+        prompt_tokens = estimate_tokens(request.system_message) + estimate_tokens(request.prompt)
+        completion_tokens = estimate_tokens(content)
+        return LLMResponse(content, {"prompt_tokens": prompt_tokens,
+                                     "completion_tokens": completion_tokens,
+                                     "total_tokens": prompt_tokens + completion_tokens})
+
+    def network_time(self) -> float:
+        # Union of the call intervals, so that overlapping calls are only counted once
+        total, current_start, current_end = 0.0, None, None
+        for call in sorted(self.calls, key=lambda call: call["start"]):
+            if current_end is None or call["start"] > current_end:
+                if current_end is not None:
+                    total += current_end - current_start
+                current_start, current_end = call["start"], call["end"]
+            else:
+                current_end = max(current_end, call["end"])
+        if current_end is not None:
+            total += current_end - current_start
+        return total
+
+def scripted_answers(answers: List[str] = None) -> Callable[[str], str]:
+    answers = answers or ["Against a human, in the terminal"]
+    position = [0]
+
+    def ask(question: str) -> str:
+        answer = answers[min(position[0], len(answers) - 1)]
+        position[0] += 1
+        return answer
+    return ask
+
+def simulated_toolkit() -> Dict[str, Tool]:
+    def run_python(tool_input: str) -> DataBundle:
+        return DataBundle({"output": tool_input}, Feedback("Code executed", success=True))
+    return {"python": Tool("python", "python", "Runs a python snippet", run_python, "python code")}
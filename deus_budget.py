@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import contextlib
+import threading
+import time
+
+from deus_context import token_meters, active_deadline
+
+ACCEPT_BEST = 'accept_best'
+FAIL = 'fail'
+
+class LoopBudget:
+    max_iterations: int
+    deadline: float
+    max_tokens: int
+    fallback: str
+
+    def __init__(self, max_iterations: int = 5, deadline: float = None, max_tokens: int = None, fallback: str = ACCEPT_BEST):
+        # deadline is in seconds of wall-clock time from the start of the loop
+        if fallback not in (ACCEPT_BEST, FAIL):
+            raise ValueError(f"Unknown budget fallback: {fallback}")
+        self.max_iterations = max_iterations
+        self.deadline = deadline
+        self.max_tokens = max_tokens
+        self.fallback = fallback
+
+class LoopBudgetExceeded(Exception):
+    loop_name: str
+    reason: str
+
+    def __init__(self, loop_name: str, reason: str):
+        super().__init__(f"{loop_name} exhausted its budget ({reason})")
+        self.loop_name = loop_name
+        self.reason = reason
+
+class DeadlineExceeded(Exception):
+    pass
+
+class Deadline:
+    timeout: float
+    expires_at: float
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, activity: str = "work"):
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline of {self.timeout}s exceeded before {activity}")
+
+def check_deadline(activity: str = "work"):
+    deadline = active_deadline.get()
+    if deadline is not None:
+        deadline.check(activity)
+
+def remaining_time() -> float:
+    deadline = active_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+class TokenMeter:
+    tokens: int
+
+    def __init__(self):
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, tokens: int):
+        with self._lock:
+            self.tokens += tokens
+
+class LoopBudgetTracker:
+    loop_name: str
+    budget: LoopBudget
+    iterations: int
+    meter: TokenMeter
+
+    def __init__(self, loop_name: str, budget: LoopBudget):
+        self.loop_name = loop_name
+        self.budget = budget
+        self.iterations = 0
+        self.meter = TokenMeter()
+        self._start = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    @property
+    def tokens(self) -> int:
+        return self.meter.tokens
+
+    def exhausted(self) -> str:
+        # Returns why the budget is exhausted, or None while there is budget left
+        if self.budget.max_iterations is not None and self.iterations >= self.budget.max_iterations:
+            return "max_iterations"
+        if self.budget.deadline is not None and self.elapsed >= self.budget.deadline:
+            return "deadline"
+        if self.budget.max_tokens is not None and self.tokens >= self.budget.max_tokens:
+            return "max_tokens"
+        return None
+
+    @contextlib.contextmanager
+    def metering(self):
+        # LLM calls made inside the block add their token usage to this loop's meter
+        token = token_meters.set(token_meters.get() + (self.meter,))
+        try:
+            yield self
+        finally:
+            token_meters.reset(token)
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import Callable, Dict
+
+from model.feedback_model import DataBundle, FeedbackBundle, feedback_to_dict, feedback_from_dict
+
+# Bumped whenever the layout of a checkpoint changes, older checkpoints are then refused
+CHECKPOINT_VERSION = 1
+
+class CheckpointError(Exception):
+    pass
+
+class Checkpointer:
+    path: str
+    save_state: Callable[[DataBundle], Dict]
+    restore_state: Callable[[Dict, DataBundle], None]
+
+    def __init__(self,
+                 path: str,
+                 save_state: Callable[[DataBundle], Dict] = None,
+                 restore_state: Callable[[Dict, DataBundle], None] = None):
+        # save_state turns the workflow's data into JSON-friendly state, restore_state puts it back
+        self.path = path
+        self.save_state = save_state
+        self.restore_state = restore_state
+
+    def save(self, workflow_id: str, next_step: str, data: DataBundle):
+        checkpoint = {"version": CHECKPOINT_VERSION,
+                      "saved_at": time.time(),
+                      "workflow_id": workflow_id,
+                      "next_step": next_step,
+                      "feedback": feedback_to_dict(data.feedback_bundle),
+                      "state": self.save_state(data) if self.save_state is not None else None}
+        # Written next to the old checkpoint and swapped in, a crash mid-write keeps the previous one
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(checkpoint, file, separators=(",", ":"))
+        os.replace(temporary_path, self.path)
+
+    def load(self) -> Dict:
+        # None when there is no checkpoint yet
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                checkpoint = json.load(file)
+        except FileNotFoundError:
+            return None
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise CheckpointError(f"Checkpoint {self.path} has version {checkpoint.get('version')}, expected {CHECKPOINT_VERSION}")
+        return checkpoint
+
+    def restore(self, data: DataBundle) -> Dict:
+        checkpoint = self.load()
+        if checkpoint is None:
+            return None
+        feedback = feedback_from_dict(checkpoint.get("feedback"))
+        if feedback is not None:
+            data.feedback_bundle = feedback if isinstance(feedback, FeedbackBundle) else FeedbackBundle(feedback)
+        if self.restore_state is not None and checkpoint.get("state") is not None:
+            self.restore_state(checkpoint["state"], data)
+        return checkpoint
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,566 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, CancelledError
+from typing import Callable, Dict, List
+
+from deus_cache import ResponseCache
+from deus_context import active_pacing, active_cancel_scope, token_meters, active_deadline, active_usage, active_workflow_step
+from deus_budget import DeadlineExceeded
+from deus_scheduler import get_rate_limiter, estimate_tokens
+from deus_prompts import prompt_roles
+from deus_usage import call_cost
+from deus_metrics import get_monitor
+from deus_tracing import trace, get_tracer
+from deus_router import Provider
+
+SYSTEM_MESSAGE = "You must always obey the user, make sure to follow the user's instructions, and do not do anything that the user has not explicitly asked you to do."
+
+class LLMRequest:
+    prompt: str
+    model: str
+    system_message: str
+    temperature: float
+    max_tokens: int
+    stop: str
+    use_cache: bool
+    timeout: float
+    provider: str
+    prompt_key: str
+
+    def __init__(self,
+                 prompt: str,
+                 model: str = 'gpt-3.5-turbo',
+                 system_message: str = SYSTEM_MESSAGE,
+                 temperature: float = 0,
+                 max_tokens: int = 3200,
+                 stop: str = "STOP",
+                 use_cache: bool = True,
+                 timeout: float = None,
+                 provider: str = None):
+        self.prompt = prompt
+        self.model = model
+        self.system_message = system_message
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.use_cache = use_cache
+        self.timeout = timeout
+        # Name of the LLMClient provider to send the request to, None for the client's own transport
+        self.provider = provider
+        self.prompt_key = getattr(prompt, 'key', None)
+
+    def key(self) -> str:
+        # The provider only joins the key when it is set, so existing cache entries and transcripts stay valid
+        fields = [self.model, self.system_message, self.prompt, self.temperature, self.stop]
+        payload = json.dumps(fields + [self.provider] if self.provider is not None else fields)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def cacheable(self) -> bool:
+        # Only deterministic calls are worth replaying from the cache
+        return self.use_cache and self.temperature == 0
+
+    def messages(self) -> List[Dict[str, str]]:
+        return [{"role": "system", "content": self.system_message},
+                {"role": "user", "content": self.prompt}]
+
+class LLMResponse:
+    content: str
+    usage: Dict[str, int]
+
+    def __init__(self, content: str, usage: Dict[str, int] = None):
+        self.content = content
+        self.usage = usage
+
+class Completion(str):
+    # The response text, with what the client knows about the call that produced it
+    model: str
+    usage: Dict[str, int]
+    latency: float
+    cost: float
+    cached: bool
+
+    def __new__(cls, text: str, model: str = None, usage: Dict[str, int] = None, latency: float = None,
+                cost: float = None, cached: bool = False):
+        completion = super().__new__(cls, text)
+        completion.model = model
+        completion.usage = usage
+        completion.latency = latency
+        completion.cost = cost
+        completion.cached = cached
+        return completion
+
+class CancelScope:
+    cancelled: bool
+
+    def __init__(self):
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._futures = set()
+
+    def register(self, future: Future):
+        with self._lock:
+            if not self.cancelled:
+                self._futures.add(future)
+                future.add_done_callback(self._discard)
+                return
+        future.cancel()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            futures, self._futures = self._futures, set()
+        for future in futures:
+            future.cancel()
+
+    def check(self):
+        if self.cancelled:
+            raise CancelledError()
+
+    def _discard(self, future: Future):
+        with self._lock:
+            self._futures.discard(future)
+
+class Transport:
+    async def send(self, request: LLMRequest) -> LLMResponse:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class OpenAITransport(Transport):
+    pool_size: int
+    api_key: str
+    api_base: str
+
+    def __init__(self, pool_size: int = 16, api_key: str = None, api_base: str = None):
+        self.pool_size = pool_size
+        self.api_key = api_key
+        self.api_base = api_base
+        self._session = None
+
+    async def send(self, request: LLMRequest) -> LLMResponse:
+        # openai and aiohttp are imported on the first request, offline runs never load them
+        import openai
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        openai.aiosession.set(self._session)
+        response = await openai.ChatCompletion.acreate(model=request.model,
+                                                       temperature=request.temperature,
+                                                       max_tokens=request.max_tokens,
+                                                       messages=request.messages(),
+                                                       stop=request.stop,
+                                                       request_timeout=request.timeout,
+                                                       api_key=self._get_api_key(),
+                                                       api_base=self.api_base)
+        return LLMResponse(response['choices'][0]['message']['content'], dict(response.get('usage') or {}) or None)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_api_key(self) -> str:
+        # Read lazily so that offline transports never need a key
+        api_key = self.api_key or os.getenv("OPENAI_API_KEY")
+        if api_key is None:
+            raise RuntimeError("OPENAI_API_KEY is not set")
+        return api_key
+
+class Transcript:
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._responses = None
+        self._answers = None
+        self._positions = {}
+
+    def record_response(self, request: LLMRequest, response: LLMResponse, latency: float):
+        self._append({"type": "llm", "key": request.key(), "model": request.model, 
+                      "prompt": request.prompt, "response": response.content, 
+                      "usage": response.usage, "latency": latency})
+
+    def record_answer(self, question: str, answer: str):
+        self._append({"type": "user", "question": question, "answer": answer})
+
+    def next_response(self, request: LLMRequest) -> Dict:
+        with self._lock:
+            self._load()
+            key = request.key()
+            entries = self._responses.get(key)
+            if not entries:
+                raise KeyError(f"No recorded response for prompt {key[:12]} in {self.path}")
+            # Identical prompts are replayed in recording order, repeating the last one
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            return entries[min(position, len(entries) - 1)]
+
+    def recording_input(self, ask_user: Callable[[str], str] = input) -> Callable[[str], str]:
+        def ask(question: str) -> str:
+            answer = ask_user(question)
+            self.record_answer(question, answer)
+            return answer
+        return ask
+
+    def replay_input(self) -> Callable[[str], str]:
+        def ask(question: str) -> str:
+            with self._lock:
+                self._load()
+                if not self._answers:
+                    raise KeyError(f"No recorded user answer left in {self.path}")
+                return self._answers.pop(0)
+        return ask
+
+    def _append(self, entry: Dict):
+        line = json.dumps(entry)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def _load(self):
+        if self._responses is not None:
+            return
+        self._responses, self._answers = {}, []
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["type"] == "llm":
+                    self._responses.setdefault(entry["key"], []).append(entry)
+                elif entry["type"] == "user":
+                    self._answers.append(entry["answer"])
+
+class RecordingTransport(Transport):
+    transport: Transport
+    transcript: Transcript
+
+    def __init__(self, transport: Transport, transcript: Transcript):
+        self.transport = transport
+        self.transcript = transcript
+
+    async def send(self, request: LLMRequest) -> LLMResponse:
+        start = time.perf_counter()
+        response = await self.transport.send(request)
+        self.transcript.record_response(request, response, time.perf_counter() - start)
+        return response
+
+    async def close(self):
+        await self.transport.close()
+
+class ReplayTransport(Transport):
+    transcript: Transcript
+    latency: float|str|Callable
+
+    def __init__(self, transcript: Transcript, latency: float|str|Callable = 0.0):
+        # latency is a fixed delay, a callable(request) -> delay, or "recorded"
+        self.transcript = transcript
+        self.latency = latency
+
+    async def send(self, request: LLMRequest) -> LLMResponse:
+        entry = self.transcript.next_response(request)
+        if self.latency == "recorded":
+            delay = entry.get("latency", 0.0)
+        elif callable(self.latency):
+            delay = self.latency(request)
+        else:
+            delay = self.latency
+        if delay:
+            await asyncio.sleep(delay)
+        return LLMResponse(entry["response"], entry.get("usage"))
+
+class StandInServer:
+    transport: Transport
+    host: str
+    port: int
+
+    def __init__(self, transport: Transport, host: str = "127.0.0.1", port: int = 0):
+        self.transport = transport
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    @property
+    def api_base(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self) -> StandInServer:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        transport = self.transport
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._reply(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                request = _request_from_payload(body)
+                try:
+                    content = asyncio.run(transport.send(request)).content
+                except KeyError as e:
+                    self._reply(404, {"error": {"message": str(e)}})
+                    return
+                self._reply(200, _completion_payload(request, content))
+
+            def _reply(self, status: int, payload: Dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="deus-stand-in", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
+
+def _request_from_payload(body: Dict) -> LLMRequest:
+    messages = body.get("messages", [])
+    system_message = next((m["content"] for m in messages if m["role"] == "system"), SYSTEM_MESSAGE)
+    prompt = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    return LLMRequest(prompt,
+                      model=body.get("model", 'gpt-3.5-turbo'),
+                      system_message=system_message,
+                      temperature=body.get("temperature", 0),
+                      max_tokens=body.get("max_tokens", 3200),
+                      stop=body.get("stop", "STOP"))
+
+def _completion_payload(request: LLMRequest, content: str) -> Dict:
+    prompt_tokens = (len(request.system_message) + len(request.prompt)) // 4
+    completion_tokens = len(content) // 4
+    return {"id": "chatcmpl-" + request.key()[:24],
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, 
+                      "completion_tokens": completion_tokens, 
+                      "total_tokens": prompt_tokens + completion_tokens}}
+
+def create_transport(mode: str = "live", transcript_path: str = None, latency: float|str = 0.0, api_base: str = None) -> Transport:
+    if mode == "live":
+        return OpenAITransport(api_base=api_base)
+    if transcript_path is None:
+        raise ValueError(f"A transcript path is required for {mode} mode")
+    if mode == "record":
+        return RecordingTransport(OpenAITransport(api_base=api_base), Transcript(transcript_path))
+    if mode == "replay":
+        return ReplayTransport(Transcript(transcript_path), latency=latency)
+    raise ValueError(f"Unknown LLM transport mode: {mode}")
+
+def create_provider_transports(mode: str, transport: Transport, providers: Dict[str, Provider]) -> Dict[str, Transport]:
+    # Replayed runs answer every provider from the transcript, recorded runs add their calls to it
+    if mode == "replay":
+        return {name: transport for name in providers}
+    transports = {}
+    for name, provider in providers.items():
+        api_key = os.getenv(provider.api_key_env) if provider.api_key_env else None
+        provider_transport = OpenAITransport(api_key=api_key, api_base=provider.api_base)
+        transports[name] = RecordingTransport(provider_transport, transport.transcript) if mode == "record" else provider_transport
+    return transports
+
+class LLMClient:
+    max_concurrency: int
+    request_timeout: float
+    cache: ResponseCache
+    transport: Transport
+    providers: Dict[str, Transport]
+
+    def __init__(self, 
+                 max_concurrency: int = 8, 
+                 request_timeout: float = None, 
+                 cache: ResponseCache = None, 
+                 transport: Transport = None,
+                 providers: Dict[str, Transport] = None):
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.cache = cache
+        self.transport = transport or OpenAITransport()
+        # Transports of the other providers that requests can name
+        self.providers = providers or {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+
+    def complete(self, request: LLMRequest) -> Completion:
+        future = self.submit(request)
+        # Cancelling the active scope cancels the in-flight request on the client's loop
+        scope = active_cancel_scope.get()
+        if scope is not None:
+            scope.register(future)
+        return future.result()
+
+    async def acomplete(self, request: LLMRequest) -> Completion:
+        return await asyncio.wrap_future(self.submit(request))
+
+    def submit(self, request: LLMRequest) -> Future:
+        if self.cache is not None and request.cacheable():
+            cached = self.cache.get(request.key())
+            if cached is not None:
+                future = Future()
+                self._record_usage(request, None, 0.0, cached=True)
+                future.set_result(Completion(cached, request.model, latency=0.0, cost=0.0, cached=True))
+                return future
+        # All requests run on the client's own loop so they share one connection pool,
+        # whichever thread or event loop they were issued from.
+        if get_tracer() is not None:
+            return self._spawn(self._traced_complete(request, threading.get_ident()))
+        return self._spawn(self._complete(request))
+
+    def close(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        for transport in dict.fromkeys([self.transport, *self.providers.values()]):
+            asyncio.run_coroutine_threadsafe(transport.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    async def _complete(self, request: LLMRequest) -> Completion:
+        start = time.perf_counter()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if request.timeout is None:
+            request.timeout = self.request_timeout
+        deadline = active_deadline.get()
+        if deadline is not None:
+            deadline.check(f"calling {request.model}")
+            request.timeout = min(request.timeout or deadline.remaining(), deadline.remaining())
+        usage_account = active_usage.get()
+        if usage_account is not None:
+            usage_account.check(f"calling {request.model}")
+        queued = time.perf_counter()
+        # Providers count max_tokens against the token budget until the real usage is known
+        reserved_tokens = estimate_tokens(request.system_message) + estimate_tokens(request.prompt) + request.max_tokens
+        # Each limiter takes at most its bucket's capacity and is refunded against what it took
+        delay, taken = get_rate_limiter().reserve(request.model, reserved_tokens)
+        pacing = active_pacing.get()
+        pacing_taken = 0
+        if pacing is not None and pacing.limiter is not None:
+            pacing_delay, pacing_taken = pacing.limiter.reserve(request.model, reserved_tokens)
+            delay = max(delay, pacing_delay)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        monitor = get_monitor()
+        async with self._semaphore:
+            # Time spent on rate limiting and waiting for a free connection
+            monitor.record_queue_wait("llm_client", time.perf_counter() - queued)
+            monitor.in_flight.inc(kind="llm_call", name=request.model)
+            try:
+                transport = self.transport_for(request)
+                if deadline is None:
+                    response = await transport.send(request)
+                else:
+                    # Whatever is still in flight when the deadline passes is cancelled
+                    try:
+                        response = await asyncio.wait_for(transport.send(request), deadline.remaining())
+                    except asyncio.TimeoutError:
+                        raise DeadlineExceeded(f"Deadline of {deadline.timeout}s exceeded while calling {request.model}")
+            finally:
+                monitor.in_flight.dec(kind="llm_call", name=request.model)
+        usage = response.usage
+        if usage and "total_tokens" in usage:
+            used_tokens = usage["total_tokens"]
+            get_rate_limiter().adjust(request.model, taken, used_tokens)
+            if pacing is not None and pacing.limiter is not None:
+                pacing.limiter.adjust(request.model, pacing_taken, used_tokens)
+        else:
+            prompt_tokens = estimate_tokens(request.system_message) + estimate_tokens(request.prompt)
+            completion_tokens = estimate_tokens(response.content or "")
+            used_tokens = prompt_tokens + completion_tokens
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                     "total_tokens": used_tokens, "estimated": True}
+        for meter in token_meters.get():
+            meter.add(used_tokens)
+        cost = call_cost(request.model, usage)
+        self._record_usage(request, usage, cost)
+        if response.content is None:
+            return None
+        message = Completion(response.content, request.model, usage, time.perf_counter() - start, cost=cost)
+        if self.cache is not None and request.cacheable():
+            await asyncio.get_running_loop().run_in_executor(None, self.cache.put, request.key(), response.content)
+        return message
+
+    def transport_for(self, request: LLMRequest) -> Transport:
+        if request.provider is None:
+            return self.transport
+        transport = self.providers.get(request.provider)
+        if transport is None:
+            raise ValueError(f"Unknown LLM provider: {request.provider}")
+        return transport
+
+    async def _traced_complete(self, request: LLMRequest, tid: int) -> Completion:
+        # The span goes on the timeline of the thread that waits for the response
+        with trace(request.prompt_key or "llm_call", "llm_call", tid, model=request.model) as span:
+            completion = await self._complete(request)
+            if completion is not None:
+                span.set(total_tokens=completion.usage.get("total_tokens"), cost=completion.cost)
+            return completion
+
+    def _record_usage(self, request: LLMRequest, usage: Dict[str, int], cost: float, cached: bool = False):
+        usage_account = active_usage.get()
+        if usage_account is not None:
+            usage_account.record(request.model, usage, cost, prompt_roles.get(request.prompt_key, request.prompt_key),
+                                 active_workflow_step.get(), cached)
+
+    def _spawn(self, coro) -> Future:
+        # Like asyncio.run_coroutine_threadsafe, but the task runs in a copy of the
+        # caller's context so that per-run context variables reach the request.
+        loop = self._ensure_loop()
+        context = contextvars.copy_context()
+        future = Future()
+
+        def start():
+            task = loop.create_task(coro, context=context)
+            future.add_done_callback(lambda f: f.cancelled() and loop.call_soon_threadsafe(task.cancel))
+            task.add_done_callback(lambda t: _copy_task_state(t, future))
+        loop.call_soon_threadsafe(start)
+        return future
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="deus-llm-client", daemon=True)
+                self._thread.start()
+            return self._loop
+
+def _copy_task_state(task: asyncio.Task, future: Future):
+    try:
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+    except InvalidStateError:
+        # The caller cancelled the future while the task was finishing
+        pass
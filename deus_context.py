@@ -0,0 +1,21 @@
+from contextvars import ContextVar
+
+# Per-run state that has to reach llm_call without being threaded through every signature.
+# LLMClient copies the caller's context onto its event loop, so these stay visible there.
+active_pacing = ContextVar("active_pacing", default=None)
+active_cancel_scope = ContextVar("active_cancel_scope", default=None)
+# Extra LLMRequest arguments for the calls made in this context, e.g. a candidate temperature
+llm_overrides = ContextVar("llm_overrides", default=None)
+# Token meters that every LLM call made in this context reports its usage to
+token_meters = ContextVar("token_meters", default=())
+active_deadline = ContextVar("active_deadline", default=None)
+# Ids of the workflow and plan step being worked on, recorded on every Log
+active_workflow_id = ContextVar("active_workflow_id", default=None)
+active_step_id = ContextVar("active_step_id", default=None)
+active_workflow_step = ContextVar("active_workflow_step", default=None)
+# UsageAccount of the current run
+active_usage = ContextVar("active_usage", default=None)
+# The tracing span that new spans are nested under
+active_span = ContextVar("active_span", default=None)
+# Escalation of the generate/validate loop being run, the model router starts its calls from it
+active_escalation = ContextVar("active_escalation", default=None)
@@ -1,6 +1,17 @@
-from model.deus_flow_model import ContextManager
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from typing import List
+
+from model.deus_flow_model import ContextManager, Context, Logger
 from model.workflow_model import Workflow, WorkflowStep, WorkflowExecutor
 from model.feedback_model import Feedback, FeedbackBundle, DataBundle
+from deus_budget import LoopBudgetExceeded, DeadlineExceeded
+from deus_usage import UsageBudget, UsageBudgetExceeded
+from deus_checkpoint import Checkpointer, CheckpointError
+import deus_logging
 import traceback
 
 # @flow(log_prints=True)
@@ -10,8 +21,14 @@ import traceback
 #     result = core_loop(context_manager)
 #     return result
 
-def establish_scope(user_query: str) -> ContextManager:
-    context_manager = ContextManager(user_query)
+# DataBundle keys that are passed on to the ContextManager when they are set
+CONTEXT_MANAGER_OPTIONS = ('logger', 'ask_user', 'toolkit', 'max_workers', 'speculation', 'budgets', 'default_budget', 'max_frozen_steps', 'router',
+                           'semantic_cache')
+# Generate/validate loops that can generate candidates speculatively
+SPECULATIVE_LOOPS = ('user_goal', 'requirements', 'merge_requirements', 'scope_description', 'plan_creation', 'plan_update')
+
+def establish_scope(user_query: str, **options) -> ContextManager:
+    context_manager = ContextManager(user_query, **options)
     context_manager.set_scope()
     return context_manager
 
@@ -24,19 +41,29 @@ def establish_scope(user_query: str) -> ContextManager:
 
 def establish_scope_step(data: DataBundle) -> Feedback:
     try:
-        data['context_manager'] = establish_scope(data['user_query'])
+        options = {key: data[key] for key in CONTEXT_MANAGER_OPTIONS if data[key] is not None}
+        data['context_manager'] = establish_scope(data['user_query'], **options)
         return Feedback(success=True, message="Scope established")
+    except (LoopBudgetExceeded, DeadlineExceeded, UsageBudgetExceeded) as e:
+        return stop_workflow(data, e)
     except Exception as e:
-        print(traceback.format_exc(e))
+        deus_logging.error(traceback.format_exc())
         return Feedback(success=False, message="Scope not established: " + str(e))
 
+def stop_workflow(data: DataBundle, error: LoopBudgetExceeded|DeadlineExceeded|UsageBudgetExceeded) -> Feedback:
+    # Retrying the step would only run out of the same budget or time again, so the workflow stops here
+    data['stopped'] = str(error)
+    return Feedback(success=False, message="Workflow stopped: " + str(error))
+
 def establish_scope_condition(data: DataBundle) -> WorkflowStep:
+    if data['stopped']:
+        return None
     workflow_feedback = data.feedback_bundle.get_last_feedback()
     if workflow_feedback.success:
-        print("Establish scope successful")
+        deus_logging.info("Establish scope successful")
         return planning_workflow_step
     else:
-        print("Establish scope unsuccessful")
+        deus_logging.warning("Establish scope unsuccessful")
         return establish_scope_workflow_step
 
 def planning_step(data: DataBundle) -> Feedback:
@@ -44,10 +71,14 @@ def planning_step(data: DataBundle) -> Feedback:
         context_manager = data['context_manager']
         context_manager.planner()
         return Feedback(success=True, message="Planning successful")
+    except (LoopBudgetExceeded, DeadlineExceeded, UsageBudgetExceeded) as e:
+        return stop_workflow(data, e)
     except Exception as e:
         return Feedback(success=False, message="Planning unsuccessful: " + str(e))
     
 def planning_condition(data: DataBundle) -> WorkflowStep:
+    if data['stopped']:
+        return None
     workflow_feedback = data.feedback_bundle.get_last_feedback()
     if workflow_feedback.success:
         return task_handling_workflow_step
@@ -60,22 +91,145 @@ def task_handling_step(data: DataBundle) -> Feedback:
         context_manager.task_handler()
         context_manager.add_iteration()
         return Feedback(success=True, message="Task handling successful")
+    except (LoopBudgetExceeded, DeadlineExceeded, UsageBudgetExceeded) as e:
+        return stop_workflow(data, e)
     except Exception as e:
         return Feedback(success=False, message="Task handling unsuccessful: " + str(e))
     
 def task_handling_condition(data: DataBundle) -> WorkflowStep:
     context_manager = data['context_manager']
-    if context_manager.context.finished:
+    if data['stopped'] or context_manager.context.finished:
         return None
     return planning_workflow_step
 
+def checkpoint_state(data: DataBundle) -> dict:
+    # The scope and plan hold the paid-for LLM work, the options are passed again on resume
+    context_manager = data['context_manager']
+    return {"user_query": data['user_query'],
+            "stopped": data['stopped'],
+            "context": context_manager.context.to_dict() if context_manager is not None else None}
+
+def restore_checkpoint_state(state: dict, data: DataBundle):
+    # Resuming with another query would silently carry on the old task
+    if data['user_query'] is not None and data['user_query'] != state["user_query"]:
+        raise CheckpointError(f"The checkpoint is for {state['user_query']!r}, not {data['user_query']!r}: "
+                              "remove it or use another checkpoint path to start a new run")
+    data['user_query'] = state["user_query"]
+    data['stopped'] = state.get("stopped")
+    if state.get("context") is not None:
+        options = {key: data[key] for key in CONTEXT_MANAGER_OPTIONS if data[key] is not None}
+        context = Context.from_dict(state["context"], data['toolkit'])
+        data['context_manager'] = ContextManager(context=context, **options)
+
+def deus_checkpointer(path: str) -> Checkpointer:
+    return Checkpointer(path, checkpoint_state, restore_checkpoint_state)
+
 establish_scope_workflow_step = WorkflowStep("Establish scope", "Establish the scope of the user's query", establish_scope_step, establish_scope_condition)
 planning_workflow_step = WorkflowStep("Planning", "Plan to achieve the user's goal", planning_step, planning_condition)
 task_handling_workflow_step = WorkflowStep("Task handling", "Handle the task", task_handling_step, task_handling_condition)
 
 deus_flow = Workflow([establish_scope_workflow_step, planning_workflow_step, task_handling_workflow_step])
 
-executor = WorkflowExecutor()
-data = DataBundle(data={"user_query": "Make me a program that can play chess"},
-                  feedback=FeedbackBundle())
-executor.execute_workflow(deus_flow, data)
\ No newline at end of file
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m deus_flow", description="Scope, plan and carry out a task with the deus workflow")
+    parser.add_argument("query", nargs="?", help="What to do, e.g. \"Make me a program that can play chess\"")
+    parser.add_argument("--checkpoint", default=os.getenv("DEUS_CHECKPOINT"),
+                        help="Checkpoint file, the run resumes from it when it exists and saves to it after every step")
+    parser.add_argument("--mode", choices=("live", "record", "replay"), default=os.getenv("DEUS_LLM_MODE", "live"),
+                        help="Call the LLM, record the calls to a transcript or replay a transcript")
+    parser.add_argument("--transcript", default=os.getenv("DEUS_LLM_TRANSCRIPT"), help="Transcript for record and replay")
+    parser.add_argument("--replay-latency", default="0", help="Seconds per replayed call, or 'recorded'")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    parser.add_argument("--semantic-cache", action="store_true",
+                        help="Reuse the goal and requirements of an earlier run for a rewording of its query or goal")
+    parser.add_argument("--query-threshold", type=float, help="Similarity from which a query counts as a rewording")
+    parser.add_argument("--goal-threshold", type=float, help="Similarity from which a goal counts as a rewording")
+    parser.add_argument("--routes", default=os.getenv("DEUS_ROUTES"),
+                        help="JSON file mapping prompt keys and roles to models and providers, or 'cascade'")
+    parser.add_argument("--timeout", type=float, help="Deadline for the whole run in seconds")
+    parser.add_argument("--max-tokens", type=int, help="Token budget for the whole run")
+    parser.add_argument("--max-cost", type=float, help="Cost budget for the whole run in USD")
+    parser.add_argument("--max-workers", type=int, help="Plan steps handled concurrently")
+    parser.add_argument("--speculation", type=int, default=1, help="Candidates generated concurrently per generate/validate loop")
+    parser.add_argument("--log-level", choices=sorted(deus_logging.LEVELS), help="Default: DEUS_LOG_LEVEL or info")
+    parser.add_argument("--log-store", help="SQLite file every log event is also written to")
+    parser.add_argument("--metrics-file", help="Where to write the OpenMetrics export at the end of the run")
+    parser.add_argument("--trace-file", help="Where to write a Chrome trace of the run")
+    parser.add_argument("--profile", help="cpu, memory or cpu,memory to profile every workflow step")
+    parser.add_argument("--profile-dir", default="profiles", help="Where the profiles are written")
+    args = parser.parse_args(argv)
+    if args.query is None and not (args.checkpoint and os.path.exists(args.checkpoint)):
+        parser.error("a query is required unless --checkpoint points to an existing checkpoint")
+    return args
+
+def main(argv: List[str] = None) -> int:
+    # The heavier parts (client, log store, profiler) are only set up for the options that need them
+    args = parse_args(argv)
+    if args.log_level:
+        deus_logging.configure_log_writer([deus_logging.StreamSink(level=deus_logging.LEVELS[args.log_level])])
+    router = None
+    if args.routes:
+        # Before the client is created, it needs a transport for every provider of the routes
+        from deus_router import configure_router, load_routes, CASCADE_ROUTES
+        router = configure_router(CASCADE_ROUTES) if args.routes == "cascade" else configure_router(router=load_routes(args.routes))
+    if args.semantic_cache:
+        from deus_semantic_cache import configure_semantic_cache, semantic_cache_from_env
+        thresholds = {"query_threshold": args.query_threshold, "goal_threshold": args.goal_threshold}
+        configure_semantic_cache(semantic_cache_from_env(**{key: value for key, value in thresholds.items() if value is not None}))
+    if args.mode != "live" or args.no_cache:
+        from deus_utils import configure_llm_mode, load_env
+        load_env()
+        latency = args.replay_latency if args.replay_latency == "recorded" else float(args.replay_latency)
+        configure_llm_mode(args.mode, args.transcript, latency, **({"cache": False} if args.no_cache else {}))
+
+    executor = WorkflowExecutor()
+    executor.metrics_path = args.metrics_file
+    executor.trace_path = args.trace_file
+    if args.profile:
+        from deus_profiling import Profiler
+        modes = {mode.strip().lower() for mode in args.profile.split(",")}
+        executor.profiler = Profiler(args.profile_dir, cpu="cpu" in modes, memory="memory" in modes)
+    if args.checkpoint:
+        executor.checkpointer = deus_checkpointer(args.checkpoint)
+
+    usage_budget = UsageBudget(args.max_tokens, args.max_cost) if args.max_tokens or args.max_cost else None
+    workflow = Workflow(deus_flow.steps, timeout=args.timeout, usage_budget=usage_budget)
+    options = {"user_query": args.query, "max_workers": args.max_workers}
+    if args.speculation > 1:
+        options["speculation"] = {loop: args.speculation for loop in SPECULATIVE_LOOPS}
+    if args.log_store:
+        from deus_log_store import LogStore
+        options["logger"] = Logger(store=LogStore(args.log_store))
+    data = DataBundle(data=options, feedback=FeedbackBundle())
+
+    if executor.checkpointer is not None:
+        try:
+            executor.resume_workflow(workflow, data)
+        except CheckpointError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
+    else:
+        executor.execute_workflow(workflow, data)
+
+    context_manager = data['context_manager']
+    if context_manager is not None:
+        context_manager.logger.close()
+        if context_manager.context.plan is not None:
+            print(context_manager.context.plan)
+    finished = bool(context_manager is not None and context_manager.context.finished)
+    if data['stopped']:
+        print(f"Stopped: {data['stopped']}")
+    elif not finished:
+        print("The plan was not finished")
+    if data.usage is not None:
+        print(f"Usage: {data.usage.total.to_dict()}")
+    if context_manager is not None and context_manager.semantic_cache is not None:
+        print(f"Semantic cache: {context_manager.semantic_cache.stats()}")
+    if router is not None:
+        for key, stats in router.stats().items():
+            print(f"Route {key} ({stats['route']}): calls={stats['calls']} escalation_rate={stats['escalation_rate']:.0%} "
+                  f"models={stats['models']}")
+    return 0 if finished else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
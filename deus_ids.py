@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+import weakref
+from typing import Any, Dict
+
+# Ids start with the digit of their type, followed by a ULID: 48 bits of milliseconds since the epoch and
+# 80 random bits in Crockford base32. Ids of one type sort in creation order, also within a millisecond.
+WORKFLOW = "1"
+WORKFLOW_STEP = "2"
+STEP = "3"
+ACTION = "4"
+KINDS = {WORKFLOW: "workflow", WORKFLOW_STEP: "workflow_step", STEP: "step", ACTION: "action"}
+
+_ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+_DECODE = {character: value for value, character in enumerate(_ALPHABET)}
+_RANDOM_BITS = 80
+_ID_LENGTH = 26
+
+class IdGenerator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_time = -1
+        self._last_random = 0
+
+    def new_id(self, prefix: str) -> str:
+        with self._lock:
+            now = time.time_ns() // 1_000_000
+            if now <= self._last_time:
+                # Same millisecond, or the clock went back: the random part is incremented to keep the order
+                now = self._last_time
+                random = self._last_random + 1
+                if random >> _RANDOM_BITS:
+                    now, random = now + 1, 0
+            else:
+                random = int.from_bytes(os.urandom(_RANDOM_BITS // 8), "big")
+            self._last_time, self._last_random = now, random
+        return prefix + _encode((now << _RANDOM_BITS) | random)
+
+def _encode(value: int) -> str:
+    characters = []
+    for _ in range(_ID_LENGTH):
+        characters.append(_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(characters))
+
+def id_kind(object_id: str) -> str:
+    # workflow, workflow_step, step or action, None for anything this module did not make
+    if not isinstance(object_id, str) or len(object_id) != 1 + _ID_LENGTH:
+        return None
+    return KINDS.get(object_id[0])
+
+def id_time(object_id: str) -> float:
+    # Creation time of the id in epoch seconds
+    value = 0
+    for character in object_id[1:1 + _ID_LENGTH].lower():
+        value = (value << 5) | _DECODE[character]
+    return (value >> _RANDOM_BITS) / 1000
+
+class ObjectRegistry:
+    # Live objects by id, an object leaves the registry when it is garbage collected
+    def __init__(self):
+        self._objects = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def register(self, obj: Any, replace: bool = False) -> Any:
+        # Copies carry the id of their original, they only take the id over with replace
+        with self._lock:
+            if replace or self._objects.get(obj.id) is None:
+                self._objects[obj.id] = obj
+        return obj
+
+    def resolve(self, object_id: str) -> Any:
+        obj = self._objects.get(object_id) if object_id is not None else None
+        # A step that took over another step's id stays registered under its old one until collected
+        return obj if obj is not None and obj.id == object_id else None
+
+    def __contains__(self, object_id: str) -> bool:
+        return self.resolve(object_id) is not None
+
+    def __len__(self):
+        return len(self._objects)
+
+    def counts(self) -> Dict[str, int]:
+        counts = {}
+        for object_id in list(self._objects.keys()):
+            kind = id_kind(object_id)
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+_generator = IdGenerator()
+_registry = ObjectRegistry()
+
+def new_id(prefix: str) -> str:
+    return _generator.new_id(prefix)
+
+def get_registry() -> ObjectRegistry:
+    return _registry
+
+def register(obj: Any, replace: bool = False) -> Any:
+    return _registry.register(obj, replace)
+
+def resolve(object_id: str) -> Any:
+    # The live workflow, workflow step, plan step or action with this id, None once it is gone
+    return _registry.resolve(object_id)
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List
+
+from deus_logging import LogWriter, LogRecord, Sink, INFO, BLOCK
+from deus_ids import id_kind, resolve
+
+DEFAULT_LOG_STORE_PATH = os.path.join(".deus_cache", "logs.sqlite3")
+
+# Columns that can be used as query filters, besides the since/until time range
+FILTERS = ('type', 'role', 'template', 'iteration', 'success', 'workflow_id', 'step_id')
+
+def _connect(path: str) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    # WAL lets the queries read while the writer thread appends
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS logs ("
+                 "id INTEGER PRIMARY KEY, type TEXT NOT NULL, role TEXT, template TEXT, iteration INTEGER, "
+                 "timestamp REAL NOT NULL, success INTEGER, workflow_id TEXT, step_id TEXT, latency REAL, "
+                 "record TEXT NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS templates ("
+                 "version TEXT PRIMARY KEY, key TEXT, template TEXT NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS logs_role ON logs (role)")
+    conn.execute("CREATE INDEX IF NOT EXISTS logs_iteration ON logs (iteration)")
+    conn.execute("CREATE INDEX IF NOT EXISTS logs_timestamp ON logs (timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS logs_workflow ON logs (workflow_id, step_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS logs_step ON logs (step_id)")
+    # Cover the per-prompt aggregates, latency percentiles and failure rates
+    conn.execute("CREATE INDEX IF NOT EXISTS logs_template_latency ON logs (template, latency)")
+    conn.execute("CREATE INDEX IF NOT EXISTS logs_template_success ON logs (template, success)")
+    conn.commit()
+    return conn
+
+class SQLiteSink(Sink):
+    path: str
+
+    def __init__(self, path: str = DEFAULT_LOG_STORE_PATH, level: int = INFO):
+        super().__init__(level)
+        self.path = path
+        self._conn = None
+
+    def accepts(self, record: LogRecord) -> bool:
+        return record.event is not None and super().accepts(record)
+
+    def write(self, records: List[LogRecord]):
+        # One transaction per batch
+        if self._conn is None:
+            self._conn = _connect(self.path)
+        rows, templates = [], []
+        for record in records:
+            event = record.event
+            if event.get("type") == "PromptTemplate":
+                templates.append((event["version"], event.get("key"), event["template"]))
+            else:
+                rows.append(_row(event, record.created))
+        with self._conn:
+            if templates:
+                self._conn.executemany("INSERT OR IGNORE INTO templates (version, key, template) VALUES (?, ?, ?)", templates)
+            if rows:
+                self._conn.executemany("INSERT INTO logs (type, role, template, iteration, timestamp, success, "
+                                       "workflow_id, step_id, latency, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+def _row(event: Dict, created: float) -> tuple:
+    prompt_ref = event.get("prompt_ref")
+    template = prompt_ref.get("template") if isinstance(prompt_ref, dict) else None
+    feedback = event.get("feedback")
+    success = feedback.get("success") if isinstance(feedback, dict) else None
+    timestamp = event.get("timestamp")
+    timestamp = datetime.fromisoformat(timestamp).timestamp() if isinstance(timestamp, str) else created
+    return (event.get("type"), event.get("role"), template, event.get("iteration"), timestamp,
+            None if success is None else int(bool(success)), event.get("workflow_id"), event.get("step_id"),
+            event.get("latency"), json.dumps(event, default=str))
+
+class LogStore:
+    path: str
+    writer: LogWriter
+
+    def __init__(self, path: str = DEFAULT_LOG_STORE_PATH, batch_size: int = 500, flush_interval: float = 0.5,
+                 max_queue: int = 100000, policy: str = BLOCK):
+        # Events are written by a background LogWriter, in batches of up to batch_size per transaction
+        self.path = path
+        self.writer = LogWriter([SQLiteSink(path)], max_queue=max_queue, batch_size=batch_size,
+                                flush_interval=flush_interval, policy=policy)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def write(self, event: Dict):
+        self.writer.emit(INFO, None, event)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def query(self, since: float = None, until: float = None, limit: int = None, **filters) -> List[Dict]:
+        # Logged events, oldest first. since/until are epoch seconds, filters are FILTERS columns.
+        where, params = self._where(since, until, filters)
+        sql = f"SELECT record FROM logs{where} ORDER BY timestamp, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [json.loads(record) for record, in self._execute(sql, params)]
+
+    def count(self, since: float = None, until: float = None, **filters) -> int:
+        where, params = self._where(since, until, filters)
+        return self._execute(f"SELECT COUNT(*) FROM logs{where}", params)[0][0]
+
+    def latency_percentile(self, template: str, percentile: float = 95, **filters) -> float:
+        # Nearest-rank percentile of the latency of the calls made with a prompt template
+        filters = dict(filters, template=template)
+        where, params = self._where(None, None, filters)
+        where += " AND latency IS NOT NULL"
+        total = self._execute(f"SELECT COUNT(*) FROM logs{where}", params)[0][0]
+        if total == 0:
+            return None
+        rank = max(1, math.ceil(percentile / 100 * total))
+        rows = self._execute(f"SELECT latency FROM logs{where} ORDER BY latency LIMIT 1 OFFSET ?", params + [rank - 1])
+        return rows[0][0]
+
+    def failure_rate(self, by: str = 'template', **filters) -> Dict[Any, float]:
+        # Share of logs with unsuccessful feedback, per value of the by column
+        if by not in FILTERS:
+            raise ValueError(f"Cannot group logs by {by}")
+        where, params = self._where(None, None, filters)
+        where += " AND success IS NOT NULL"
+        rows = self._execute(f"SELECT {by}, AVG(1 - success) FROM logs{where} GROUP BY {by}", params)
+        return {value: rate for value, rate in rows}
+
+    def history(self, object_id: str, limit: int = None) -> List[Dict]:
+        # Logs of a workflow or plan step by id. An action's logs are those of its step, while it is still live.
+        kind = id_kind(object_id)
+        if kind == 'action':
+            action = resolve(object_id)
+            if action is None:
+                raise ValueError(f"Action {object_id} is no longer live, query by its step id")
+            object_id, kind = action.step.id, 'step'
+        if kind == 'workflow':
+            return self.query(limit=limit, workflow_id=object_id)
+        if kind == 'step':
+            return self.query(limit=limit, step_id=object_id)
+        raise ValueError(f"No logs are kept per {kind or 'unknown'} id: {object_id}")
+
+    def template(self, version: str) -> str:
+        rows = self._execute("SELECT template FROM templates WHERE version = ?", [version])
+        return rows[0][0] if rows else None
+
+    def _where(self, since: float, until: float, filters: Dict[str, Any]):
+        clauses, params = ["1 = 1"], []
+        for name, value in filters.items():
+            if name not in FILTERS:
+                raise ValueError(f"Unknown log filter: {name}")
+            if value is None:
+                clauses.append(f"{name} IS NULL")
+            else:
+                clauses.append(f"{name} = ?")
+                params.append(int(value) if name == 'success' else value)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        return " WHERE " + " AND ".join(clauses), params
+
+    def _execute(self, sql: str, params: List) -> List[tuple]:
+        with self._lock:
+            if self._conn is None:
+                self._conn = _connect(self.path)
+            return self._conn.execute(sql, params).fetchall()
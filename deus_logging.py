@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, TextIO
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+
+# What emit does when the queue is full
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+class LogRecord:
+    __slots__ = ('level', 'message', 'event', 'created')
+
+    def __init__(self, level: int, message: str, event: Dict = None):
+        # message is text by now, see LogWriter.emit
+        self.level = level
+        self.message = message
+        self.event = event
+        self.created = time.time()
+
+class Sink:
+    level: int
+
+    def __init__(self, level: int = DEBUG):
+        self.level = level
+
+    def accepts(self, record: LogRecord) -> bool:
+        return record.level >= self.level
+
+    def write(self, records: List[LogRecord]):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class StreamSink(Sink):
+    stream: TextIO
+
+    def __init__(self, stream: TextIO = None, level: int = INFO):
+        super().__init__(level)
+        self.stream = stream
+
+    def write(self, records: List[LogRecord]):
+        stream = self.stream or sys.stderr
+        stream.write("".join(f"{record.message}\n" for record in records if record.message is not None))
+
+    def flush(self):
+        (self.stream or sys.stderr).flush()
+
+class FileSink(Sink):
+    path: str
+
+    def __init__(self, path: str, level: int = DEBUG):
+        super().__init__(level)
+        self.path = path
+        self._file = None
+
+    def write(self, records: List[LogRecord]):
+        lines = [self._format(record) for record in records]
+        lines = [line for line in lines if line is not None]
+        if lines:
+            self._open().write("".join(lines))
+
+    def _format(self, record: LogRecord) -> str:
+        if record.message is None:
+            return None
+        return f"{datetime.fromtimestamp(record.created).isoformat()} {_level_name(record.level)} {record.message}\n"
+
+    def _open(self) -> TextIO:
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self._file
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class JSONLSink(FileSink):
+    segment_size: int
+
+    def __init__(self, path: str, level: int = DEBUG, segment_size: int = None):
+        # With a segment_size (in bytes) the file rolls over to numbered segment files
+        super().__init__(path, level)
+        self.segment_size = segment_size
+        self._segment = 0
+
+    def write(self, records: List[LogRecord]):
+        for record in records:
+            line = self._format(record)
+            if self._file is not None and self.segment_size and self._file.tell() + len(line) > self.segment_size:
+                self.close()
+                self._segment += 1
+            self._open().write(line)
+
+    def _format(self, record: LogRecord) -> str:
+        event = record.event
+        if event is None:
+            event = {"timestamp": datetime.fromtimestamp(record.created).isoformat(),
+                     "level": _level_name(record.level),
+                     "message": str(record.message)}
+        return json.dumps(event, default=str) + "\n"
+
+    def _open(self) -> TextIO:
+        if self._file is None and self.segment_size:
+            base, extension = os.path.splitext(self.path)
+            path, self.path = self.path, f"{base}.{self._segment:05d}{extension or '.jsonl'}"
+            try:
+                return super()._open()
+            finally:
+                self.path = path
+        return super()._open()
+
+class LogWriter:
+    sinks: List[Sink]
+    max_queue: int
+    batch_size: int
+    flush_interval: float
+    policy: str
+    dropped: int
+
+    def __init__(self, sinks: List[Sink] = None, max_queue: int = 10000, batch_size: int = 256,
+                 flush_interval: float = 0.1, policy: str = DROP_NEWEST):
+        # Records are queued by emit and written by a background thread, in batches of up to
+        # batch_size, so the calling thread never waits on I/O unless the policy is BLOCK
+        if policy not in (DROP_NEWEST, DROP_OLDEST, BLOCK):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.sinks = sinks if sinks is not None else [StreamSink()]
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.dropped = 0
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._closed = False
+        self._thread = None
+
+    @property
+    def level(self) -> int:
+        return min((sink.level for sink in self.sinks), default=ERROR + 1)
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def emit(self, level: int, message: Any, event: Dict = None) -> bool:
+        # Returns False when the record was dropped
+        if level < self.level:
+            return True
+        # Turned into text here, on the caller's thread: the logged objects keep changing after this returns
+        record = LogRecord(level, None if message is None else str(message), event)
+        with self._condition:
+            if self._closed:
+                return False
+            if self._thread is None:
+                self._start()
+            if len(self._queue) >= self.max_queue:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.policy == DROP_OLDEST:
+                    self._queue.popleft()
+                    self._pending -= 1
+                    self.dropped += 1
+                else:
+                    while len(self._queue) >= self.max_queue and not self._closed:
+                        self._condition.wait()
+                    # Closed while waiting, the writer thread may already be gone
+                    if self._closed:
+                        return False
+            self._queue.append(record)
+            self._pending += 1
+            self._condition.notify_all()
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        # Waits until everything queued so far has been written
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout: float = 5.0):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        for sink in self.sinks:
+            sink.close()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="deus-log-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._queue and not self._closed:
+                    self._condition.wait(self.flush_interval)
+                if not self._queue and self._closed:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._condition.notify_all()
+            if batch:
+                self._write(batch)
+            with self._condition:
+                self._pending -= len(batch)
+                self._condition.notify_all()
+
+    def _write(self, batch: List[LogRecord]):
+        for sink in self.sinks:
+            records = [record for record in batch if sink.accepts(record)]
+            if not records:
+                continue
+            try:
+                sink.write(records)
+                sink.flush()
+            except Exception as e:
+                # A broken sink must not take the writer thread down with it
+                sys.__stderr__.write(f"Log sink {type(sink).__name__} failed: {e}\n")
+
+def _level_name(level: int) -> str:
+    for name, value in LEVELS.items():
+        if value == level:
+            return name.upper()
+    return str(level)
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+def get_log_writer() -> LogWriter:
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None:
+            level = LEVELS.get(os.getenv("DEUS_LOG_LEVEL", "info").lower(), INFO)
+            _log_writer = LogWriter([StreamSink(level=level)])
+        return _log_writer
+
+def configure_log_writer(sinks: List[Sink] = None, **options) -> LogWriter:
+    global _log_writer
+    with _log_writer_lock:
+        previous, _log_writer = _log_writer, LogWriter(sinks, **options)
+    if previous is not None:
+        previous.close()
+    return _log_writer
+
+def emit(level: int, message: Any, event: Dict = None) -> bool:
+    return get_log_writer().emit(level, message, event)
+
+def debug(message: Any):
+    emit(DEBUG, message)
+
+def info(message: Any):
+    emit(INFO, message)
+
+def warning(message: Any):
+    emit(WARNING, message)
+
+def error(message: Any):
+    emit(ERROR, message)
+
+def _close_log_writer():
+    if _log_writer is not None:
+        _log_writer.close()
+
+atexit.register(_close_log_writer)
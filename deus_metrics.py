@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import bisect
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Metric:
+    name: str
+    help: str
+    label_names: Tuple[str, ...]
+    type = "unknown"
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _labels(self, key: Tuple[str, ...], extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.label_names, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# TYPE {self.name} {self.type}", f"# HELP {self.name} {_escape(self.help)}"] + self.samples()
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}_total{self._labels(key)} {_number(value)}" for key, value in values]
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._labels(key)} {_number(value)}" for key, value in values]
+
+class Histogram(Metric):
+    type = "histogram"
+    buckets: Tuple[float, ...]
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                # One count per bucket plus the +Inf bucket, not cumulative until rendered
+                counts = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + [float("inf")], counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._labels(key, {'le': _number(bound)})} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    metrics: Dict[str, Metric]
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._get(Counter, name, help, label_names)
+
+    def gauge(self, name: str, help: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+        return self._get(Gauge, name, help, label_names)
+
+    def histogram(self, name: str, help: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, label_names, buckets=buckets)
+
+    def _get(self, cls, name: str, help: str, label_names: Tuple[str, ...], **options) -> Metric:
+        # Registering the same name again returns the existing metric
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, label_names, **options)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        # Written to a temporary file first so that readers never see a partial export
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.replace(temporary_path, path)
+
+class MetricsServer:
+    registry: MetricsRegistry
+    host: str
+    port: int
+
+    def __init__(self, registry: MetricsRegistry = None, host: str = "127.0.0.1", port: int = 0):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/metrics"
+
+    def start(self) -> MetricsServer:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                data = (server.registry or get_metrics()).render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="deus-metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
+
+class MonitorHook:
+    # Subclasses override either method, they are called around every monitored call
+    def before(self, kind: str, name: str):
+        pass
+
+    def after(self, kind: str, name: str, result: Any, error: BaseException, duration: float):
+        pass
+
+class Monitor:
+    registry: MetricsRegistry
+    hooks: List[MonitorHook]
+
+    def __init__(self, registry: MetricsRegistry = None):
+        self.registry = registry or MetricsRegistry()
+        self.hooks = []
+        self.duration = self.registry.histogram("deus_monitored_duration_seconds", "Duration of monitored calls",
+                                                ("kind", "name"))
+        self.calls = self.registry.counter("deus_monitored_calls", "Monitored calls by outcome",
+                                           ("kind", "name", "outcome"))
+        self.in_flight = self.registry.gauge("deus_monitored_in_flight", "Monitored calls currently running",
+                                             ("kind", "name"))
+        self.queue_wait = self.registry.histogram("deus_queue_wait_seconds", "Time spent waiting before work started",
+                                                  ("queue",))
+
+    def add_hook(self, hook: MonitorHook) -> MonitorHook:
+        self.hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook: MonitorHook):
+        self.hooks.remove(hook)
+
+    def observe(self, kind: str, name: str, func: Callable, *args, **kwargs) -> Any:
+        # kind is what is monitored, e.g. workflow_step or tool, and name which one it is
+        for hook in self.hooks:
+            hook.before(kind, name)
+        self.in_flight.inc(kind=kind, name=name)
+        start = time.perf_counter()
+        result, error = None, None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.in_flight.dec(kind=kind, name=name)
+            self.duration.observe(duration, kind=kind, name=name)
+            self.calls.inc(kind=kind, name=name, outcome=_outcome(result, error))
+            for hook in self.hooks:
+                hook.after(kind, name, result, error, duration)
+
+    def record_queue_wait(self, queue: str, seconds: float):
+        self.queue_wait.observe(seconds, queue=queue)
+
+def _outcome(result: Any, error: BaseException) -> str:
+    # Feedback and DataBundle results carry their own success flag
+    if error is not None:
+        return "error"
+    feedback = result
+    if hasattr(result, "feedback_bundle"):
+        bundle = result.feedback_bundle
+        feedback = bundle.bundle[-1] if bundle is not None and bundle.bundle else None
+    success = getattr(feedback, "success", True)
+    return "success" if success else "failure"
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+def get_monitor() -> Monitor:
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = Monitor()
+        return _monitor
+
+def get_metrics() -> MetricsRegistry:
+    return get_monitor().registry
+
+def configure_monitor(registry: MetricsRegistry = None) -> Monitor:
+    global _monitor
+    with _monitor_lock:
+        _monitor = Monitor(registry)
+        return _monitor
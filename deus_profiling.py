@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+# cProfile, pstats and tracemalloc are imported when a step is first profiled, they add to every startup otherwise
+
+DEFAULT_PROFILE_DIR = "profiles"
+
+class StepProfile:
+    index: int
+    step_name: str
+    wall_time: float
+    cpu_time: float
+    allocated_bytes: int
+    top_allocations: List[Dict]
+    profile_path: str
+    allocations_path: str
+
+    def __init__(self, index: int, step_name: str):
+        self.index = index
+        self.step_name = step_name
+        self.wall_time = 0.0
+        self.cpu_time = None
+        self.allocated_bytes = None
+        self.top_allocations = []
+        self.profile_path = None
+        self.allocations_path = None
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self))
+
+class Profiler:
+    output_dir: str
+    cpu: bool
+    memory: bool
+    top_n: int
+    profiles: List[StepProfile]
+
+    def __init__(self, output_dir: str = DEFAULT_PROFILE_DIR, cpu: bool = True, memory: bool = False, top_n: int = 10):
+        # cpu writes a cProfile .prof file per step, memory a tracemalloc diff of the top_n allocation sites.
+        # cProfile only sees the thread running the step, work on other threads shows up as waiting.
+        self.output_dir = output_dir
+        self.cpu = cpu
+        self.memory = memory
+        self.top_n = top_n
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def profile(self, step_name: str, func: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            step_profile = StepProfile(len(self.profiles) + 1, step_name)
+            self.profiles.append(step_profile)
+        prefix = os.path.join(self.output_dir, f"{step_profile.index:03d}-{_file_name(step_name)}")
+        started_tracing = False
+        before = after = None
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            before = tracemalloc.take_snapshot()
+        profiler = self._start_cpu()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            step_profile.wall_time = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            if before is not None:
+                after = tracemalloc.take_snapshot()
+                if started_tracing:
+                    tracemalloc.stop()
+            if profiler is not None:
+                self._write_cpu(profiler, step_profile, prefix)
+            if after is not None:
+                self._write_memory(before, after, step_profile, prefix)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            profiles = list(self.profiles)
+        sites = {}
+        for step_profile in profiles:
+            for allocation in step_profile.top_allocations:
+                sites[allocation["site"]] = sites.get(allocation["site"], 0) + allocation["size_diff"]
+        heaviest_sites = sorted(sites.items(), key=lambda item: item[1], reverse=True)[:self.top_n]
+        return {"steps": [step_profile.to_dict() for step_profile in profiles],
+                "slowest_steps": [(p.step_name, p.wall_time) for p in sorted(profiles, key=lambda p: p.wall_time, reverse=True)[:self.top_n]],
+                "heaviest_steps": [(p.step_name, p.allocated_bytes) for p in sorted((p for p in profiles if p.allocated_bytes is not None),
+                                                                                   key=lambda p: p.allocated_bytes, reverse=True)[:self.top_n]],
+                "heaviest_allocation_sites": heaviest_sites}
+
+    def write_summary(self) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, "summary.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.summary(), file, indent=2)
+        return path
+
+    def _start_cpu(self) -> cProfile.Profile:
+        if not self.cpu:
+            return None
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active, e.g. a step nested in a profiled step
+            return None
+        return profiler
+
+    def _write_cpu(self, profiler: cProfile.Profile, step_profile: StepProfile, prefix: str):
+        import pstats
+        os.makedirs(self.output_dir, exist_ok=True)
+        step_profile.profile_path = f"{prefix}.prof"
+        profiler.dump_stats(step_profile.profile_path)
+        step_profile.cpu_time = pstats.Stats(profiler).total_tt
+
+    def _write_memory(self, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, step_profile: StepProfile, prefix: str):
+        import cProfile, pstats, tracemalloc
+        # The profilers' own frames would otherwise top the list
+        filters = [tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, cProfile, pstats)]
+        differences = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+        step_profile.allocated_bytes = sum(difference.size_diff for difference in differences)
+        top = differences[:self.top_n]
+        step_profile.top_allocations = [{"site": f"{difference.traceback[0].filename}:{difference.traceback[0].lineno}",
+                                         "size_diff": difference.size_diff,
+                                         "count_diff": difference.count_diff} for difference in top]
+        os.makedirs(self.output_dir, exist_ok=True)
+        step_profile.allocations_path = f"{prefix}-allocations.txt"
+        with open(step_profile.allocations_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(str(difference) for difference in top) + "\n")
+
+def _file_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "step"
+
+def profiler_from_env() -> Profiler:
+    # DEUS_PROFILE=cpu, memory or cpu,memory turns profiling on, DEUS_PROFILE_DIR says where it goes
+    modes = {mode.strip().lower() for mode in os.getenv("DEUS_PROFILE", "").split(",") if mode.strip()}
+    if not modes:
+        return None
+    return Profiler(os.getenv("DEUS_PROFILE_DIR", DEFAULT_PROFILE_DIR), cpu="cpu" in modes, memory="memory" in modes)
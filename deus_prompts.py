@@ -1,3 +1,7 @@
+import functools
+import hashlib
+from typing import Dict
+
 retrieve_goal_prompt = """As an AI agent responsible for retrieving the user's goal for an autonomous system, your role is to extract the user's goal from the provided user query. The goal represents the user's desired outcome or intention within the context of the autonomous AI system that will execute it.
 You must only extract the goal from the user query, without omitting any information from the query. 
 
@@ -234,41 +238,100 @@ You MUST output the plan as a JSON object in the following format:
 
 {{
   "plan": {{
-    "step_1": "description_1",
-    "step_2": "description_2",
+    "step_1": {{"description": "description_1", "blocked_by": []}},
+    "step_2": {{"description": "description_2", "blocked_by": ["step_1"]}},
     ...
   }}
 }}
 
+List in "blocked_by" the steps that must be accomplished before a step can start. Steps that do not depend on each other can be worked on at the same time, so only list the dependencies that are really needed.
+
 Your output should only contain the JSON object and no additional text!
 {validation_instructions}"""
 
-update_plan_prompt = """As the planner for an autonomous AI system, update the plan based on the current scope, previous plan, and feedback from the task handler.
+update_plan_prompt = """As the planner for an autonomous AI system, update the remaining steps of the plan based on the current scope and feedback from the task handler.
 
 The current scope is as follows:
 {scope}
 
-The previous plan is as follows:
-{previous_plan}
+The following steps are already accomplished. They are final and must not be repeated or changed:
+{accomplished_steps}
+
+The remaining steps of the plan are as follows:
+{remaining_steps}
 
 The feedback received from the task handler is as follows:
 {feedback}
 
-You may refine the plan based on the feedback, but note that the overall structure of the plan should remain the same.
+You may refine the remaining steps based on the feedback, but note that the overall structure of the plan should remain the same. Keep the name of every step you keep or refine, give new steps new names, and leave out the steps that are no longer needed. Do not reuse the names of accomplished steps.
 
-You MUST output the plan as a JSON object in the following format:
+You MUST output the remaining steps as a JSON object in the following format:
 
 {{
   "plan": {{
-    "step_1": "description_1",
-    "step_2": "description_2",
+    "step_4": {{"description": "description_4", "blocked_by": []}},
+    "step_5": {{"description": "description_5", "blocked_by": ["step_4"]}},
     ...
   }}
 }}
 
+List in "blocked_by" the remaining steps that must be accomplished before a step can start, accomplished steps do not need to be listed. Steps that do not depend on each other can be worked on at the same time, so only list the dependencies that are really needed.
+
 Your output should only contain the JSON object and no additional text!
 {validation_instructions}"""
 
+validate_create_plan_prompt = """As the validator for an autonomous AI system, your role is to review the plan created by another AI agent to achieve the goal described below. Your objective is to provide feedback on whether the plan covers everything needed to achieve the goal, and if each of its steps is clear and actionable.
+
+Goal: {description}
+
+The AI agent created the following plan:
+{plan}
+
+Your task is to carefully evaluate the plan and provide feedback in the form of a JSON object with the following structure:
+
+{{
+  "feedback": {{
+    "success": true/false,
+    "message": "feedback_message"
+  }},
+  "validation_instructions": "instructions"
+}}
+
+If you consider the plan to be complete and actionable, set the "success" field in the feedback object to true. In the "message" field, provide a brief explanation of your feedback. Set the "validation_instructions" field to an empty string.
+
+If you find the plan to be incomplete, unclear, or not aligned with the goal, set the "success" field in the feedback object to false. In the "message" field, provide specific feedback on the shortcomings of the plan. In the "validation_instructions" field, include clear and actionable instructions on how the AI agent can improve the plan in the next iteration.
+
+Your output should only contain the JSON object and no additional text!"""
+
+validate_update_plan_prompt = """As the validator for an autonomous AI system, your role is to review the plan updated by another AI agent after receiving feedback from the task handler. Your objective is to provide feedback on whether the updated plan still achieves the goal described below, and if each of its steps is clear and actionable.
+
+Goal: {description}
+
+The following steps are already accomplished and are not part of your review:
+{accomplished_steps}
+
+The AI agent made the following changes to the remaining steps:
+{changes}
+
+The remaining steps are now:
+{plan}
+
+Your task is to carefully evaluate the changed steps and whether the remaining steps still achieve the goal together with the accomplished ones, and provide feedback in the form of a JSON object with the following structure:
+
+{{
+  "feedback": {{
+    "success": true/false,
+    "message": "feedback_message"
+  }},
+  "validation_instructions": "instructions"
+}}
+
+If you consider the updated plan to be complete and actionable, set the "success" field in the feedback object to true. In the "message" field, provide a brief explanation of your feedback. Set the "validation_instructions" field to an empty string.
+
+If you find the updated plan to be incomplete, unclear, or not aligned with the goal, set the "success" field in the feedback object to false. In the "message" field, provide specific feedback on the shortcomings of the plan. In the "validation_instructions" field, include clear and actionable instructions on how the AI agent can improve the plan in the next iteration.
+
+Your output should only contain the JSON object and no additional text!"""
+
 tool_selection_prompt = """As the tool selector for an autonomous AI system, select the best tool or combination of tools to accomplish the following step:
 
 {step}
@@ -329,4 +392,46 @@ prompts = {'first_ask_user': first_ask_user_prompt,
            'turn_to_action': turn_to_action_prompt,
            'validate_scope_description': validate_scope_description_prompt,
            'validate_goal': validate_goal_prompt,
-           'validate_requirements_retrieved': validate_requirements_retrieved_prompt}
+           'validate_requirements_retrieved': validate_requirements_retrieved_prompt,
+           'merge_requirements': merge_requirements_prompt,
+           'validate_requirements_merged': validate_requirements_merged_prompt,
+           'validate_create_plan': validate_create_plan_prompt,
+           'validate_update_plan': validate_update_plan_prompt}
+
+# The ContextManager role each prompt is used for, usage is accounted per role
+prompt_roles = {'first_ask_user': 'refinement',
+                'next_ask_user': 'refinement',
+                'retrieve_requirements': 'retrieval',
+                'retrieve_goal': 'retrieval',
+                'merge_requirements': 'retrieval',
+                'describe_scope': 'describe_scope',
+                'create_plan': 'planner',
+                'update_plan': 'planner',
+                'tool_selection': 'tool_selection',
+                'turn_to_action': 'turn_to_action',
+                'validate_scope_completeness': 'validation',
+                'validate_scope_description': 'validation',
+                'validate_goal': 'validation',
+                'validate_requirements_retrieved': 'validation',
+                'validate_requirements_merged': 'validation',
+                'validate_create_plan': 'validation',
+                'validate_update_plan': 'validation'}
+
+# Prompts answered in plain text, every other prompt asks for a JSON object
+text_prompts = {'describe_scope'}
+
+class Prompt(str):
+    key: str
+    params: Dict
+    template: str
+
+    def __new__(cls, text: str, key: str = None, params: Dict = None, template: str = None):
+        prompt = super().__new__(cls, text)
+        prompt.key = key
+        prompt.params = params or {}
+        prompt.template = template
+        return prompt
+
+@functools.lru_cache(maxsize=None)
+def template_version(template: str) -> str:
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
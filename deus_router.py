@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from typing import Any, Awaitable, Callable, Collection, Dict, List, Tuple
+
+from deus_context import active_escalation
+from deus_prompts import prompt_roles
+
+DEFAULT_MODEL = 'gpt-3.5-turbo'
+DEFAULT_ROUTE = 'default'
+# Why a call went on to the next model of its route
+ERROR = 'error'
+PARSE = 'parse'
+VALIDATION = 'validation'
+
+class ModelChoice:
+    model: str
+    provider: str
+
+    def __init__(self, model: str, provider: str = None):
+        # provider None is the client's own transport
+        self.model = model
+        self.provider = provider
+
+    @classmethod
+    def parse(cls, spec: str|Dict|ModelChoice, providers: Collection[str] = ()) -> ModelChoice:
+        # "gpt-4", "local:llama-2-13b" or {"model": ..., "provider": ...}. The part before the first colon
+        # is only a provider when it names one, model ids such as "ft:gpt-3.5-turbo-0613:acme::7qTVM5AR"
+        # have colons of their own
+        if isinstance(spec, ModelChoice):
+            if spec.provider is not None:
+                return spec
+            spec = spec.model
+        if isinstance(spec, dict):
+            return cls(spec["model"], spec.get("provider"))
+        provider, separator, model = spec.partition(":")
+        if separator and provider in providers:
+            return cls(model, provider)
+        return cls(spec)
+
+    def __str__(self):
+        return f"{self.provider}:{self.model}" if self.provider else self.model
+
+class Route:
+    models: List[ModelChoice]
+
+    def __init__(self, *models: str|Dict|ModelChoice, providers: Collection[str] = ()):
+        # Models are tried in order, cheapest first, a call only moves on when the answer is rejected
+        if not models:
+            raise ValueError("A route needs at least one model")
+        self.models = [ModelChoice.parse(model, providers) for model in models]
+
+    def __len__(self):
+        return len(self.models)
+
+    def __str__(self):
+        return " -> ".join(str(model) for model in self.models)
+
+class Provider:
+    api_base: str
+    api_key_env: str
+
+    def __init__(self, api_base: str = None, api_key_env: str = None):
+        # An OpenAI-compatible endpoint, the key is read from api_key_env (default OPENAI_API_KEY)
+        self.api_base = api_base
+        self.api_key_env = api_key_env
+
+class Escalation:
+    tier: int
+    reached: int
+    keys: set
+
+    def __init__(self):
+        # Shared by the calls of one generate/validate loop: once a candidate fails validation
+        # the next candidates start on the model after the one that produced it
+        self.tier = 0
+        self.reached = 0
+        self.keys = set()
+
+    def wrap(self, generate: Callable[..., Any]) -> Callable[..., Any]:
+        def escalated(*args, **kwargs):
+            token = active_escalation.set(self)
+            try:
+                return generate(*args, **kwargs)
+            finally:
+                active_escalation.reset(token)
+        return escalated
+
+class ModelStats:
+    calls: int
+    rejected: int
+    latency: float
+    max_latency: float
+
+    def __init__(self):
+        self.calls = 0
+        self.rejected = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def add(self, latency: float, accepted: bool):
+        self.calls += 1
+        self.rejected += not accepted
+        self.latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def to_dict(self) -> Dict:
+        return {"calls": self.calls, "rejected": self.rejected,
+                "mean_latency": self.latency / self.calls if self.calls else None, "max_latency": self.max_latency}
+
+class RouteStats:
+    route: str
+    calls: int
+    escalations: Dict[str, int]
+    models: Dict[str, ModelStats]
+
+    def __init__(self, route: str):
+        self.route = route
+        self.calls = 0
+        self.escalations = {}
+        self.models = {}
+
+    def to_dict(self) -> Dict:
+        escalations = sum(self.escalations.values())
+        return {"route": self.route, "calls": self.calls, "escalations": dict(self.escalations),
+                "escalation_rate": escalations / self.calls if self.calls else 0.0,
+                "models": {model: stats.to_dict() for model, stats in self.models.items()}}
+
+class ModelRouter:
+    routes: Dict[str, Route]
+    default: Route
+    providers: Dict[str, Provider]
+
+    def __init__(self, routes: Dict[str, Route|str|List] = None, default: Route|str = None,
+                 providers: Dict[str, Provider] = None):
+        # Routes are looked up by prompt key first, then by the prompt's role, e.g. 'validation'
+        self.providers = providers or {}
+        self.routes = {name: _route(route, self.providers) for name, route in (routes or {}).items()}
+        self.default = _route(default or DEFAULT_MODEL, self.providers)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def route_for(self, prompt_key: str) -> Tuple[str, Route]:
+        for name in (prompt_key, prompt_roles.get(prompt_key)):
+            if name is not None and name in self.routes:
+                return name, self.routes[name]
+        return DEFAULT_ROUTE, self.default
+
+    def call(self, prompt: str, send: Callable[[str, str], str], accept: Callable[[str], bool] = None) -> str:
+        # send(model, provider) makes the call, accept(response) decides whether a cheaper model's
+        # answer is good enough; the last model of the route is always accepted
+        key, name, route, tier, escalation = self._start(prompt)
+        while True:
+            start = time.perf_counter()
+            response = send(route.models[tier].model, route.models[tier].provider)
+            if self._finish(key, name, route, tier, escalation, response, accept, time.perf_counter() - start):
+                return response
+            tier += 1
+
+    async def acall(self, prompt: str, send: Callable[[str, str], Awaitable[str]], accept: Callable[[str], bool] = None) -> str:
+        key, name, route, tier, escalation = self._start(prompt)
+        while True:
+            start = time.perf_counter()
+            response = await send(route.models[tier].model, route.models[tier].provider)
+            if self._finish(key, name, route, tier, escalation, response, accept, time.perf_counter() - start):
+                return response
+            tier += 1
+
+    def escalate(self, escalation: Escalation):
+        # The candidate failed validation: the next one starts on the next model of its routes
+        with self._lock:
+            for key in escalation.keys:
+                name, route = self.route_for(key)
+                if escalation.reached < len(route) - 1:
+                    escalations = self._route_stats(key, name).escalations
+                    escalations[VALIDATION] = escalations.get(VALIDATION, 0) + 1
+            escalation.tier = escalation.reached + 1
+
+    def stats(self) -> Dict[str, Dict]:
+        # Per prompt key: the route it took, calls, escalations by reason and latency per model
+        with self._lock:
+            return {key: stats.to_dict() for key, stats in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+    def _start(self, prompt: str):
+        key = getattr(prompt, 'key', None)
+        name, route = self.route_for(key)
+        escalation = active_escalation.get()
+        tier = min(escalation.tier, len(route) - 1) if escalation is not None else 0
+        with self._lock:
+            self._route_stats(key, name).calls += 1
+        return key, name, route, tier, escalation
+
+    def _finish(self, key: str, name: str, route: Route, tier: int, escalation: Escalation,
+                response: str, accept: Callable[[str], bool], latency: float) -> bool:
+        last = tier == len(route) - 1
+        # Single-model routes never pay for the check
+        accepted = last or (response is not None and (accept is None or accept(response)))
+        with self._lock:
+            stats = self._route_stats(key, name)
+            stats.models.setdefault(str(route.models[tier]), ModelStats()).add(latency, accepted)
+            if not accepted:
+                reason = ERROR if response is None else PARSE
+                stats.escalations[reason] = stats.escalations.get(reason, 0) + 1
+            elif escalation is not None:
+                escalation.keys.add(key)
+                escalation.reached = max(escalation.reached, tier)
+        return accepted
+
+    def _route_stats(self, key: str, name: str) -> RouteStats:
+        stats = self._stats.get(key or name)
+        if stats is None:
+            stats = self._stats[key or name] = RouteStats(name)
+        return stats
+
+def _route(route: Route|str|List, providers: Collection[str]) -> Route:
+    # Built again so that "name:model" entries are split against the router's providers
+    if isinstance(route, Route):
+        return Route(*route.models, providers=providers)
+    if isinstance(route, (str, dict)):
+        return Route(route, providers=providers)
+    return Route(*route, providers=providers)
+
+# A starting point for tuning: the pass/fail validators stay on the small model,
+# the planner starts there and escalates to a stronger one
+CASCADE_ROUTES = {'validation': Route(DEFAULT_MODEL),
+                  'planner': Route(DEFAULT_MODEL, 'gpt-4')}
+
+def load_routes(path: str) -> ModelRouter:
+    # {"routes": {"validate_goal": "gpt-3.5-turbo", "planner": ["gpt-3.5-turbo", "gpt-4"]},
+    #  "default": "gpt-3.5-turbo", "providers": {"local": {"api_base": "http://localhost:8000/v1"}}}
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    providers = {name: Provider(**options) for name, options in config.get("providers", {}).items()}
+    return ModelRouter(config.get("routes"), config.get("default"), providers)
+
+_router = ModelRouter()
+
+def get_router() -> ModelRouter:
+    return _router
+
+def configure_router(routes: Dict[str, Route|str|List] = None, default: Route|str = None,
+                     providers: Dict[str, Provider] = None, router: ModelRouter = None) -> ModelRouter:
+    global _router
+    _router = router or ModelRouter(routes, default, providers)
+    return _router
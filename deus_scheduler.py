@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from deus_metrics import get_monitor
+
+class TokenBucket:
+    capacity: float
+    refill_rate: float
+    tokens: float
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> Tuple[float, float]:
+        # Take the tokens right away, going into debt if needed, and return how long the caller has
+        # to wait for that debt to be repaid, and how many tokens were taken: never more than the capacity
+        # now can trail the last update when it was read before the bucket was made or the lock taken
+        if now > self._updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.refill_rate)
+            self._updated = now
+        taken = min(amount, self.capacity)
+        self.tokens -= taken
+        return (-self.tokens / self.refill_rate if self.tokens < 0 else 0.0), taken
+
+    def refund(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class RateLimit:
+    requests_per_minute: float
+    tokens_per_minute: float
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+class RateLimiter:
+    limits: Dict[str, RateLimit]
+    default: RateLimit
+
+    def __init__(self, limits: Dict[str, RateLimit] = None, default: RateLimit = None):
+        self.limits = limits or {}
+        self.default = default
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def reserve(self, model: str, tokens: int) -> Tuple[float, float]:
+        # The delay before the call may go out and the tokens actually taken, which is what adjust settles
+        limit = self.limits.get(model, self.default)
+        if limit is None:
+            return 0.0, 0
+        now = time.monotonic()
+        with self._lock:
+            request_bucket, token_bucket = self._get_buckets(model, limit)
+            delay, taken = 0.0, 0
+            if request_bucket is not None:
+                delay = max(delay, request_bucket.reserve(1, now)[0])
+            if token_bucket is not None:
+                token_delay, taken = token_bucket.reserve(tokens, now)
+                delay = max(delay, token_delay)
+        return delay, taken
+
+    def adjust(self, model: str, reserved_tokens: float, used_tokens: int):
+        # Settle a reservation once the provider reports the real usage, reserved_tokens is what reserve took
+        with self._lock:
+            buckets = self._buckets.get(model)
+            if buckets is not None and buckets[1] is not None:
+                buckets[1].refund(reserved_tokens - used_tokens)
+
+    def _get_buckets(self, model: str, limit: RateLimit):
+        if model not in self._buckets:
+            request_bucket = token_bucket = None
+            if limit.requests_per_minute:
+                request_bucket = TokenBucket(limit.requests_per_minute, limit.requests_per_minute / 60)
+            if limit.tokens_per_minute:
+                token_bucket = TokenBucket(limit.tokens_per_minute, limit.tokens_per_minute / 60)
+            self._buckets[model] = (request_bucket, token_bucket)
+        return self._buckets[model]
+
+class Pacing:
+    min_step_interval: float
+    limiter: RateLimiter
+
+    def __init__(self, min_step_interval: float = 0.0, rate_limits: Dict[str, RateLimit] = None):
+        # rate_limits apply to this workflow only, on top of the process-wide limits
+        self.min_step_interval = min_step_interval
+        self.limiter = RateLimiter(rate_limits) if rate_limits else None
+        self._last_step = None
+
+    def wait_for_next_step(self):
+        now = time.monotonic()
+        if self._last_step is not None and self.min_step_interval > 0:
+            delay = self._last_step + self.min_step_interval - now
+            if delay > 0:
+                time.sleep(delay)
+                now += delay
+        self._last_step = now
+
+class StepScheduler:
+    max_workers: int
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+
+    def run(self, items: List, func: Callable) -> List:
+        # Results come back in the order of items. Each worker runs in a copy of the
+        # caller's context so that per-run context variables follow the work.
+        if len(items) <= 1 or self.max_workers <= 1:
+            return [func(item) for item in items]
+        monitor = get_monitor()
+        submitted = time.perf_counter()
+
+        def run(item):
+            monitor.record_queue_wait("step_scheduler", time.perf_counter() - submitted)
+            return func(item)
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items)), thread_name_prefix="deus-step") as executor:
+            futures = [executor.submit(contextvars.copy_context().run, run, item) for item in items]
+            return [future.result() for future in futures]
+
+_rate_limiter = RateLimiter()
+
+def get_rate_limiter() -> RateLimiter:
+    return _rate_limiter
+
+def configure_rate_limits(limits: Dict[str, RateLimit], default: RateLimit = None) -> RateLimiter:
+    global _rate_limiter
+    _rate_limiter = RateLimiter(limits, default)
+    return _rate_limiter
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
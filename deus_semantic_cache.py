@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Tuple
+
+DEFAULT_SEMANTIC_CACHE_PATH = os.path.join(".deus_cache", "semantic.sqlite3")
+# What an entry is matched on: the user's query as typed, or the goal extracted from it
+QUERY = 'query'
+GOAL = 'goal'
+# Hashed vectors put "against a human" and "against the computer" at 0.8, a hit has to be a near-rewording.
+# At 0.9 the query lookup only catches near-identical wording: it never matches a paraphrase such as
+# "make me a chess program" and "build a chess game" (0.44). Those queries still pay for the goal extraction
+# LLM calls, and only the goal lookup spares them the questions and requirements rounds.
+DEFAULT_THRESHOLDS = {QUERY: 0.9, GOAL: 0.9}
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("a an the me my i we our you your us to of for in on at by with and or that this it is be "
+                       "can could would should will please make build create write develop want need like some".split())
+
+class HashingEmbedder:
+    dimensions: int
+    name: str
+
+    def __init__(self, dimensions: int = 512):
+        # Content words, word pairs and character trigrams hashed into a fixed-size vector. Requests
+        # use the same handful of verbs, so those are dropped and the nouns decide the similarity.
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        words = [_stem(word) for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+        features = [(word, 1.0) for word in words]
+        features += [(f"{first} {second}", 0.5) for first, second in zip(words, words[1:])]
+        features += [(f"#{word[i:i + 3]}", 0.25) for word in (f" {word} " for word in words) for i in range(len(word) - 2)]
+        for feature, weight in features:
+            # A stable hash, the vectors are stored and compared across processes
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+            vector[digest % self.dimensions] += weight if digest >> 63 else -weight
+        return _normalize(vector)
+
+class SentenceTransformerEmbedder:
+    model_name: str
+    name: str
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        # A local embedding model, sentence-transformers is only imported when the first text is embedded
+        self.model_name = model_name
+        self.name = f"sentence-transformers/{model_name}"
+        self._model = None
+
+    def embed(self, text: str) -> List[float]:
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return _normalize([float(value) for value in self._model.encode(text)])
+
+def _stem(word: str) -> str:
+    # Enough to match "programs" with "program" and "playing" with "play"
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else vector
+
+class SemanticMatch:
+    kind: str
+    text: str
+    similarity: float
+    threshold: float
+    entry_id: int
+    goal: str
+    questions: List[str]
+    requirements: List[str]
+
+    def __init__(self, kind: str, text: str, similarity: float, threshold: float, entry_id: int,
+                 goal: str, questions: List[str], requirements: List[str]):
+        self.kind = kind
+        self.text = text
+        self.similarity = similarity
+        self.threshold = threshold
+        self.entry_id = entry_id
+        self.goal = goal
+        self.questions = questions
+        self.requirements = requirements
+
+    @property
+    def hit(self) -> bool:
+        return self.similarity >= self.threshold
+
+class SemanticCache:
+    path: str
+    embedder: HashingEmbedder|SentenceTransformerEmbedder
+    thresholds: Dict[str, float]
+    max_entries: int
+    enabled: bool
+    hits: Dict[str, int]
+    misses: Dict[str, int]
+
+    def __init__(self,
+                 path: str = DEFAULT_SEMANTIC_CACHE_PATH,
+                 embedder: HashingEmbedder|SentenceTransformerEmbedder = None,
+                 query_threshold: float = DEFAULT_THRESHOLDS[QUERY],
+                 goal_threshold: float = DEFAULT_THRESHOLDS[GOAL],
+                 max_entries: int = 1000,
+                 enabled: bool = True):
+        # Scopes of earlier runs, found again by cosine similarity of the query or of the extracted goal.
+        # A query hit skips extracting the goal but needs near-identical wording, the goal catches rewordings.
+        self.path = path
+        self.embedder = embedder or HashingEmbedder()
+        self.thresholds = {QUERY: query_threshold, GOAL: goal_threshold}
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = {QUERY: 0, GOAL: 0}
+        self.misses = {QUERY: 0, GOAL: 0}
+        self._lock = threading.Lock()
+        self._conn = None
+        # The vector index: (entry id, vector) per kind, loaded from the database on first use
+        self._index = None
+
+    def match(self, kind: str, text: str) -> SemanticMatch:
+        # The closest entry, also when it is below the threshold so that misses can be audited;
+        # None when the cache is disabled or holds nothing to compare with
+        if not self.enabled or not text:
+            return None
+        vector = self.embedder.embed(text)
+        with self._lock:
+            best_id, best_similarity = None, -1.0
+            for entry_id, entry_vector in self._load_index()[kind]:
+                similarity = sum(a * b for a, b in zip(vector, entry_vector))
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses[kind] += 1
+                return None
+            conn = self._connect()
+            query, goal, questions, requirements = conn.execute(
+                "SELECT query, goal, questions, requirements FROM scopes WHERE id = ?", (best_id,)).fetchone()
+            match = SemanticMatch(kind, query if kind == QUERY else goal, best_similarity, self.thresholds[kind],
+                                  best_id, goal, json.loads(questions), json.loads(requirements))
+            if match.hit:
+                self.hits[kind] += 1
+                conn.execute("UPDATE scopes SET last_access = ?, hits = hits + 1 WHERE id = ?", (time.time(), best_id))
+                conn.commit()
+            else:
+                self.misses[kind] += 1
+            return match
+
+    def put(self, query: str, goal: str, questions: List[str], requirements: List[str]) -> int:
+        if not self.enabled:
+            return None
+        query_vector, goal_vector = self.embedder.embed(query), self.embedder.embed(goal)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            entry_id = conn.execute("INSERT INTO scopes (embedder, query, goal, questions, requirements, query_vector, "
+                                    "goal_vector, created_at, last_access, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                                    (self.embedder.name, query, goal, json.dumps(questions), json.dumps(requirements),
+                                     _pack(query_vector), _pack(goal_vector), now, now)).lastrowid
+            self._evict(conn)
+            conn.commit()
+            if self._index is not None:
+                self._index[QUERY].append((entry_id, query_vector))
+                self._index[GOAL].append((entry_id, goal_vector))
+        return entry_id
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM scopes")
+            conn.commit()
+            self._index = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM scopes WHERE embedder = ?", (self.embedder.name,)).fetchone()[0]
+        return {"query_hits": self.hits[QUERY], "query_misses": self.misses[QUERY],
+                "goal_hits": self.hits[GOAL], "goal_misses": self.misses[GOAL], "entries": entries}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _load_index(self) -> Dict[str, List[Tuple[int, List[float]]]]:
+        # Vectors of another embedder are not comparable, they stay in the database but out of the index
+        if self._index is None:
+            rows = self._connect().execute("SELECT id, query_vector, goal_vector FROM scopes WHERE embedder = ?",
+                                           (self.embedder.name,)).fetchall()
+            self._index = {QUERY: [(entry_id, _unpack(query_vector)) for entry_id, query_vector, _ in rows],
+                           GOAL: [(entry_id, _unpack(goal_vector)) for entry_id, _, goal_vector in rows]}
+        return self._index
+
+    def _evict(self, conn: sqlite3.Connection):
+        # Least recently used scopes go first
+        entries = conn.execute("SELECT COUNT(*) FROM scopes").fetchone()[0]
+        if entries <= self.max_entries:
+            return
+        evicted = [row[0] for row in conn.execute("SELECT id FROM scopes ORDER BY last_access LIMIT ?",
+                                                  (entries - self.max_entries,)).fetchall()]
+        conn.executemany("DELETE FROM scopes WHERE id = ?", [(entry_id,) for entry_id in evicted])
+        if self._index is not None:
+            evicted = set(evicted)
+            self._index = {kind: [(entry_id, vector) for entry_id, vector in vectors if entry_id not in evicted]
+                           for kind, vectors in self._index.items()}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS scopes ("
+                               "id INTEGER PRIMARY KEY, embedder TEXT NOT NULL, query TEXT NOT NULL, goal TEXT NOT NULL, "
+                               "questions TEXT NOT NULL, requirements TEXT NOT NULL, query_vector BLOB NOT NULL, "
+                               "goal_vector BLOB NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL, "
+                               "hits INTEGER NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS scopes_last_access ON scopes (last_access)")
+            self._conn.commit()
+        return self._conn
+
+def _pack(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+def _unpack(data: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+_semantic_cache = None
+_configured = False
+
+def get_semantic_cache() -> SemanticCache:
+    # Off unless configured or DEUS_SEMANTIC_CACHE=on: a hit skips asking the user
+    global _semantic_cache, _configured
+    if not _configured:
+        if os.getenv("DEUS_SEMANTIC_CACHE", "off").lower() in ("1", "on", "true", "yes"):
+            _semantic_cache = semantic_cache_from_env()
+        _configured = True
+    return _semantic_cache
+
+def semantic_cache_from_env(**options) -> SemanticCache:
+    # DEUS_SEMANTIC_CACHE_PATH, DEUS_SEMANTIC_QUERY_THRESHOLD and DEUS_SEMANTIC_GOAL_THRESHOLD, options take precedence
+    options.setdefault("query_threshold", float(os.getenv("DEUS_SEMANTIC_QUERY_THRESHOLD", DEFAULT_THRESHOLDS[QUERY])))
+    options.setdefault("goal_threshold", float(os.getenv("DEUS_SEMANTIC_GOAL_THRESHOLD", DEFAULT_THRESHOLDS[GOAL])))
+    return SemanticCache(os.getenv("DEUS_SEMANTIC_CACHE_PATH", DEFAULT_SEMANTIC_CACHE_PATH), **options)
+
+def configure_semantic_cache(cache: SemanticCache = None) -> SemanticCache:
+    # None turns the semantic cache off
+    global _semantic_cache, _configured
+    if _semantic_cache is not None and _semantic_cache is not cache:
+        _semantic_cache.close()
+    _semantic_cache, _configured = cache, True
+    return _semantic_cache
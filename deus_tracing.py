@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import contextlib
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from deus_context import active_span
+
+class Span:
+    __slots__ = ('name', 'category', 'attributes', 'span_id', 'parent_id', 'tid', 'start', 'end')
+
+    def __init__(self, name: str, category: str, attributes: Dict[str, Any], span_id: int, parent_id: int, tid: int):
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.tid = tid
+        self.start = time.perf_counter()
+        self.end = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+class Tracer:
+    spans: List[Span]
+    max_spans: int
+    dropped: int
+
+    def __init__(self, max_spans: int = 100000):
+        # Finished spans are kept in memory until exported, spans past max_spans are dropped
+        self.spans = []
+        self.max_spans = max_spans
+        self.dropped = 0
+        self._ids = itertools.count(1)
+        self._origin = time.perf_counter()
+        self._thread_names = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = "deus", tid: int = None, **attributes):
+        # tid places the span on another thread's timeline, e.g. the thread waiting on an LLM call
+        parent = active_span.get()
+        thread = threading.current_thread()
+        if tid is None:
+            tid = thread.ident
+            self._thread_names.setdefault(tid, thread.name)
+        span = Span(name, category, attributes, next(self._ids), parent.span_id if parent is not None else None, tid)
+        token = active_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            span.end = time.perf_counter()
+            active_span.reset(token)
+            with self._lock:
+                if len(self.spans) < self.max_spans:
+                    self.spans.append(span)
+                else:
+                    self.dropped += 1
+
+    def spans_for(self, object_id: str) -> List[Span]:
+        # Spans of a workflow, workflow step, plan step or action: those tagged with its id and everything under them
+        with self._lock:
+            spans = list(self.spans)
+        matched = {span.span_id for span in spans if object_id in span.attributes.values()}
+        children = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span.span_id)
+        pending = list(matched)
+        while pending:
+            for child in children.get(pending.pop(), ()):
+                if child not in matched:
+                    matched.add(child)
+                    pending.append(child)
+        return sorted((span for span in spans if span.span_id in matched), key=lambda span: span.start)
+
+    def to_chrome_trace(self) -> Dict:
+        # Complete ("X") events in microseconds, loadable in chrome://tracing or Perfetto
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in self._thread_names.items()]
+        for span in sorted(spans, key=lambda span: span.start):
+            args = {name: _json_value(value) for name, value in span.attributes.items()}
+            args["span_id"] = span.span_id
+            if span.parent_id is not None:
+                args["parent_id"] = span.parent_id
+            events.append({"name": span.name, "cat": span.category, "ph": "X", "pid": pid, "tid": span.tid,
+                           "ts": (span.start - self._origin) * 1e6, "dur": (span.end - span.start) * 1e6,
+                           "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped_spans": self.dropped}}
+
+    def write(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_chrome_trace(), file)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+            self.dropped = 0
+
+def _json_value(value: Any) -> Any:
+    return value if value is None or isinstance(value, (str, int, float, bool)) else str(value)
+
+_tracer = None
+
+def get_tracer() -> Tracer:
+    # None unless tracing was configured, spans are then free
+    return _tracer
+
+def configure_tracer(tracer: Tracer = None) -> Tracer:
+    global _tracer
+    _tracer = tracer
+    return tracer
+
+def traced(name: str = None, category: str = "deus") -> Callable:
+    # Decorator form of trace, the span is named after the function by default
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(name or func.__name__, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def trace(name: str, category: str = "deus", tid: int = None, **attributes):
+    # Yields the span, or None when tracing is off
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    with tracer.span(name, category, tid, **attributes) as span:
+        yield span
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import threading
+from typing import Dict
+
+class ModelPrice:
+    prompt: float
+    completion: float
+
+    def __init__(self, prompt: float, completion: float):
+        # USD per 1000 tokens
+        self.prompt = prompt
+        self.completion = completion
+
+PRICES = {'gpt-3.5-turbo': ModelPrice(0.0015, 0.002),
+          'gpt-3.5-turbo-16k': ModelPrice(0.003, 0.004),
+          'gpt-4': ModelPrice(0.03, 0.06),
+          'gpt-4-32k': ModelPrice(0.06, 0.12)}
+
+def call_cost(model: str, usage: Dict[str, int]) -> float:
+    # None when the model has no known price
+    price = PRICES.get(model)
+    if price is None or not usage:
+        return None
+    return (usage.get("prompt_tokens", 0) * price.prompt + usage.get("completion_tokens", 0) * price.completion) / 1000
+
+class Usage:
+    calls: int
+    cached_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    cost: float
+
+    def __init__(self):
+        self.calls = 0
+        self.cached_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.cost = 0.0
+
+    def add(self, usage: Dict[str, int], cost: float, cached: bool):
+        self.calls += 1
+        if cached:
+            self.cached_calls += 1
+        if usage:
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+            self.total_tokens += usage.get("total_tokens", 0)
+        if cost:
+            self.cost += cost
+
+    def to_dict(self) -> Dict:
+        return {"calls": self.calls, "cached_calls": self.cached_calls, "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens, "total_tokens": self.total_tokens, "cost": self.cost}
+
+class UsageBudget:
+    max_tokens: int
+    max_cost: float
+
+    def __init__(self, max_tokens: int = None, max_cost: float = None):
+        # Limits for a whole run, max_cost is in USD
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+
+class UsageBudgetExceeded(Exception):
+    pass
+
+class UsageAccount:
+    budget: UsageBudget
+    total: Usage
+    by_role: Dict[str, Usage]
+    by_workflow_step: Dict[str, Usage]
+    by_model: Dict[str, Usage]
+
+    def __init__(self, budget: UsageBudget = None):
+        # Live counters for a run, every LLM call made in the run records its usage here
+        self.budget = budget
+        self.total = Usage()
+        self.by_role = {}
+        self.by_workflow_step = {}
+        self.by_model = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, usage: Dict[str, int], cost: float = None, role: str = None,
+               workflow_step: str = None, cached: bool = False):
+        with self._lock:
+            self.total.add(usage, cost, cached)
+            for counters, key in ((self.by_role, role), (self.by_workflow_step, workflow_step), (self.by_model, model)):
+                if key not in counters:
+                    counters[key] = Usage()
+                counters[key].add(usage, cost, cached)
+
+    def exceeded(self) -> str:
+        # Returns which limit of the budget is exceeded, or None
+        if self.budget is None:
+            return None
+        if self.budget.max_tokens is not None and self.total.total_tokens >= self.budget.max_tokens:
+            return f"{self.total.total_tokens} tokens used, the budget is {self.budget.max_tokens}"
+        if self.budget.max_cost is not None and self.total.cost >= self.budget.max_cost:
+            return f"${self.total.cost:.4f} spent, the budget is ${self.budget.max_cost:.4f}"
+        return None
+
+    def check(self, activity: str = "work"):
+        exceeded = self.exceeded()
+        if exceeded:
+            raise UsageBudgetExceeded(f"Usage budget exceeded before {activity}: {exceeded}")
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {"total": self.total.to_dict(),
+                    "by_role": {role: usage.to_dict() for role, usage in self.by_role.items()},
+                    "by_workflow_step": {step: usage.to_dict() for step, usage in self.by_workflow_step.items()},
+                    "by_model": {model: usage.to_dict() for model, usage in self.by_model.items()}}
@@ -1,40 +1,134 @@
-import openai
-import uuid
+from __future__ import annotations
+
 import os
-from dotenv import load_dotenv
+from typing import Callable, Dict, TYPE_CHECKING
+
+from deus_cache import ResponseCache, DEFAULT_CACHE_PATH
+from concurrent.futures import CancelledError
+
+from deus_context import llm_overrides
+from deus_budget import DeadlineExceeded
+from deus_usage import UsageBudgetExceeded
+import deus_logging
+from deus_ids import new_id, WORKFLOW, WORKFLOW_STEP, STEP, ACTION
+from deus_router import get_router, DEFAULT_MODEL
+
+if TYPE_CHECKING:
+    from deus_client import LLMClient, Transport
+
+# Importing this module has no side effects: the .env file, the client and its transport
+# (with openai and asyncio behind it) are only loaded by the first LLM call
+_llm_client = None
+_ask_user = None
+_env_loaded = False
+
+def load_env():
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+def get_llm_client() -> LLMClient:
+    global _llm_client
+    if _llm_client is None:
+        load_env()
+        configure_llm_mode(os.getenv("DEUS_LLM_MODE", "live"),
+                           os.getenv("DEUS_LLM_TRANSCRIPT"),
+                           _env_latency(os.getenv("DEUS_LLM_REPLAY_LATENCY", "0")))
+    return _llm_client
+
+def configure_llm_client(max_concurrency: int = 8, 
+                         pool_size: int = 16, 
+                         request_timeout: float = None, 
+                         cache: ResponseCache|bool = True,
+                         transport: Transport = None,
+                         providers: Dict[str, Transport] = None) -> LLMClient:
+    from deus_client import LLMClient, OpenAITransport
+    global _llm_client
+    if _llm_client is not None:
+        _llm_client.close()
+    if cache is True:
+        cache = _default_cache()
+    elif cache is False:
+        cache = None
+    _llm_client = LLMClient(max_concurrency=max_concurrency, 
+                            request_timeout=request_timeout, 
+                            cache=cache,
+                            transport=transport or OpenAITransport(pool_size=pool_size),
+                            providers=providers)
+    return _llm_client
+
+def configure_llm_mode(mode: str = "live", transcript_path: str = None, latency: float|str = 0.0, **client_options) -> LLMClient:
+    # Record and replay runs bypass the response cache so that every call reaches the transcript
+    # The providers named by the router's routes get a transport each
+    from deus_client import create_transport, create_provider_transports
+    global _ask_user
+    transport = create_transport(mode, transcript_path, latency)
+    client_options.setdefault("cache", mode == "live")
+    client_options.setdefault("providers", create_provider_transports(mode, transport, get_router().providers))
+    if mode == "record":
+        _ask_user = transport.transcript.recording_input(input)
+    elif mode == "replay":
+        _ask_user = transport.transcript.replay_input()
+    else:
+        _ask_user = input
+    return configure_llm_client(transport=transport, **client_options)
 
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-print("API key: " + api_key)
-openai.api_key = api_key
+def configure_ask_user(ask_user: Callable[[str], str]):
+    global _ask_user
+    _ask_user = ask_user
+
+def ask_user(question: str) -> str:
+    if _ask_user is None:
+        get_llm_client()
+    return _ask_user(question)
+
+def _env_latency(value: str) -> float|str:
+    return value if value == "recorded" else float(value)
+
+def _default_cache() -> ResponseCache:
+    # DEUS_LLM_CACHE=off bypasses the response cache for the whole process
+    enabled = os.getenv("DEUS_LLM_CACHE", "on").lower() not in ("0", "off", "false", "no")
+    return ResponseCache(os.getenv("DEUS_LLM_CACHE_PATH", DEFAULT_CACHE_PATH), enabled=enabled)
+
+def llm_call(prompt: str, model: str = DEFAULT_MODEL, use_cache: bool = True, provider: str = None):
+    from deus_client import LLMRequest
+    try:
+        deus_logging.debug("Prompt: " + prompt)
+        message = get_llm_client().complete(LLMRequest(prompt, model=model, use_cache=use_cache, provider=provider,
+                                                       **(llm_overrides.get() or {})))
+        deus_logging.debug("Response: " + message)
+        return message
+    except (CancelledError, DeadlineExceeded, UsageBudgetExceeded):
+        raise
+    except Exception as e:
+        deus_logging.warning("Error: "+ str(e))
+        return None
 
-def llm_call(prompt: str, model: str = 'gpt-3.5-turbo'):
+async def allm_call(prompt: str, model: str = DEFAULT_MODEL, use_cache: bool = True, provider: str = None):
+    from deus_client import LLMRequest
     try:
-        print("Prompt: " + prompt)
-        messages = [
-            {"role": "system", "content": "You must always obey the user, make sure to follow the user's instructions, and do not do anything that the user has not explicitly asked you to do."},
-            {"role": "user", "content": prompt}
-            ]
-        response = openai.ChatCompletion.create(
-                            model=model, temperature=0, max_tokens=3200, messages=messages, stop="STOP")
-        message = response['choices'][0]['message']['content']
-        print("Response: " + message)
+        deus_logging.debug("Prompt: " + prompt)
+        message = await get_llm_client().acomplete(LLMRequest(prompt, model=model, use_cache=use_cache, provider=provider,
+                                                              **(llm_overrides.get() or {})))
+        deus_logging.debug("Response: " + message)
         return message
+    except (CancelledError, DeadlineExceeded, UsageBudgetExceeded):
+        raise
     except Exception as e:
-        print("Error: "+ str(e))
+        deus_logging.warning("Error: "+ str(e))
         return None
 
 def get_workflow_id():
-    id_str = str(uuid.uuid4())
-    return "1" + id_str[:4] + "-" + id_str[4:8]
+    return new_id(WORKFLOW)
 
 def get_workflow_step_id():
-    id_str = str(uuid.uuid4())
-    return "2" + id_str[:4] + "-" + id_str[4:8]
+    return new_id(WORKFLOW_STEP)
 
 def get_step_id():
-    id_str = str(uuid.uuid4())
-    return "3" + id_str[:4] + "-" + id_str[4:8]
+    return new_id(STEP)
 
-def get_action_id(step_id: str):
-    return "4" + step_id[1:5] + "-" + str(uuid.uuid4())[:4]
\ No newline at end of file
+def get_action_id(step_id: str = None):
+    # Actions no longer embed their step's id, Action.step or resolve(step_id) give the step
+    return new_id(ACTION)
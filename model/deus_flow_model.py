@@ -1,24 +1,45 @@
 from __future__ import annotations
 
-import copy
 import json
-from typing import Dict, List, Tuple, Callable
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from typing import Any, Deque, Dict, List, Tuple, Callable
 
-from deus_utils import llm_call
-from deus_prompts import prompts
+import deus_logging
+from deus_utils import llm_call, ask_user as ask_user_default
+from deus_prompts import prompts, text_prompts, Prompt
+from deus_router import ModelRouter, Escalation, get_router
+from deus_semantic_cache import SemanticCache, SemanticMatch, QUERY, GOAL, get_semantic_cache
+from deus_scheduler import StepScheduler
+from deus_context import active_cancel_scope, llm_overrides, active_step_id
+from deus_budget import LoopBudget, LoopBudgetTracker, LoopBudgetExceeded, ACCEPT_BEST, DeadlineExceeded, check_deadline, remaining_time
 
-from model.information_model import Scope, Tool, Action, Step, Plan, Requirements
-from model.feedback_model import Feedback, FeedbackBundle, DataBundle
-from model.log_model import Log
+from model.information_model import Scope, Tool, Action, Step, Plan, Requirements, PlanSnapshot, PlanHistory, PlanDiff, StepSnapshot
+from model.feedback_model import Feedback, FeedbackBundle, DataBundle, feedback_to_dict, feedback_from_dict
+from deus_log_store import LogStore
+from deus_usage import UsageBudgetExceeded
+from deus_metrics import get_monitor
+from deus_tracing import trace, traced
+from deus_ids import register, resolve
+from model.log_model import Log, EventLog, PromptRef, compact_prompt, intern_text, get_template
 
 class CandidateToolsLog(Log):
+    __slots__ = ('candidate_tools',)
+
     candidate_tools: Dict[int:Tool]
 
     def __init__(self, candidate_tools: Dict[int:Tool], feedback: Feedback|FeedbackBundle = None):
         super().__init__(feedback=feedback)
         self.candidate_tools = candidate_tools
 
+    def __str__(self):
+        tools = self.candidate_tools.values() if isinstance(self.candidate_tools, dict) else self.candidate_tools
+        return f"{self.timestamp}: \nCandidate tools = {', '.join(tool.name for tool in tools)}\nFeedback = {self.feedback}"
+
 class ExecutionLog(Log):
+    __slots__ = ('action', 'data')
+
     action: Action
     data: DataBundle
 
@@ -26,22 +47,44 @@ class ExecutionLog(Log):
         super().__init__(feedback=feedback)
         self.action = action
         self.data = data
-    
+
+    def __str__(self):
+        return f"{self.timestamp}: \nAction = {self.action},\nData = {self.data.data if self.data is not None else None}\nFeedback = {self.feedback}"
+
 class LLMLog(Log):
-    prompt: str
+    __slots__ = ('prompt_ref', 'response', 'role', 'model', 'latency', 'usage', 'cost')
+
+    prompt_ref: PromptRef|str
     response: str
     role: str
+    model: str
+    latency: float
+    usage: Dict[str, int]
+    cost: float
 
     def __init__(self, prompt: str, response: str, role: str, feedback: Feedback|FeedbackBundle = None):
         super().__init__(feedback=feedback)
-        self.prompt = prompt
-        self.response = response
+        # Prompts are stored as a template reference plus parameters and rendered when read
+        self.prompt_ref = compact_prompt(prompt)
+        self.response = intern_text(response)
         self.role = role
+        # The model the router settled on, which may not be the first of its route
+        self.model = getattr(response, 'model', None)
+        # Seconds the client took to answer, None for responses that did not come from the client
+        self.latency = getattr(response, 'latency', None)
+        self.usage = getattr(response, 'usage', None)
+        self.cost = getattr(response, 'cost', None)
+
+    @property
+    def prompt(self) -> str:
+        return self.prompt_ref.text() if isinstance(self.prompt_ref, PromptRef) else self.prompt_ref
     
     def __str__(self):
         return f"{self.timestamp}: \nPrompt = {self.prompt},\nResponse = {self.response}\nFeedback = {self.feedback}"
 
 class ValidationLog(LLMLog):
+    __slots__ = ('validation_instructions',)
+
     validation_instructions: str
 
     def __init__(self, prompt: str, response: str, feedback: Feedback, validation_instructions: str):
@@ -49,6 +92,8 @@ class ValidationLog(LLMLog):
         self.validation_instructions = validation_instructions
 
 class RetrievalLog(LLMLog):
+    __slots__ = ('data',)
+
     data: Dict
 
     def __init__(self, prompt: str, response: str, data: Dict):
@@ -56,20 +101,24 @@ class RetrievalLog(LLMLog):
         self.data = data
 
 class RefinementLog(LLMLog):
+    __slots__ = ('question', 'answer', 'requirements')
+
     question: str
     answer: str
     requirements: Requirements
 
     def __init__(self, prompt: str, question: str, answer: str, requirements: Requirements, feedback: Feedback|FeedbackBundle = None):
         super().__init__(prompt, question, "refinement", feedback=feedback)
-        self.question = question
-        self.answer = answer
+        self.question = self.response
+        self.answer = intern_text(answer)
         self.requirements = requirements
     
     def __str__(self):
         return f"{self.timestamp}: \nQuestion = {self.question},\nAnswer = {self.answer}"
     
 class GoalUpdateLog(Log):
+    __slots__ = ('previous_goal', 'goal')
+
     previous_goal: str
     goal: str
 
@@ -82,15 +131,23 @@ class GoalUpdateLog(Log):
         return f"{self.timestamp}: new_goal = {self.goal}"
     
 class PlanUpdateLog(LLMLog):
-    previous_plan: Plan
-    plan: Plan
+    __slots__ = ('previous_plan', 'plan', 'diff')
 
-    def __init__(self, prompt: str, response: str, previous_plan: Plan, plan: Plan, feedback: Feedback|FeedbackBundle = None):
+    # Snapshots rather than the live plans, which keep changing after the log is made
+    previous_plan: PlanSnapshot
+    plan: PlanSnapshot
+    diff: PlanDiff
+
+    def __init__(self, prompt: str, response: str, previous_plan: PlanSnapshot, plan: PlanSnapshot,
+                 feedback: Feedback|FeedbackBundle = None, diff: PlanDiff = None):
         super().__init__(prompt, response, 'planner', feedback=feedback)
         self.previous_plan = previous_plan
         self.plan = plan
+        self.diff = diff
 
 class ToolSelectionLog(LLMLog):
+    __slots__ = ('tool',)
+
     tool: Tool
 
     def __init__(self, prompt: str, response: str, tool: Tool, feedback: Feedback|FeedbackBundle = None):
@@ -98,6 +155,8 @@ class ToolSelectionLog(LLMLog):
         self.tool = tool
 
 class TurnToActionLog(LLMLog):
+    __slots__ = ('action',)
+
     action: Action
 
     def __init__(self, prompt: str, response: str, action: Action, feedback: Feedback|FeedbackBundle = None):
@@ -105,7 +164,66 @@ class TurnToActionLog(LLMLog):
         self.action = action
     
     
+class BudgetLog(Log):
+    __slots__ = ('loop_name', 'iterations', 'elapsed', 'tokens', 'exhausted', 'fallback')
+
+    loop_name: str
+    iterations: int
+    elapsed: float
+    tokens: int
+    exhausted: str
+    fallback: str
+
+    def __init__(self, tracker: LoopBudgetTracker, exhausted: str = None, fallback: str = None, feedback: Feedback|FeedbackBundle = None):
+        super().__init__(feedback=feedback)
+        self.loop_name = tracker.loop_name
+        self.iterations = tracker.iterations
+        self.elapsed = tracker.elapsed
+        self.tokens = tracker.tokens
+        self.exhausted = exhausted
+        self.fallback = fallback
+
+    def __str__(self):
+        status = f", budget exhausted ({self.exhausted}), fallback = {self.fallback}" if self.exhausted else ""
+        return f"{self.timestamp}: {self.loop_name} used {self.iterations} iterations, {self.elapsed:.2f}s, {self.tokens} tokens{status}"
+
+class SemanticCacheLog(Log):
+    __slots__ = ('kind', 'text', 'hit', 'similarity', 'threshold', 'matched_text', 'entry_id', 'questions', 'requirements')
+
+    kind: str
+    text: str
+    hit: bool
+    similarity: float
+    threshold: float
+    matched_text: str
+    entry_id: int
+    # What a hit reuses instead of asking the user again
+    questions: List[str]
+    requirements: List[str]
+
+    def __init__(self, kind: str, text: str, match: SemanticMatch = None, feedback: Feedback|FeedbackBundle = None):
+        # Misses keep the closest entry too, their similarities show where the threshold should be
+        super().__init__(feedback=feedback)
+        self.kind = kind
+        self.text = text
+        self.hit = match is not None and match.hit
+        self.similarity = match.similarity if match is not None else None
+        self.threshold = match.threshold if match is not None else None
+        self.matched_text = match.text if match is not None else None
+        self.entry_id = match.entry_id if match is not None else None
+        self.questions = list(match.questions) if self.hit else None
+        self.requirements = list(match.requirements) if self.hit else None
+
+    def __str__(self):
+        if self.similarity is None:
+            return f"{self.timestamp}: semantic cache {self.kind} miss, no entries"
+        reused = f", reusing {len(self.questions)} questions and {len(self.requirements)} requirements" if self.hit else ""
+        return (f"{self.timestamp}: semantic cache {self.kind} {'hit' if self.hit else 'miss'}, {self.text!r} is "
+                f"{self.similarity:.2f} similar to {self.matched_text!r} (threshold {self.threshold}){reused}")
+
 class IterationLog(Log):
+    __slots__ = ('context', 'logs', 'snapshot')
+
     context: Context
     logs: List[Log]
 
@@ -114,6 +232,8 @@ class IterationLog(Log):
         self.context = context
         self.logs = logs or []
         self.feedback = feedback
+        # The context as it was when the iteration started, the context itself is shared between iterations
+        self.snapshot = context.snapshot() if context is not None else None
 
     def append(self, log: Log):
         self.logs.append(log)
@@ -121,11 +241,27 @@ class IterationLog(Log):
     def clear(self):
         self.logs = []
 
+    def __str__(self):
+        logs = "".join(f"\n{log}" for log in self.logs)
+        return f"{self.timestamp}: iteration with {len(self.logs)} logs\nFeedback = {self.feedback}{logs}"
+
 class Logger:
-    logs: List[IterationLog]
+    logs: Deque[IterationLog]
+    events: EventLog
+    store: LogStore
+    iteration: int
 
-    def __init__(self, logs: List[IterationLog] = None, context: Context = None):
-        self.logs = logs or [IterationLog()]
+    def __init__(self, logs: List[IterationLog] = None, context: Context = None,
+                 max_iterations: int = 16, max_events: int = 10000,
+                 stream_path: str = None, segment_size: int = None, store: LogStore = None):
+        # Only the last max_iterations iterations are kept as objects, every log is also
+        # appended to the event log, which can stream the whole run to disk
+        self.logs = deque(logs or [IterationLog()], maxlen=max_iterations)
+        self.events = EventLog(max_events, stream_path, segment_size)
+        # Optional persistent store, every event is also written there
+        self.store = store
+        self.iteration = 0
+        self._templates = set()
         if logs is None and context is not None:
             self.add_context(context)
 
@@ -133,16 +269,41 @@ class Logger:
         self.logs[-1].context = context
 
     def clear_logs(self):
-        self.logs = []
+        self.logs.clear()
+        self.logs.append(IterationLog())
 
     def add_iteration(self):
-        old_iteration = self.logs[0]
-        self.logs.insert(0, copy.deepcopy(old_iteration))
-        self.logs[-1].clear()
+        # The context is shared rather than copied, its state at the boundary goes to the event log
+        context = self.logs[-1].context
+        self.iteration += 1
+        self.logs.append(IterationLog(context))
+        self._record({"type": "IterationStart",
+                      "iteration": self.iteration,
+                      "timestamp": self.logs[-1].timestamp.isoformat(),
+                      "context": context.summary() if context is not None else None})
 
     def log(self, log: Log):
-        print(log)
+        deus_logging.info(log)
         self.logs[-1].append(log)
+        prompt_ref = getattr(log, 'prompt_ref', None)
+        if isinstance(prompt_ref, PromptRef) and prompt_ref.version not in self._templates:
+            # Each template version is written to the event log once, the logs refer to it
+            self._templates.add(prompt_ref.version)
+            self._record({"type": "PromptTemplate",
+                          "key": prompt_ref.key,
+                          "version": prompt_ref.version,
+                          "template": get_template(prompt_ref.version)})
+        self._record(dict(log.to_dict(), iteration=self.iteration))
+
+    def close(self):
+        self.events.close()
+        if self.store is not None:
+            self.store.close()
+
+    def _record(self, event: Dict):
+        self.events.append(event)
+        if self.store is not None:
+            self.store.write(event)
 
 class Context:
     scope: Scope
@@ -151,6 +312,7 @@ class Context:
     finished: bool
     current_feedback: Feedback|FeedbackBundle
     data: DataBundle
+    plan_history: PlanHistory
 
     def __init__(self, scope: Scope, 
                  plan: Plan = None, 
@@ -164,17 +326,121 @@ class Context:
         self.finished = finished
         self.current_feedback = current_feedback
         self.data = data
+        self.plan_history = PlanHistory()
+        self._scope_snapshot = None
     
     def deep_copy(self):
-        return Context(self.scope.copy(), self.plan.copy(), self.current_step.copy(), self.finished)
+        plan = self.plan.copy() if self.plan is not None else None
+        current_step = None
+        if self.current_step is not None:
+            current_step = next((step for step in plan.steps if step == self.current_step), None) if plan is not None else self.current_step.copy()
+        return Context(self.scope.copy(), plan, current_step, self.finished, self.current_feedback)
+
+    def snapshot(self) -> ContextSnapshot:
+        # Cheaper than deep_copy, the plan is recorded in plan_history and shares its unchanged steps
+        # with earlier versions, and the scope copy is reused for as long as the scope does not change
+        if self._scope_snapshot is None or self._scope_snapshot != self.scope:
+            self._scope_snapshot = self.scope.copy()
+        plan = self.plan_history.record(self.plan) if self.plan is not None else None
+        return ContextSnapshot(self._scope_snapshot, plan,
+                               self.current_step.id if self.current_step is not None else None,
+                               self.finished, self.current_feedback)
+
+    def to_dict(self) -> Dict[str, Any]:
+        # The tool outputs in data are left out, they only feed the iteration that produced them
+        return {"scope": self.scope.to_dict(),
+                "plan": self.plan.to_dict() if self.plan is not None else None,
+                "current_step": self.current_step.id if self.current_step is not None else None,
+                "finished": self.finished,
+                "current_feedback": feedback_to_dict(self.current_feedback)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], toolkit: Dict[str, Tool] = None) -> Context:
+        plan = Plan.from_dict(data["plan"], toolkit) if data.get("plan") is not None else None
+        current_step = None
+        if plan is not None and data.get("current_step") is not None:
+            # Plan.from_dict registered the restored steps, so the id resolves to the one in this plan
+            current_step = resolve(data["current_step"])
+            if not isinstance(current_step, Step):
+                current_step = None
+        return cls(Scope.from_dict(data["scope"]), plan, current_step, data.get("finished", False),
+                   feedback_from_dict(data.get("current_feedback")))
+
+    def summary(self) -> Dict[str, Any]:
+        plan = None
+        if self.plan is not None:
+            plan = [{"id": step.id, "name": step.name, "accomplished": step.accomplished} for step in self.plan.steps]
+        return {"plan": plan,
+                "current_step": self.current_step.id if self.current_step is not None else None,
+                "finished": self.finished}
+
+class ContextSnapshot:
+    __slots__ = ('scope', 'plan', 'current_step', 'finished', 'current_feedback')
+
+    scope: Scope
+    plan: PlanSnapshot
+    current_step: str
+    finished: bool
+    current_feedback: Feedback|FeedbackBundle
+
+    def __init__(self, scope: Scope, plan: PlanSnapshot, current_step: str, finished: bool,
+                 current_feedback: Feedback|FeedbackBundle = None):
+        self.scope = scope
+        self.plan = plan
+        self.current_step = current_step
+        self.finished = finished
+        self.current_feedback = current_feedback
+
+    def diff(self, other: ContextSnapshot) -> PlanDiff:
+        # The plan changes from this snapshot to other
+        return (self.plan or PlanSnapshot(())).diff(other.plan or PlanSnapshot(()))
 
 class ContextManager:
     context: Context
     logger: Logger
+    toolkit: Dict[str, Tool]
+    step_scheduler: StepScheduler
+    speculation: Dict[str, int]
+    speculative_temperature: float
+    budgets: Dict[str, LoopBudget]
+    default_budget: LoopBudget
+    max_frozen_steps: int
+    router: ModelRouter
+    semantic_cache: SemanticCache
     prompts = prompts
 
-    def __init__(self, user_query: str = None, context: Context = None, logger: Logger = None):
+    def __init__(self, 
+                 user_query: str = None, 
+                 context: Context = None, 
+                 logger: Logger = None, 
+                 ask_user: Callable[[str], str] = None,
+                 toolkit: Dict[str, Tool] = None,
+                 max_workers: int = 4,
+                 speculation: Dict[str, int] = None,
+                 speculative_temperature: float = 0.7,
+                 budgets: Dict[str, LoopBudget] = None,
+                 default_budget: LoopBudget = None,
+                 max_frozen_steps: int = 10,
+                 router: ModelRouter = None,
+                 semantic_cache: SemanticCache = None):
         self.logger = logger or Logger()
+        self._ask_user = ask_user or ask_user_default
+        self.toolkit = toolkit or {}
+        self.step_scheduler = StepScheduler(max_workers)
+        # Number of candidates generated concurrently per generate/validate loop, e.g. {'plan_creation': 3}
+        self.speculation = speculation or {}
+        self.speculative_temperature = speculative_temperature
+        # Limits per generate/validate loop, e.g. {'plan_creation': LoopBudget(max_iterations=3, fallback='fail')}
+        self.budgets = budgets or {}
+        self.default_budget = default_budget or LoopBudget()
+        # Accomplished steps described to the planner on updates, older ones are only counted
+        self.max_frozen_steps = max_frozen_steps
+        # Picks the model of every call by prompt key or role, see deus_router
+        self.router = router or get_router()
+        # Scopes of earlier runs that are reused for rewordings of their query or goal, None to always ask
+        self.semantic_cache = semantic_cache if semantic_cache is not None else get_semantic_cache()
+        self._scope_match = None
+        self._questions = []
         if context is not None:
             self.context = context
         elif user_query is not None:
@@ -182,41 +448,79 @@ class ContextManager:
             self.context = Context(Scope(user_query, user_goal))
         self.logger.add_context(self.context)
 
+    @traced("set_scope", "phase")
     def set_scope(self):
+        # A query or goal close enough to an earlier run's takes that run's requirements instead of asking again
+        match = self._scope_match or self._semantic_match(GOAL, self.context.scope.user_goal)
+        if match is not None:
+            # The questions are kept too, the SemanticCacheLog of the match has both
+            self._questions = list(match.questions)
+            requirements = Requirements(list(match.requirements))
+        else:
+            requirements = self._refine_requirements()
+        self.context.scope.set_requirements(requirements)
+        self.context.scope.description = self._get_scope_description(self.context.scope.user_goal, requirements)
+
+    def _refine_requirements(self) -> Requirements:
         validation_instructions = ""
         stop = False
         requirements = None
-        while (stop != True):
-            if requirements is None:
-                requirements = self._first_ask_user_llm_call()
-                if requirements is None:
-                    break
-            else:
-                new_requirements = self._next_ask_user_llm_call(requirements, validation_instructions)
-                if new_requirements is None:
+        self._questions = []
+        tracker = self._budget_tracker('scope')
+        exhausted = None
+        with tracker.metering():
+            while (stop != True):
+                check_deadline("the next scope refinement round")
+                exhausted = tracker.exhausted()
+                if exhausted:
+                    # Out of refinement rounds, go on with the requirements gathered so far
+                    self._budget_fallback(tracker, exhausted, requirements)
                     break
-                requirements = self._merge_requirements(requirements, new_requirements)
-            data = self.validate_scope_completeness_llm_call(requirements)
-            feedback = data.feedback_bundle.get_last_feedback()
-            validation_instructions = data['validation_instructions']
-            stop = feedback.success
-        self.context.scope.set_requirements(requirements)
-        self.context.scope.description = self._get_scope_description(self.context.scope.user_goal, requirements)
+                tracker.iterations += 1
+                if requirements is None:
+                    requirements = self._first_ask_user_llm_call()
+                    if requirements is None:
+                        break
+                else:
+                    new_requirements = self._next_ask_user_llm_call(requirements, validation_instructions)
+                    if new_requirements is None:
+                        break
+                    requirements = self._merge_requirements(requirements, new_requirements)
+                data = self.validate_scope_completeness_llm_call(requirements)
+                feedback = data.feedback_bundle.get_last_feedback()
+                validation_instructions = data['validation_instructions']
+                stop = feedback.success
+        if not exhausted:
+            self._log(BudgetLog(tracker))
+        if stop and requirements is not None and self.semantic_cache is not None:
+            # Only scopes that passed the completeness check are worth reusing
+            scope = self.context.scope
+            self.semantic_cache.put(scope.user_query, scope.user_goal, self._questions, requirements.to_dict())
+        return requirements
+
+    def _semantic_match(self, kind: str, text: str) -> SemanticMatch:
+        if self.semantic_cache is None:
+            return None
+        match = self.semantic_cache.match(kind, text)
+        self._log(SemanticCacheLog(kind, text, match))
+        return match if match is not None and match.hit else None
 
     def _first_ask_user_llm_call(self) -> Requirements:
-        prompt = self.prompts['first_ask_user'].format(user_goal=self.context.scope.user_goal)
+        prompt = self._format_prompt('first_ask_user', user_goal=self.context.scope.user_goal)
         questions = self.llm_call(prompt)
-        user_answer = input(questions + '\nType your answer here: ')
+        self._questions.append(questions)
+        user_answer = self.ask_user(questions + '\nType your answer here: ')
         requirements = self._get_requirements(questions, user_answer)
         self._log(RefinementLog(prompt, questions, user_answer, requirements))
         return requirements
     
     def _next_ask_user_llm_call(self, requirements: Requirements, validation_instructions: str) -> Requirements:
-        prompt = self.prompts['next_ask_user'].format(user_goal=self.context.scope.user_goal,
+        prompt = self._format_prompt('next_ask_user', user_goal=self.context.scope.user_goal,
                                                       requirements=requirements,
                                                       validation_instructions=validation_instructions)
         questions = self.llm_call(prompt)
-        user_answer = input(questions + '\nType your answer here: ')
+        self._questions.append(questions)
+        user_answer = self.ask_user(questions + '\nType your answer here: ')
         requirements = self._get_requirements(questions, user_answer)
         self._log(RefinementLog(prompt, questions, user_answer, requirements))
         return requirements    
@@ -224,38 +528,32 @@ class ContextManager:
     def _get_requirements(self, questions: str, answer: str) -> Requirements:
         if answer == "stop":
             return None
-        validation_instructions = ""
-        stop = False
         user_goal = self.context.scope.user_goal
-        while (stop != True):
-            requirements = self._retrieve_requirements_llm_call(user_goal, questions, answer, validation_instructions)
-            data = self._validate_requirements_retrieved_llm_call(requirements, user_goal, questions, answer)
-            feedback = data.feedback_bundle.get_last_feedback()
-            validation_instructions = data['validation_instructions']
-            stop = feedback.success
-        return requirements
+        return self._generate_validate('requirements',
+                                       lambda validation_instructions: self._retrieve_requirements_llm_call(user_goal, questions, answer, validation_instructions),
+                                       lambda requirements: self._validate_requirements_retrieved_llm_call(requirements, user_goal, questions, answer))
     
     def _retrieve_requirements_llm_call(self, user_goal: str, questions: str, answer: str, validation_instructions: str):
-        prompt = self.prompts['retrieve_requirements'].format(user_goal=user_goal,
+        prompt = self._format_prompt('retrieve_requirements', user_goal=user_goal,
                                                               questions=questions, 
                                                               answer=answer,
                                                               validation_instructions=validation_instructions)
         response = self.llm_call(prompt)
         json_obj = self._parse_response(response)
-        print(json_obj)
+        deus_logging.debug(json_obj)
         requirements = self._retrieve_requirements(json_obj)
         return requirements
     
     def _retrieve_requirements(self, json_obj: Dict) -> Requirements:
         if "requirements" in json_obj:
             requirements = Requirements(json_obj["requirements"])
-            print(requirements)
+            deus_logging.debug(requirements)
         else:
             requirements = None
         return requirements
     
     def _validate_requirements_retrieved_llm_call(self, requirements: Requirements, user_goal: str, questions: str, answer: str) -> DataBundle:
-        prompt = self.prompts['validate_requirements_retrieved'].format(user_goal=user_goal,
+        prompt = self._format_prompt('validate_requirements_retrieved', user_goal=user_goal,
                                                                         questions=questions, 
                                                                         answer=answer,
                                                                         requirements=requirements)
@@ -268,18 +566,12 @@ class ContextManager:
         return data
     
     def _merge_requirements(self, requirements: Requirements, new_requirements: Requirements) -> Requirements:
-        validation_instructions = ""
-        stop = False
-        while (stop != True):
-            merged_requirements = self._merge_requirements_llm_call(requirements, new_requirements, validation_instructions)
-            data = self._validate_requirements_merged(merged_requirements, requirements, new_requirements)
-            feedback = data.feedback_bundle.get_last_feedback()
-            validation_instructions = data['validation_instructions']
-            stop = feedback.success
-        return merged_requirements
+        return self._generate_validate('merge_requirements',
+                                       lambda validation_instructions: self._merge_requirements_llm_call(requirements, new_requirements, validation_instructions),
+                                       lambda merged_requirements: self._validate_requirements_merged(merged_requirements, requirements, new_requirements))
 
     def _merge_requirements_llm_call(self, requirements: Requirements, new_requirements: Requirements, validation_instructions: str) -> Requirements:
-        prompt = self.prompts['merge_requirements'].format(requirements=requirements,
+        prompt = self._format_prompt('merge_requirements', requirements=requirements,
                                                             new_requirements=new_requirements,
                                                             validation_instructions=validation_instructions)
         response = self.llm_call(prompt)
@@ -289,7 +581,7 @@ class ContextManager:
         return merged_requirements
     
     def _validate_requirements_merged(self, merged_requirements: Requirements, requirements: Requirements, new_requirements: Requirements) -> DataBundle:
-        prompt = self.prompts['validate_requirements_merged'].format(requirements=requirements,
+        prompt = self._format_prompt('validate_requirements_merged', requirements=requirements,
                                                                      new_requirements=new_requirements,
                                                                      merged_requirements=merged_requirements)
         response = self.llm_call(prompt)
@@ -301,7 +593,7 @@ class ContextManager:
         return data
     
     def validate_scope_completeness_llm_call(self, requirements: Requirements) -> DataBundle:
-        prompt = self.prompts['validate_scope_completeness'].format(user_goal=self.context.scope.user_goal, 
+        prompt = self._format_prompt('validate_scope_completeness', user_goal=self.context.scope.user_goal, 
                                                                     requirements=requirements)
         response = self.llm_call(prompt)
         json_obj = self._parse_response(response)
@@ -311,18 +603,12 @@ class ContextManager:
         return data
     
     def _get_scope_description(self, user_goal: str, requirements: Requirements) -> str:
-        validation_instructions = ""
-        stop = False
-        while stop != True:
-            description = self._describe_scope_llm_call(user_goal, requirements, validation_instructions)
-            data = self._validate_scope_description_llm_call(user_goal, requirements, description)
-            feedback = data.feedback_bundle.get_last_feedback()
-            validation_instructions = data['validation_instructions']
-            stop = feedback.success
-        return description
+        return self._generate_validate('scope_description',
+                                       lambda validation_instructions: self._describe_scope_llm_call(user_goal, requirements, validation_instructions),
+                                       lambda description: self._validate_scope_description_llm_call(user_goal, requirements, description))
 
     def _describe_scope_llm_call(self, user_goal: str, requirements: Requirements, validation_instructions: str) -> str:
-        prompt = self.prompts['describe_scope'].format(user_goal=user_goal, 
+        prompt = self._format_prompt('describe_scope', user_goal=user_goal, 
                                                        requirements=requirements,
                                                        validation_instructions=validation_instructions)
         response = self.llm_call(prompt)
@@ -330,7 +616,7 @@ class ContextManager:
         return response
     
     def _validate_scope_description_llm_call(self, user_goal: str, requirements: Requirements, description: str):
-        prompt = self.prompts['validate_scope_description'].format(user_goal=user_goal, 
+        prompt = self._format_prompt('validate_scope_description', user_goal=user_goal, 
                                                                    requirements=requirements, 
                                                                    description=description)
         response = self.llm_call(prompt)
@@ -341,6 +627,7 @@ class ContextManager:
         self._log(ValidationLog(prompt, response, feedback, data.data))
         return data
         
+    @traced("planner", "phase")
     def planner(self):
         previous_plan = self.context.plan
         if previous_plan is None:
@@ -349,31 +636,30 @@ class ContextManager:
             plan = self._get_plan_update(self.context.scope.description, 
                                          self.context.current_feedback, 
                                          previous_plan)
+        # Only the accepted plan takes over the ids, a rejected candidate must not leave the registry
+        # pointing at steps that are about to be collected
+        for step in plan.steps:
+            register(step, replace=True)
         self.context.plan = plan
         self.context.current_step = plan.get_current_step()
+        self.context.plan_history.record(plan)
     
     def _get_plan_creation(self, description: str) -> Plan:
-        validation_instructions = ""
-        stop = False
-        while stop != True:
-            plan = self._create_plan_llm_call(description, validation_instructions)
-            data = self._validate_create_plan_llm_call(plan, description)
-            feedback = data.feedback_bundle.get_last_feedback()
-            validation_instructions = data['validation_instructions']
-            stop = feedback.success
-        return plan
+        return self._generate_validate('plan_creation',
+                                       lambda validation_instructions: self._create_plan_llm_call(description, validation_instructions),
+                                       lambda plan: self._validate_create_plan_llm_call(plan, description))
     
     def _create_plan_llm_call(self, description: str, validation_instructions: str = "") -> Plan:
-        prompt = self.prompts['create_plan'].format(description=description,
+        prompt = self._format_prompt('create_plan', description=description,
                                                     validation_instructions=validation_instructions)
         response = self.llm_call(prompt)
         json_obj = self._parse_response(response)
         plan = self._retrieve_plan(json_obj)
-        self._log(PlanUpdateLog(prompt, response, None, plan))
+        self._log(PlanUpdateLog(prompt, response, None, self._plan_snapshot(plan)))
         return plan
     
     def _validate_create_plan_llm_call(self, plan: Plan, description: str) -> DataBundle:
-        prompt = self.prompts['validate_create_plan'].format(plan=plan, description=description)
+        prompt = self._format_prompt('validate_create_plan', plan=plan, description=description)
         response = self.llm_call(prompt)
         json_obj = self._parse_response(response)
         feedback = self._retrieve_feedback(json_obj)
@@ -382,32 +668,100 @@ class ContextManager:
         self._log(ValidationLog(prompt, response, feedback, data.data))
         return data
     
-    def _get_plan_update(self, description: str, feedback: Feedback, previous_plan: Plan, validation_instructions: str = "") -> Plan:
-        stop = False
-        while stop != True:
-            plan = self._update_plan_llm_call(description, 
-                                              feedback, 
-                                              previous_plan, 
-                                              validation_instructions)
-            data = self._validate_update_plan_llm_call(plan, description)
-            feedback = data.feedback_bundle.get_last_feedback()
-            validation_instructions = data['validation_instructions']
-            stop = feedback.success
-        return plan
+    def _get_plan_update(self, description: str, feedback: Feedback, previous_plan: Plan) -> Plan:
+        return self._generate_validate('plan_update',
+                                       lambda validation_instructions: self._update_plan_llm_call(description, 
+                                                                                                  feedback, 
+                                                                                                  previous_plan, 
+                                                                                                  validation_instructions),
+                                       lambda plan: self._validate_update_plan_llm_call(plan, description, previous_plan))
     
     def _update_plan_llm_call(self, description: str, feedback: Feedback, previous_plan: Plan, validation_instructions: str = "") -> Plan:
-        prompt = self.prompts['update_plan'].format(description=description, 
+        # Accomplished steps are frozen, only the remaining steps are sent to the planner and regenerated
+        prompt = self._format_prompt('update_plan', scope=description, 
+                                                    accomplished_steps=self._describe_frozen_steps(previous_plan),
+                                                    remaining_steps=self._describe_steps(self._remaining_steps(previous_plan)),
                                                     feedback=feedback,
-                                                    previous_plan=previous_plan,
                                                     validation_instructions=validation_instructions)
         response = self.llm_call(prompt)
         json_obj = self._parse_response(response)
-        plan = self._retrieve_plan(json_obj)
-        self._log(PlanUpdateLog(prompt, response, previous_plan, plan))
+        remaining = self._retrieve_plan(json_obj)
+        plan = self._merge_plan(previous_plan, remaining) if remaining is not None else None
+        previous_snapshot = self.context.plan_history.record(previous_plan)
+        snapshot = self._plan_snapshot(plan)
+        diff = None
+        if snapshot is not None:
+            dropped = tuple(StepSnapshot.of(step) for step in self._clashing_steps(previous_plan, remaining))
+            diff = previous_snapshot.diff(snapshot, dropped)
+        self._log(PlanUpdateLog(prompt, response, previous_snapshot, snapshot, diff=diff))
         return plan
 
-    def _validate_update_plan_llm_call(self, plan: Plan, description: str) -> DataBundle:
-        prompt = self.prompts['validate_update_plan'].format(plan=plan, description=description)
+    def _plan_snapshot(self, plan: Plan) -> PlanSnapshot:
+        # Candidate plans are snapshotted against the history but only accepted plans are recorded
+        return self.context.plan_history.snapshot(plan) if plan is not None else None
+
+    def _remaining_steps(self, plan: Plan) -> List[Step]:
+        return [step for step in plan.steps if not step.accomplished]
+
+    def _describe_frozen_steps(self, plan: Plan) -> str:
+        # Only the last max_frozen_steps are described so that the prompt stops growing as the plan progresses.
+        # The earlier ones are still named: a new step reusing one of their names is dropped by _merge_plan.
+        frozen = [step for step in plan.steps if step.accomplished]
+        if not frozen:
+            return "None yet"
+        shown = frozen[-self.max_frozen_steps:] if self.max_frozen_steps > 0 else []
+        lines = [str(step) for step in shown]
+        hidden = frozen[:len(frozen) - len(shown)]
+        if hidden:
+            lines.insert(0, f"({len(hidden)} earlier steps accomplished: {', '.join(step.name for step in hidden)})")
+        return "\n".join(lines)
+
+    def _describe_steps(self, steps: List[Step]) -> str:
+        if not steps:
+            return "None"
+        return "\n".join(f"{step} (blocked by: {', '.join(blocker.name for blocker in step.blocked_by if not blocker.accomplished) or 'nothing'})"
+                         for step in steps)
+
+    def _clashing_steps(self, previous_plan: Plan, remaining: Plan) -> List[Step]:
+        # Regenerated steps named like an accomplished step, _merge_plan leaves them out
+        accomplished = {step.name for step in previous_plan.steps if step.accomplished}
+        return [step for step in remaining.steps if step.name in accomplished]
+
+    def _merge_plan(self, previous_plan: Plan, remaining: Plan) -> Plan:
+        # The regenerated steps are merged back by name: a step the planner kept takes over the id, feedback
+        # and action of the unfinished step it replaces, steps named like an accomplished step are dropped
+        frozen = [step for step in previous_plan.steps if step.accomplished]
+        frozen_steps = {step.name: step for step in frozen}
+        unfinished = {step.name: step for step in self._remaining_steps(previous_plan)}
+        steps, frozen_blockers = [], {}
+        for step in remaining.steps:
+            if step.name in frozen_steps:
+                continue
+            blockers = [frozen_steps[blocker.name] for blocker in step.blocked_by if blocker.name in frozen_steps]
+            previous_step = unfinished.get(step.name)
+            if previous_step is not None:
+                step.id = previous_step.id
+                step.feedback = previous_step.feedback
+                step.action = previous_step.action
+                blockers += [blocker for blocker in previous_step.blocked_by if blocker.accomplished and blocker not in blockers]
+            frozen_blockers[step] = blockers
+            steps.append(step)
+        # Links to accomplished steps only go one way, the frozen steps themselves are left untouched
+        kept = set(steps)
+        for step in steps:
+            step.blocked_by = frozen_blockers[step] + [blocker for blocker in step.blocked_by if blocker in kept]
+            step.blocking = [blocked for blocked in step.blocking if blocked in kept]
+        return Plan(frozen + steps)
+
+    def _validate_update_plan_llm_call(self, plan: Plan, description: str, previous_plan: Plan = None) -> DataBundle:
+        # Only the remaining steps and what changed in them are reviewed
+        changes = "Not known"
+        if previous_plan is not None:
+            changes = str(self.context.plan_history.snapshot(previous_plan).diff(self._plan_snapshot(plan)))
+        prompt = self._format_prompt('validate_update_plan', plan=self._describe_steps(self._remaining_steps(plan)),
+                                                             accomplished_steps=self._describe_frozen_steps(plan),
+                                                             changes=changes,
+                                                             description=description)
         response = self.llm_call(prompt)
         json_obj = self._parse_response(response)
         feedback = self._retrieve_feedback(json_obj)
@@ -416,19 +770,103 @@ class ContextManager:
         self._log(ValidationLog(prompt, response, feedback, data.data))
         return data
 
+    def _generate_validate(self, loop_name: str, generate: Callable[[str], Any], validate: Callable[[Any], DataBundle]) -> Any:
+        validation_instructions = ""
+        stop = False
+        best = None
+        tracker = self._budget_tracker(loop_name)
+        # Candidates that fail validation move the loop's generating calls on to a stronger model
+        escalation = Escalation()
+        generate = escalation.wrap(generate)
+        with tracker.metering():
+            while stop != True:
+                check_deadline(f"the next {loop_name} iteration")
+                exhausted = tracker.exhausted()
+                if exhausted:
+                    return self._budget_fallback(tracker, exhausted, best)
+                tracker.iterations += 1
+                with trace(f"{loop_name} #{tracker.iterations}", "iteration", loop=loop_name):
+                    candidate, data = self._next_candidate(loop_name, generate, validate, validation_instructions)
+                if candidate is not None:
+                    best = candidate
+                feedback = data.feedback_bundle.get_last_feedback()
+                validation_instructions = data['validation_instructions']
+                stop = feedback.success
+                if not stop:
+                    self.router.escalate(escalation)
+        self._log(BudgetLog(tracker))
+        return candidate
+
+    def _budget_tracker(self, loop_name: str) -> LoopBudgetTracker:
+        return LoopBudgetTracker(loop_name, self.budgets.get(loop_name, self.default_budget))
+
+    def _budget_fallback(self, tracker: LoopBudgetTracker, exhausted: str, best: Any) -> Any:
+        # Validators only pass or fail, so the best candidate is the latest one that parsed
+        fallback = tracker.budget.fallback
+        if fallback == ACCEPT_BEST and best is not None:
+            self._log(BudgetLog(tracker, exhausted, fallback, Feedback(f"Accepted the last candidate of {tracker.loop_name}", success=True)))
+            return best
+        self._log(BudgetLog(tracker, exhausted, fallback, Feedback(f"{tracker.loop_name} failed, no candidate left to accept", success=False)))
+        raise LoopBudgetExceeded(tracker.loop_name, exhausted)
+
+    def _next_candidate(self, loop_name: str, generate: Callable[[str], Any], validate: Callable[[Any], DataBundle], validation_instructions: str) -> Tuple[Any, DataBundle]:
+        n = self.speculation.get(loop_name, 1)
+        if n <= 1:
+            candidate = generate(validation_instructions)
+            return candidate, validate(candidate)
+
+        # Speculative mode: n candidates are generated and validated concurrently, the first
+        # one to pass validation wins and the calls still in flight for the others are cancelled.
+        from deus_client import CancelScope
+        scopes = [CancelScope() for _ in range(n)]
+
+        def run_candidate(index: int) -> Tuple[Any, DataBundle]:
+            active_cancel_scope.set(scopes[index])
+            if index > 0:
+                # Candidate 0 is the deterministic one, the others need some variety
+                llm_overrides.set(dict(llm_overrides.get() or {}, temperature=self.speculative_temperature))
+            candidate = generate(validation_instructions)
+            scopes[index].check()
+            return candidate, validate(candidate)
+
+        result = None
+        pool = ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"deus-{loop_name}")
+        try:
+            futures = [pool.submit(contextvars.copy_context().run, run_candidate, index) for index in range(n)]
+            for future in as_completed(futures):
+                try:
+                    candidate, data = future.result()
+                except (DeadlineExceeded, UsageBudgetExceeded):
+                    raise
+                except Exception as e:
+                    deus_logging.warning(f"Candidate for {loop_name} failed: {e}")
+                    continue
+                result = (candidate, data)
+                if data.feedback_bundle.get_last_feedback().success:
+                    break
+        finally:
+            for scope in scopes:
+                scope.cancel()
+            pool.shutdown(wait=False, cancel_futures=True)
+        if result is None:
+            raise RuntimeError(f"Every candidate for {loop_name} failed")
+        return result
+
+    @traced("task_handler", "phase")
     def task_handler(self):
-        active_step = self.context.current_step
-        if active_step:
-            data = DataBundle({'active_step': active_step}, FeedbackBundle())
-            self.get_candidate_tools(data)
-            self.tool_selection(data)
-            self.turn_to_action(data)
-            self.execute_action(data)
-            active_step.feedback = data.feedback_bundle
-            self.context.data = data
-            if data.feedback_bundle.success:
-                active_step.accomplished = True
-                if self.context.plan.check_accomplished():
+        plan = self.context.plan
+        ready_steps = plan.get_ready_steps() if plan is not None else []
+        if not ready_steps and self.context.current_step:
+            ready_steps = [self.context.current_step]
+        if ready_steps:
+            # Independent steps are handled concurrently, then their feedback is merged
+            results = self.step_scheduler.run(ready_steps, self._handle_step)
+            feedback = FeedbackBundle([Feedback(f"{step.name}: {step_feedback}", success=step_feedback.success)
+                                       for step, (step_feedback, _) in zip(ready_steps, results)])
+            self.context.data = DataBundle({step.id: step_data for step, (_, step_data) in zip(ready_steps, results)}, feedback)
+            if plan is not None:
+                self.context.plan_history.record(plan)
+                if plan.check_accomplished():
                     self.context.finished = True
         else:
             feedback = Feedback("No active step found", success=False)
@@ -436,16 +874,42 @@ class ContextManager:
         self.context.current_feedback = feedback
         self.logger.logs[-1].feedback = feedback
 
-    def get_candidate_tools(self, step: Step) -> DataBundle:
+    def _handle_step(self, step: Step) -> Tuple[FeedbackBundle, DataBundle]:
+        # Logs made while handling the step are tagged with its id
+        token = active_step_id.set(step.id)
+        try:
+            with trace(step.name, "step", step_id=step.id, goal=step.goal):
+                candidate_tools = self.get_candidate_tools(step)
+                tool, feedback = self.tool_selection(step, candidate_tools)
+                action = self.turn_to_action(step, tool, feedback)
+                data = self.execute_action(action, feedback)
+        except (DeadlineExceeded, UsageBudgetExceeded):
+            raise
+        except Exception as e:
+            # Steps run side by side, one that fails must not take the results of the others with it
+            deus_logging.warning(f"Step {step.name} failed: {e}")
+            feedback, data = FeedbackBundle(Feedback(f"Step failed: {e}", success=False)), None
+        finally:
+            active_step_id.reset(token)
+        step.feedback = feedback
+        if feedback.success:
+            step.accomplished = True
+        return feedback, data
+
+    def get_candidate_tools(self, step: Step) -> List[Tool]:
         #Semantic search to find potential tools
-        pass
+        return list(self.toolkit.values())
 
-    def tool_selection(self, step: Step, candidate_tools: List[Tool]) -> Tuple[List[Tool], Feedback]:
-        prompt = self.prompts['tool_selection'].format(step=step, candidate_tools=candidate_tools)
+    def tool_selection(self, step: Step, candidate_tools: List[Tool]) -> Tuple[Tool, FeedbackBundle]:
+        prompt = self._format_prompt('tool_selection', step=step, 
+                                                       candidate_tools="\n".join(str(tool) for tool in candidate_tools),
+                                                       validation_instructions="")
         response = self.llm_call(prompt)
         json_obj = self._parse_response(response)
         tool = self._retrieve_tool(json_obj)
         feedback = self._retrieve_feedback(json_obj)
+        if tool is None and (feedback is None or feedback.success):
+            feedback = Feedback("No known tool was selected", success=False)
         feedback_bundle = FeedbackBundle(feedback)
         self._log(ToolSelectionLog(prompt, response, tool, feedback=feedback))
         return tool, feedback_bundle
@@ -453,10 +917,10 @@ class ContextManager:
     def turn_to_action(self, step: Step, tool: Tool, feedback_bundle: FeedbackBundle) -> Action:
         prev_feedback = feedback_bundle.get_last_feedback()
         if prev_feedback.success:
-            prompt = self.prompts['turn_to_action'].format(step=step, tool=tool)
+            prompt = self._format_prompt('turn_to_action', step=step, tool_descriptions=tool, validation_instructions="")
             response = self.llm_call(prompt)
             json_obj = self._parse_response(response)
-            action = self._retrieve_action(json_obj)
+            action = self._retrieve_action(json_obj, step, tool)
             step.action = action
             feedback = self._retrieve_feedback(json_obj)
             self._log(TurnToActionLog(prompt, response, action, feedback=feedback))
@@ -465,21 +929,39 @@ class ContextManager:
         else:
             return None
 
-    def execute_action(self, action: Action, feedback_bundle: FeedbackBundle):
+    def execute_action(self, action: Action, feedback_bundle: FeedbackBundle) -> DataBundle:
+        data = None
         if action:
-            data = self.monitor(action.tool.func, action.tool_input)
+            data = self.monitor(action.tool.func, action.tool_input, action.tool.name)
             feedback = data.feedback_bundle.get_last_feedback()
             # TODO: Figure out how to store data and what to do with it
-            self.context.data = data
         else:
             feedback = Feedback("No action to execute", success=False)
         self._log(ExecutionLog(action, data, feedback=feedback))
         feedback_bundle.append(feedback)
-
-    def monitor(self, func: Callable, input: str) -> DataBundle:
-        # TODO: Implement monitoring
-        data = func(input)
         return data
+
+    def monitor(self, func: Callable, input: str, name: str = None) -> DataBundle:
+        name = name or getattr(func, "__name__", "tool")
+        with trace(name, "tool"):
+            return get_monitor().observe("tool", name, self._run_tool, func, input)
+
+    def _run_tool(self, func: Callable, input: str) -> DataBundle:
+        remaining = remaining_time()
+        if remaining is None:
+            return func(input)
+        check_deadline("running the tool")
+        # The tool runs on its own thread so that the caller stops waiting at the deadline,
+        # a tool that overruns is abandoned rather than killed
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="deus-tool")
+        try:
+            future = pool.submit(contextvars.copy_context().run, func, input)
+            return future.result(timeout=remaining)
+        except FuturesTimeoutError:
+            future.cancel()
+            return DataBundle({}, Feedback("Tool execution exceeded the workflow deadline", success=False))
+        finally:
+            pool.shutdown(wait=False)
         
     def _parse_response(self, response: str):
         # parse the JSON object from the response
@@ -499,26 +981,27 @@ class ContextManager:
             try:
                 json_obj = json.loads(response.replace('\n', ''))
             except json.JSONDecodeError as e:
-                print(f"Error parsing JSON: {str(e)}")
+                deus_logging.warning(f"Error parsing JSON: {str(e)}")
                 # handle the error or exit the program
         return json_obj
             
+    @traced("user_goal", "phase")
     def _get_user_goal(self, user_query) -> str:
-        # TODO: Set a limit on the number of times this can be called
-        validation_instructions = ""
-        stop = False
-        while stop != True:
-            user_goal = self._retrieve_goal_llm_call(user_query, validation_instructions)
-            data = self._validate_goal_llm_call(user_query, user_goal)
-            feedback = data.feedback_bundle.get_last_feedback()
-            validation_instructions = data['validation_instructions']
-            stop = feedback.success
+        match = self._semantic_match(QUERY, user_query)
+        if match is not None:
+            # A rewording of an earlier query: its goal, and in set_scope its requirements, are reused
+            self._scope_match = match
+            user_goal = match.goal
+        else:
+            user_goal = self._generate_validate('user_goal',
+                                                lambda validation_instructions: self._retrieve_goal_llm_call(user_query, validation_instructions),
+                                                lambda user_goal: self._validate_goal_llm_call(user_query, user_goal))
         self._log(GoalUpdateLog(None, user_goal))
         return user_goal
     
     def _retrieve_goal_llm_call(self, user_query: str, validation_instructions: str = ""):
-        print(user_query)
-        prompt = self.prompts['retrieve_goal'].format(user_query=user_query,
+        deus_logging.debug(user_query)
+        prompt = self._format_prompt('retrieve_goal', user_query=user_query,
                                                       validation_instructions=validation_instructions)
         response = self.llm_call(prompt)
         try:
@@ -534,7 +1017,7 @@ class ContextManager:
         return user_goal
     
     def _validate_goal_llm_call(self, user_query: str, user_goal: str) -> DataBundle:
-        prompt = self.prompts['validate_goal'].format(user_query=user_query, 
+        prompt = self._format_prompt('validate_goal', user_query=user_query, 
                                                       user_goal=user_goal)
         response = self.llm_call(prompt)
         json_obj = self._parse_response(response)
@@ -551,7 +1034,7 @@ class ContextManager:
             message = feedback_dict["message"]
             success = feedback_dict["success"]
             feedback = Feedback(message, success=success)
-            print(feedback)
+            deus_logging.debug(feedback)
         else:
             feedback = None
         return feedback
@@ -559,7 +1042,7 @@ class ContextManager:
     def _retrieve_validation_instructions(self, json_obj: Dict[str, str]) -> str:
         if "validation_instructions" in json_obj:
             validation_instructions = json_obj["validation_instructions"]
-            print(validation_instructions)
+            deus_logging.debug(validation_instructions)
         else:
             validation_instructions = None
         return validation_instructions
@@ -567,21 +1050,33 @@ class ContextManager:
     def _retrieve_plan(self, json_obj: Dict[str, str]) -> Plan:
         if "plan" in json_obj:
             plan_dict = json_obj['plan']
-            steps = []
+            steps = {}
+            for step_name, description in plan_dict.items():
+                if isinstance(description, dict):
+                    steps[step_name] = Step(step_name, description.get("description", ""))
+                else:
+                    steps[step_name] = Step(step_name, description)
+            previous_step = None
             for step_name, description in plan_dict.items():
-                step = Step(step_name, description)
-                steps.append(step)
-            plan = Plan(steps)
-            print(plan)
+                step = steps[step_name]
+                if isinstance(description, dict):
+                    for blocker_name in description.get("blocked_by") or []:
+                        if blocker_name in steps and blocker_name != step_name:
+                            step.add_blocker(steps[blocker_name])
+                elif previous_step is not None:
+                    # Steps without declared dependencies keep running in plan order
+                    step.add_blocker(previous_step)
+                previous_step = step
+            plan = Plan(list(steps.values()))
+            deus_logging.debug(plan)
         else:
             plan = None
         return plan
     
     def _retrieve_tool(self, json_obj: Dict[str, str]) -> Tool:
         if "tool" in json_obj:
-            tool_dict = json_obj['tool']
-            tool = self.query_tool(tool_dict)
-            print(tool)
+            tool = self.query_tool(json_obj['tool'])
+            deus_logging.debug(tool)
         else:
             tool = None
         return tool
@@ -591,17 +1086,37 @@ class ContextManager:
             action_dict = json_obj['action']
             tool_input = action_dict['tool_input']
             action = Action(step, tool, tool_input)
-            print(action)
+            deus_logging.debug(action)
         else:
             action = None
         return action
 
-    def query_tool(self, tool_dict: Dict[str, str]) -> List[Tool]:
+    def query_tool(self, tool_name: str) -> Tool:
         # query the database for the tools
-        pass
+        return self.toolkit.get(tool_name)
+
+    def _format_prompt(self, key: str, **params) -> Prompt:
+        template = self.prompts[key]
+        return Prompt(template.format(**params), key, params, template)
 
     def llm_call(self, prompt: str) -> str:
-        return llm_call(prompt)
+        return self.router.call(prompt, lambda model, provider: llm_call(prompt, model, provider=provider),
+                                self._accepts(prompt))
+
+    def _accepts(self, prompt: str) -> Callable[[str], bool]:
+        # An answer from a cheaper model is kept when it is usable, otherwise the router escalates
+        if getattr(prompt, 'key', None) in text_prompts:
+            return lambda response: bool(response.strip())
+        return self._parses
+
+    def _parses(self, response: str) -> bool:
+        try:
+            return isinstance(self._parse_response(response), dict)
+        except Exception:
+            return False
+
+    def ask_user(self, question: str) -> str:
+        return self._ask_user(question)
     
     def add_iteration(self):
         self.logger.add_iteration()
@@ -1,6 +1,13 @@
+from __future__ import annotations
 from typing import List, Dict
 
+from deus_budget import Deadline
+from deus_usage import UsageAccount
+
 class Feedback:
+    # Feedback is never changed once given, it compares and hashes by value
+    __slots__ = ('message', 'success')
+
     message: str
     success: bool
 
@@ -11,10 +18,23 @@ class Feedback:
     def copy(self):
         return Feedback(self.message, self.success)
 
+    def to_dict(self) -> Dict:
+        return {"message": self.message, "success": self.success}
+
+    def __eq__(self, other):
+        if not isinstance(other, Feedback):
+            return NotImplemented
+        return self.success == other.success and self.message == other.message
+
+    def __hash__(self):
+        return hash((self.message, self.success))
+
     def __str__(self):
         return self.message   
     
 class FeedbackBundle:
+    __slots__ = ('bundle', 'summary', 'success')
+
     bundle: List[Feedback]
     summary: str
     success: bool
@@ -35,6 +55,9 @@ class FeedbackBundle:
 
     def copy(self):
         return FeedbackBundle(self.bundle.copy(), self.summary, self.success)
+
+    def to_dict(self) -> Dict:
+        return {"bundle": [feedback_to_dict(feedback) for feedback in self.bundle], "summary": self.summary, "success": self.success}
     
     def get_last_feedback(self):
         return self.bundle[-1]
@@ -42,13 +65,29 @@ class FeedbackBundle:
     def __str__(self):
         return self.summary if self.summary is not None else "\n".join([str(feedback) for feedback in self.bundle])
     
+def feedback_to_dict(feedback: Feedback|FeedbackBundle) -> Dict:
+    return feedback.to_dict() if feedback is not None else None
+
+def feedback_from_dict(data: Dict) -> Feedback|FeedbackBundle:
+    if data is None:
+        return None
+    if "bundle" in data:
+        return FeedbackBundle([feedback_from_dict(feedback) for feedback in data["bundle"]], data.get("summary"), data.get("success"))
+    return Feedback(data["message"], data["success"])
+
 class DataBundle:
+    __slots__ = ('data', 'feedback_bundle', 'deadline', 'usage')
+
     data: Dict
     feedback_bundle: FeedbackBundle
+    deadline: Deadline
+    usage: UsageAccount
 
-    def __init__(self, data: Dict, feedback: Feedback|FeedbackBundle = None):
+    def __init__(self, data: Dict, feedback: Feedback|FeedbackBundle = None, deadline: Deadline = None, usage: UsageAccount = None):
         self.data = data
         self.feedback_bundle = FeedbackBundle([feedback]) if isinstance(feedback, Feedback) else feedback
+        self.deadline = deadline
+        self.usage = usage
 
     def __getitem__(self, key):
         try:
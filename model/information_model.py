@@ -1,12 +1,15 @@
 from __future__ import annotations
-from typing import List, Callable
-import copy
+import threading
+from typing import Dict, List, Callable, Tuple
 
-from model.feedback_model import Feedback, FeedbackBundle
+from model.feedback_model import Feedback, FeedbackBundle, feedback_to_dict, feedback_from_dict
 from model.workflow_model import Workflow
 from deus_utils import get_step_id, get_action_id
+from deus_ids import register
 
 class Scope:
+    __slots__ = ('user_query', 'user_goal', 'requirements', 'description')
+
     user_query: str
     user_goal: str
     requirements: Requirements
@@ -22,48 +25,110 @@ class Scope:
         self.requirements = requirements
 
     def copy(self):
-        return Scope(self.user_query, self.user_goal, self.requirements.copy(), self.description)
+        return Scope(self.user_query, self.user_goal,
+                     self.requirements.copy() if self.requirements is not None else None, self.description)
+
+    def to_dict(self) -> Dict:
+        return {"user_query": self.user_query,
+                "user_goal": self.user_goal,
+                "requirements": self.requirements.to_dict() if self.requirements is not None else None,
+                "description": self.description}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> Scope:
+        requirements = data.get("requirements")
+        return cls(data["user_query"], data["user_goal"],
+                   Requirements.from_dict(requirements) if requirements is not None else None,
+                   data.get("description"))
+
+    def __eq__(self, other):
+        if not isinstance(other, Scope):
+            return NotImplemented
+        return (self.user_query == other.user_query and self.user_goal == other.user_goal
+                and self.requirements == other.requirements and self.description == other.description)
+
+    # The goal and requirements change during a run, so scopes are not hashable
+    __hash__ = None
 
     def __str__(self):
         return f"User's query = {self.user_query}\nGoal = {self.user_goal}\nRequirements = {self.requirements}"
 
 class Step:
+    # Steps are compared and hashed by id, which survives copies and plan updates
+    __slots__ = ('id', 'name', 'goal', 'tools', 'blocked_by', 'blocking', 'action', 'feedback', 'accomplished', '__weakref__')
+
     id: str
     name: str
     goal: str
+    tools: List[Tool]
+    blocked_by: List[Step]
+    blocking: List[Step]
     action: Action
     feedback: Feedback|FeedbackBundle
-    accomplished: bool = False
-    
+    accomplished: bool
 
     def __init__(self,
                  name: str, 
                  goal: str,
-                 tools: List[Tool] = [],
-                 blocked_by: List[Step] = [],
-                 blocking: List[Step] = [],
+                 tools: List[Tool] = None,
+                 blocked_by: List[Step] = None,
+                 blocking: List[Step] = None,
                  action: Action = None,
                  feedback: Feedback = None,
-                 accomplished: bool = False):
-        self.id = get_step_id()
+                 accomplished: bool = False,
+                 id: str = None):
+        self.id = id or get_step_id()
         self.name = name
         self.goal = goal
-        self.tools = tools
-        self.blocked_by = blocked_by
-        self.blocking = blocking
+        self.tools = tools or []
+        self.blocked_by = blocked_by or []
+        self.blocking = blocking or []
         self.action = action
         self.feedback = feedback
         self.accomplished = accomplished
+        register(self)
     
+    def add_blocker(self, step: Step):
+        if step not in self.blocked_by:
+            self.blocked_by.append(step)
+        if self not in step.blocking:
+            step.blocking.append(self)
+
     def copy(self):
-        return Step(self.id, self.tools.copy(), self.goal, self.action, self.feedback, self.accomplished)
+        # Shallow, the blocker lists are new lists of the same steps, Plan.copy relinks them
+        return Step(self.name, self.goal, self.tools.copy(), self.blocked_by.copy(), self.blocking.copy(),
+                    self.action, self.feedback, self.accomplished, id=self.id)
+
+    def to_dict(self) -> Dict:
+        # Tools are stored by name and blockers by id, Plan.from_dict links them up again
+        return {"id": self.id,
+                "name": self.name,
+                "goal": self.goal,
+                "tools": [tool.name for tool in self.tools],
+                "blocked_by": [step.id for step in self.blocked_by],
+                "action": self.action.to_dict() if self.action is not None else None,
+                "feedback": feedback_to_dict(self.feedback),
+                "accomplished": self.accomplished}
+
+    def __eq__(self, other):
+        if not isinstance(other, Step):
+            return NotImplemented
+        return self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return f"{self.name}: {self.goal}"
 
 
 class Tool:
-    id: int
+    __slots__ = ('id', 'name', 'description', 'func', 'input_format')
+
+    id: str
     name: str
     description: str
-    workflow: Workflow
+    func: Callable
     input_format: str
 
     def __init__(self, id: str, name: str, description: str, func: Callable, input_format: str):
@@ -76,7 +141,20 @@ class Tool:
     def copy(self):
         return Tool(self.id, self.name, self.description, self.func, self.input_format)
 
+    def __eq__(self, other):
+        if not isinstance(other, Tool):
+            return NotImplemented
+        return self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return f"{self.name}: {self.description}\nInput format: {self.input_format}"
+
 class Action:
+    __slots__ = ('id', 'step', 'tool', 'tool_input', 'feedback', '__weakref__')
+
     id: str
     step: Step
     tool: Tool
@@ -87,12 +165,40 @@ class Action:
                  step: Step, 
                  tool: Tool, 
                  tool_input: str,  
-                 feedback: Feedback = None):
-        self.id = get_action_id(step.id)
+                 feedback: Feedback = None,
+                 id: str = None):
+        self.id = id or get_action_id(step.id)
         self.step = step
         self.tool = tool
         self.tool_input = tool_input
         self.feedback = feedback
+        register(self)
+
+    def copy(self, step: Step = None):
+        # step is the copy of the step the action belongs to, when the step was copied as well
+        return Action(step or self.step, self.tool, self.tool_input, self.feedback, id=self.id)
+
+    def to_dict(self) -> Dict:
+        return {"id": self.id,
+                "tool": self.tool.name if self.tool is not None else None,
+                "tool_input": self.tool_input,
+                "feedback": feedback_to_dict(self.feedback)}
+
+    @classmethod
+    def from_dict(cls, data: Dict, step: Step, toolkit: Dict[str, Tool] = None) -> Action:
+        return cls(step, (toolkit or {}).get(data.get("tool")), data.get("tool_input"),
+                   feedback_from_dict(data.get("feedback")), id=data["id"])
+
+    def __eq__(self, other):
+        if not isinstance(other, Action):
+            return NotImplemented
+        return self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return f"{self.tool.name if self.tool else None}({self.tool_input})"
 
 class Plan:
     steps: List[Step]
@@ -101,17 +207,257 @@ class Plan:
         self.steps = steps
 
     def get_current_step(self):
-        for step in self.steps:
-            if step.accomplished == False:
-                return step
+        ready_steps = self.get_ready_steps()
+        return ready_steps[0] if ready_steps else None
+
+    def get_ready_steps(self) -> List[Step]:
+        # Unaccomplished steps whose blockers are all accomplished
+        pending = [step for step in self.steps if not step.accomplished]
+        ready = [step for step in pending if all(blocker.accomplished for blocker in step.blocked_by)]
+        if pending and not ready:
+            # A dependency cycle would stall the plan, fall back to plan order
+            return pending[:1]
+        return ready
     
     def check_accomplished(self):
         return all(step.accomplished for step in self.steps)
 
     def copy(self):
-        return Plan(copy.deepcopy(self.steps))
+        # Copies the steps and points their blockers and actions at the copies, tools and feedback are shared
+        copies = {step.id: step.copy() for step in self.steps}
+        for step in copies.values():
+            step.blocked_by = [copies.get(blocker.id, blocker) for blocker in step.blocked_by]
+            step.blocking = [copies.get(blocked.id, blocked) for blocked in step.blocking]
+            if step.action is not None:
+                step.action = step.action.copy(step)
+            if isinstance(step.feedback, FeedbackBundle):
+                step.feedback = step.feedback.copy()
+        return Plan(list(copies.values()))
+
+    def snapshot(self, previous: PlanSnapshot = None) -> PlanSnapshot:
+        # Steps that did not change since previous are shared with it, an unchanged plan returns previous itself
+        steps = tuple(StepSnapshot.of(step, previous.get(step.id) if previous is not None else None) for step in self.steps)
+        if previous is not None and len(steps) == len(previous.steps) and all(a is b for a, b in zip(steps, previous.steps)):
+            return previous
+        return PlanSnapshot(steps)
+
+    def to_dict(self) -> Dict:
+        return {"steps": [step.to_dict() for step in self.steps]}
+
+    @classmethod
+    def from_dict(cls, data: Dict, toolkit: Dict[str, Tool] = None) -> Plan:
+        # Tools that are no longer in the toolkit are dropped
+        toolkit = toolkit or {}
+        steps = {}
+        for step_data in data["steps"]:
+            step = Step(step_data["name"], step_data["goal"],
+                        tools=[toolkit[name] for name in step_data.get("tools", []) if name in toolkit],
+                        feedback=feedback_from_dict(step_data.get("feedback")),
+                        accomplished=step_data.get("accomplished", False),
+                        id=step_data["id"])
+            # The restored steps are the live ones from now on, even if older objects with their ids remain
+            steps[step.id] = register(step, replace=True)
+        for step_data in data["steps"]:
+            step = steps[step_data["id"]]
+            for blocker_id in step_data.get("blocked_by", []):
+                if blocker_id in steps:
+                    step.add_blocker(steps[blocker_id])
+            if step_data.get("action") is not None:
+                step.action = register(Action.from_dict(step_data["action"], step, toolkit), replace=True)
+        return cls(list(steps.values()))
+
+    def __str__(self):
+        return "\n".join(f"{str(step)}{' (accomplished)' if step.accomplished else ''}" for step in self.steps)
+
+class StepSnapshot:
+    # The state of a step at one point, never changed once taken so that plan versions can share it.
+    # Tools are kept by name, blockers by id and the action as (id, tool name, tool input, feedback).
+    __slots__ = ('id', 'name', 'goal', 'tools', 'blocked_by', 'action', 'feedback', 'accomplished')
+
+    id: str
+    name: str
+    goal: str
+    tools: Tuple[str, ...]
+    blocked_by: Tuple[str, ...]
+    action: Tuple
+    feedback: Feedback|FeedbackBundle
+    accomplished: bool
+
+    def __init__(self, id: str, name: str, goal: str, tools: Tuple[str, ...], blocked_by: Tuple[str, ...],
+                 action: Tuple, feedback: Feedback|FeedbackBundle, accomplished: bool):
+        self.id = id
+        self.name = name
+        self.goal = goal
+        self.tools = tools
+        self.blocked_by = blocked_by
+        self.action = action
+        self.feedback = feedback
+        self.accomplished = accomplished
+
+    @classmethod
+    def of(cls, step: Step, previous: StepSnapshot = None) -> StepSnapshot:
+        # previous is returned when the step still matches it
+        action = step.action
+        snapshot = cls(step.id, step.name, step.goal,
+                       tuple(tool.name for tool in step.tools),
+                       tuple(blocker.id for blocker in step.blocked_by),
+                       (action.id, action.tool.name if action.tool is not None else None, action.tool_input, action.feedback)
+                       if action is not None else None,
+                       step.feedback, step.accomplished)
+        return previous if snapshot == previous else snapshot
+
+    def changed_fields(self, other: StepSnapshot) -> List[str]:
+        return [name for name in self.__slots__ if getattr(self, name) != getattr(other, name)]
+
+    def to_dict(self) -> Dict:
+        action = None
+        if self.action is not None:
+            action_id, tool, tool_input, feedback = self.action
+            action = {"id": action_id, "tool": tool, "tool_input": tool_input, "feedback": feedback_to_dict(feedback)}
+        return {"id": self.id,
+                "name": self.name,
+                "goal": self.goal,
+                "tools": list(self.tools),
+                "blocked_by": list(self.blocked_by),
+                "action": action,
+                "feedback": feedback_to_dict(self.feedback),
+                "accomplished": self.accomplished}
+
+    def _key(self) -> Tuple:
+        return (self.id, self.name, self.goal, self.tools, self.blocked_by, self.action, self.feedback, self.accomplished)
+
+    def __eq__(self, other):
+        if not isinstance(other, StepSnapshot):
+            return NotImplemented
+        return self is other or self._key() == other._key()
+
+    def __hash__(self):
+        return hash((self.id, self.name, self.goal, self.accomplished))
+
+    def __str__(self):
+        return f"{self.name}: {self.goal}"
+
+class PlanSnapshot:
+    # An immutable plan version, steps are StepSnapshots shared with the versions they did not change in
+    __slots__ = ('steps', '_by_id')
+
+    steps: Tuple[StepSnapshot, ...]
+
+    def __init__(self, steps: Tuple[StepSnapshot, ...]):
+        self.steps = steps
+        self._by_id = None
+
+    def get(self, step_id: str) -> StepSnapshot:
+        if self._by_id is None:
+            # Built on first use, most versions are only ever read in order
+            self._by_id = {step.id: step for step in self.steps}
+        return self._by_id.get(step_id)
+
+    def diff(self, other: PlanSnapshot, dropped: Tuple[StepSnapshot, ...] = ()) -> PlanDiff:
+        # What changed from this version to other, shared steps are skipped by identity
+        if other is self:
+            return PlanDiff((), (), (), len(self.steps), dropped)
+        added, changed, unchanged = [], [], 0
+        for step in other.steps:
+            before = self.get(step.id)
+            if before is step:
+                unchanged += 1
+            elif before is None:
+                added.append(step)
+            elif before == step:
+                unchanged += 1
+            else:
+                changed.append((before, step))
+        removed = [step for step in self.steps if other.get(step.id) is None]
+        return PlanDiff(tuple(added), tuple(removed), tuple(changed), unchanged, dropped)
+
+    def to_dict(self) -> Dict:
+        return {"steps": [step.to_dict() for step in self.steps]}
+
+    def to_plan(self, toolkit: Dict[str, Tool] = None) -> Plan:
+        return Plan.from_dict(self.to_dict(), toolkit)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __str__(self):
+        return "\n".join(f"{str(step)}{' (accomplished)' if step.accomplished else ''}" for step in self.steps)
+
+class PlanDiff:
+    __slots__ = ('added', 'removed', 'changed', 'unchanged', 'dropped')
+
+    added: Tuple[StepSnapshot, ...]
+    removed: Tuple[StepSnapshot, ...]
+    changed: Tuple[Tuple[StepSnapshot, StepSnapshot], ...]
+    unchanged: int
+    # Proposed steps that never made it into the plan, e.g. named like an accomplished step
+    dropped: Tuple[StepSnapshot, ...]
+
+    def __init__(self, added: Tuple[StepSnapshot, ...], removed: Tuple[StepSnapshot, ...],
+                 changed: Tuple[Tuple[StepSnapshot, StepSnapshot], ...], unchanged: int,
+                 dropped: Tuple[StepSnapshot, ...] = ()):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.unchanged = unchanged
+        self.dropped = dropped
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed or self.dropped)
+
+    def to_dict(self) -> Dict:
+        # Dropped steps never got into a plan version, so they are listed by name rather than id
+        return {"added": [step.id for step in self.added],
+                "removed": [step.id for step in self.removed],
+                "changed": {after.id: before.changed_fields(after) for before, after in self.changed},
+                "unchanged": self.unchanged,
+                "dropped": [step.name for step in self.dropped]}
+
+    def __str__(self):
+        lines = [f"+ {step}" for step in self.added] + [f"- {step}" for step in self.removed]
+        lines += [f"~ {after} ({', '.join(before.changed_fields(after))})" for before, after in self.changed]
+        lines += [f"x {step} (dropped)" for step in self.dropped]
+        return "\n".join(lines) if lines else "No changes"
+
+class PlanHistory:
+    versions: List[PlanSnapshot]
+
+    def __init__(self):
+        # Each version costs a tuple of references plus the steps that changed since the previous one
+        self.versions = []
+        self._lock = threading.Lock()
+
+    @property
+    def latest(self) -> PlanSnapshot:
+        return self.versions[-1] if self.versions else None
+
+    def snapshot(self, plan: Plan) -> PlanSnapshot:
+        # Shares steps with the latest version without adding to the history, e.g. for candidate plans
+        return plan.snapshot(self.latest)
+
+    def record(self, plan: Plan) -> PlanSnapshot:
+        # A plan that did not change since the latest version is not recorded again
+        with self._lock:
+            snapshot = plan.snapshot(self.latest)
+            if snapshot is not self.latest:
+                self.versions.append(snapshot)
+            return snapshot
+
+    def diff(self, start: int = -2, end: int = -1) -> PlanDiff:
+        if not self.versions:
+            return PlanDiff((), (), (), 0)
+        before = self.versions[start] if len(self.versions) > 1 else PlanSnapshot(())
+        return before.diff(self.versions[end])
+
+    def __len__(self):
+        return len(self.versions)
     
 class Requirements:
+    __slots__ = ('requirements',)
+
     requirements: List[str]
 
     def __init__(self, requirements: List[str]):
@@ -119,9 +465,24 @@ class Requirements:
 
     def copy(self):
         return Requirements(self.requirements.copy())
+
+    def to_dict(self) -> List[str]:
+        return list(self.requirements)
+
+    @classmethod
+    def from_dict(cls, data: List[str]) -> Requirements:
+        return cls(list(data))
     
     def update(self, requirements: List[str]):
         self.requirements = requirements
+
+    def __eq__(self, other):
+        if not isinstance(other, Requirements):
+            return NotImplemented
+        return self.requirements == other.requirements
+
+    # Updated in place during a run, so requirements are not hashable
+    __hash__ = None
     
     def __str__(self):
         return str(self.requirements)
\ No newline at end of file
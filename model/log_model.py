@@ -1,10 +1,146 @@
+from __future__ import annotations
+
+import sys
+import threading
+from collections import deque
 from datetime import datetime
-from model.feedback_model import Feedback, FeedbackBundle
+from typing import Any, Deque, Dict, List, Tuple
+from deus_logging import LogWriter, JSONLSink, INFO, BLOCK
+from deus_prompts import Prompt, template_version
+from deus_context import active_workflow_id, active_step_id
+from model.feedback_model import Feedback, FeedbackBundle, DataBundle
+from model.information_model import PlanDiff
 
 class Log:
+    # Subclasses declare their own __slots__, to_dict walks them in declaration order
+    __slots__ = ('timestamp', 'feedback', 'workflow_id', 'step_id')
+
     timestamp: datetime
     feedback: Feedback|FeedbackBundle
-    
+    workflow_id: str
+    step_id: str
+
     def __init__(self, feedback: Feedback = None):
         self.timestamp = datetime.now()
-        self.feedback = feedback
\ No newline at end of file
+        self.feedback = feedback
+        self.workflow_id = active_workflow_id.get()
+        self.step_id = active_step_id.get()
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {"type": type(self).__name__}
+        for name in _fields(type(self)):
+            record[name] = serialize(getattr(self, name, None))
+        # Subclasses without __slots__ keep their extra fields in a __dict__
+        for name, value in getattr(self, '__dict__', {}).items():
+            if not name.startswith("_"):
+                record[name] = serialize(value)
+        return record
+
+# Public slot names per Log class, base class fields first
+_log_fields: Dict[type, Tuple[str, ...]] = {}
+
+def _fields(cls: type) -> Tuple[str, ...]:
+    fields = _log_fields.get(cls)
+    if fields is None:
+        fields = tuple(name for klass in reversed(cls.__mro__) for name in vars(klass).get('__slots__', ())
+                       if not name.startswith("_"))
+        _log_fields[cls] = fields
+    return fields
+
+# Template text per version hash, so that logged prompts only keep a reference to it
+_templates: Dict[str, str] = {}
+
+def register_template(template: str) -> str:
+    version = template_version(template)
+    _templates.setdefault(version, template)
+    return version
+
+def get_template(version: str) -> str:
+    return _templates[version]
+
+def intern_text(value: Any) -> str:
+    # Responses and parameters repeat a lot across iterations, equal strings share one object
+    return None if value is None else sys.intern(str(value))
+
+class PromptRef:
+    __slots__ = ('key', 'version', 'params')
+
+    def __init__(self, key: str, version: str, params: Dict[str, str]):
+        self.key = key
+        self.version = version
+        self.params = params
+
+    @classmethod
+    def from_prompt(cls, prompt: Prompt) -> PromptRef:
+        # Parameters are rendered now, since the objects behind them keep changing during the run
+        params = {intern_text(name): intern_text(value) for name, value in prompt.params.items()}
+        return cls(prompt.key, register_template(prompt.template), params)
+
+    def text(self) -> str:
+        return get_template(self.version).format(**self.params)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"template": self.key, "version": self.version, "params": self.params}
+
+def compact_prompt(prompt: str) -> PromptRef|str:
+    if isinstance(prompt, Prompt) and prompt.template is not None:
+        return PromptRef.from_prompt(prompt)
+    return intern_text(prompt)
+
+def serialize(value: Any) -> Any:
+    # Compact JSON-friendly form of the values stored in logs, objects with an id are referenced by it
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, PromptRef):
+        return value.to_dict()
+    if isinstance(value, Feedback):
+        return {"message": value.message, "success": value.success}
+    if isinstance(value, FeedbackBundle):
+        return {"success": value.success, "bundle": [serialize(feedback) for feedback in value.bundle]}
+    if isinstance(value, PlanDiff):
+        return value.to_dict()
+    if isinstance(value, DataBundle):
+        return {"data": serialize(value.data), "feedback": serialize(value.feedback_bundle)}
+    if isinstance(value, dict):
+        return {str(key): serialize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [serialize(item) for item in value]
+    if hasattr(value, "id"):
+        return {"id": value.id, "description": str(value)}
+    return str(value)
+
+class EventLog:
+    events: Deque[Dict]
+    writer: LogWriter
+
+    def __init__(self, max_events: int = 10000, stream_path: str = None, segment_size: int = None, policy: str = BLOCK):
+        # Only the latest max_events stay in memory, the full history goes to stream_path if set.
+        # With a segment_size (in bytes) the stream rolls over to numbered segment files.
+        # Writing happens on a background thread, by default the stream is lossless and only
+        # holds the caller back once the writer falls a full queue behind.
+        self.events = deque(maxlen=max_events)
+        self.writer = None
+        if stream_path is not None:
+            self.writer = LogWriter([JSONLSink(stream_path, segment_size=segment_size)], policy=policy)
+        self._lock = threading.Lock()
+
+    def append(self, event: Dict):
+        with self._lock:
+            self.events.append(event)
+            if self.writer is not None:
+                self.writer.emit(INFO, None, event)
+
+    def tail(self, n: int = None) -> List[Dict]:
+        with self._lock:
+            events = list(self.events)
+        return events if n is None else events[-n:]
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
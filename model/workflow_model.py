@@ -1,10 +1,19 @@
 from __future__ import annotations
 
-import time
-
+import os
 from typing import List, Dict, Tuple, Callable, Optional
+import deus_logging
 from model.feedback_model import Feedback, FeedbackBundle, DataBundle
 from deus_utils import get_workflow_id, get_workflow_step_id
+from deus_ids import register
+from deus_context import active_pacing, active_deadline, active_workflow_id, active_workflow_step, active_usage
+from deus_budget import Deadline
+from deus_scheduler import Pacing
+from deus_usage import UsageAccount, UsageBudget
+from deus_metrics import get_monitor, get_metrics
+from deus_tracing import Tracer, trace, get_tracer, configure_tracer
+from deus_profiling import Profiler, profiler_from_env
+from deus_checkpoint import Checkpointer
 
 
 class WorkflowStep:
@@ -13,45 +22,141 @@ class WorkflowStep:
     description: str
     func: Callable
     next_step_condition: Callable
+    profile: bool
 
     def __init__(self,
                  name: str, 
                  description: str,
                  func: Callable,
-                 next_step_condition: Callable):
+                 next_step_condition: Callable,
+                 profile: bool = None):
         self.id = get_workflow_step_id()
         self.name = name
         self.description = description
         self.func = func
         self.next_step_condition = next_step_condition
+        # None follows the executor's profiler, True always profiles the step, False never does
+        self.profile = profile
+        register(self)
 
 class Workflow:
     id: str
     steps: List[WorkflowStep]
+    pacing: Pacing
+    timeout: float
+    usage_budget: UsageBudget
 
-    def __init__(self, steps: List[WorkflowStep]):
+    def __init__(self, steps: List[WorkflowStep], pacing: Pacing = None, timeout: float = None, usage_budget: UsageBudget = None):
         self.id = get_workflow_id()
         self.steps = steps
+        self.pacing = pacing or Pacing()
+        self.timeout = timeout
+        self.usage_budget = usage_budget
+        register(self)
 
 class WorkflowExecutor:
     current_step: WorkflowStep
+    # OpenMetrics file written after every run, DEUS_METRICS_FILE if not set
+    metrics_path: str = None
+    # Chrome trace file written after every run, DEUS_TRACE_FILE if not set
+    trace_path: str = None
+    # Profiles every step when set, DEUS_PROFILE sets one up if not
+    profiler: Profiler = None
+    # Saves a checkpoint after every step when set, resume_workflow continues from it
+    checkpointer: Checkpointer = None
 
-    def execute_workflow(self, workflow: Workflow, data: DataBundle) -> FeedbackBundle:
-        self.current_step = step = workflow.steps[0]
-        while step is not None:
-            feedback = self.execute_step(step, data)
-            data.feedback_bundle.append(feedback)
-            self.current_step = step = self.compute_next_step(step, data)
-            time.sleep(1)
+    def execute_workflow(self, workflow: Workflow, data: DataBundle, start_step: WorkflowStep = None) -> FeedbackBundle:
+        # LLM calls made by the steps are paced by the shared rate limiter and the workflow's pacing,
+        # and are bounded by the deadline carried in the DataBundle
+        if data.deadline is None and workflow.timeout is not None:
+            data.deadline = Deadline(workflow.timeout)
+        # Token usage and cost of the run, a run stops once it exceeds the workflow's usage budget
+        if data.usage is None:
+            data.usage = UsageAccount(workflow.usage_budget)
+        usage_token = active_usage.set(data.usage)
+        pacing_token = active_pacing.set(workflow.pacing)
+        deadline_token = active_deadline.set(data.deadline)
+        workflow_token = active_workflow_id.set(workflow.id)
+        trace_path = self.trace_path or os.getenv("DEUS_TRACE_FILE")
+        if self.profiler is None:
+            self.profiler = profiler_from_env()
+        if trace_path and get_tracer() is None:
+            configure_tracer(Tracer())
+        try:
+            with trace("workflow", "workflow", workflow_id=workflow.id):
+                self.current_step = step = start_step or workflow.steps[0]
+                while step is not None:
+                    if data.deadline is not None and data.deadline.expired():
+                        data.feedback_bundle.append(Feedback(f"Deadline of {data.deadline.timeout}s exceeded before {step.name}", success=False))
+                        break
+                    workflow.pacing.wait_for_next_step()
+                    feedback = self.execute_step(step, data)
+                    data.feedback_bundle.append(feedback)
+                    self.current_step = step = self.compute_next_step(step, data)
+                    if self.checkpointer is None:
+                        continue
+                    if step is None:
+                        # A finished run leaves nothing to resume, the next run with this path starts over
+                        self.checkpointer.clear()
+                    else:
+                        self.checkpointer.save(workflow.id, step.name, data)
+        finally:
+            active_usage.reset(usage_token)
+            active_workflow_id.reset(workflow_token)
+            active_deadline.reset(deadline_token)
+            active_pacing.reset(pacing_token)
+        deus_logging.info(f"Workflow {workflow.id} usage: {data.usage.total.to_dict()}")
+        metrics_path = self.metrics_path or os.getenv("DEUS_METRICS_FILE")
+        if metrics_path:
+            get_metrics().write(metrics_path)
+        if trace_path and get_tracer() is not None:
+            get_tracer().write(trace_path)
+        if self.profiler is not None and self.profiler.profiles:
+            deus_logging.info(f"Profiles written to {self.profiler.write_summary()}")
+        return data.feedback_bundle
             
+    def resume_workflow(self, workflow: Workflow, data: DataBundle) -> FeedbackBundle:
+        # Continues from the step after the last checkpoint, or starts over when there is none
+        checkpoint = self.checkpointer.restore(data) if self.checkpointer is not None else None
+        if checkpoint is None:
+            return self.execute_workflow(workflow, data)
+        if checkpoint["next_step"] is None:
+            deus_logging.info(f"Workflow {checkpoint['workflow_id']} already finished")
+            return data.feedback_bundle
+        # Step ids are generated per process, the names are what stays the same across runs
+        steps = {step.name: step for step in workflow.steps}
+        if checkpoint["next_step"] not in steps:
+            raise ValueError(f"Checkpoint resumes at unknown step {checkpoint['next_step']}")
+        deus_logging.info(f"Resuming workflow {checkpoint['workflow_id']} at {checkpoint['next_step']}")
+        return self.execute_workflow(workflow, data, steps[checkpoint["next_step"]])
+
     def execute_step(self, step: WorkflowStep, data: DataBundle) -> Feedback:
-        print(f"Executing step: {step.id} ({step.name})")
-        feedback = self.monitor(step.func, data)
+        deus_logging.info(f"Executing step: {step.id} ({step.name})")
+        token = active_workflow_step.set(step.name)
+        try:
+            with trace(step.name, "workflow_step", workflow_step_id=step.id) as span:
+                profiler = self._step_profiler(step)
+                if profiler is None:
+                    feedback = self.monitor(step.func, data, step.name)
+                else:
+                    feedback = profiler.profile(step.name, self.monitor, step.func, data, step.name)
+                if span is not None:
+                    span.set(success=feedback.success)
+        finally:
+            active_workflow_step.reset(token)
         return feedback
 
-    def monitor(self, func: Callable, data) -> Feedback:
-        feedback = func(data)
-        return feedback
+    def _step_profiler(self, step: WorkflowStep) -> Profiler:
+        if step.profile is False:
+            return None
+        if step.profile and self.profiler is None:
+            self.profiler = Profiler()
+        return self.profiler
+
+    def monitor(self, func: Callable, data, name: str = None) -> Feedback:
+        # execute_step may be called without a running workflow, so the name comes from the step itself
+        name = name or active_workflow_step.get() or getattr(func, "__name__", "step")
+        return get_monitor().observe("workflow_step", name, func, data)
 
     def compute_next_step(self, step: WorkflowStep, data: DataBundle) -> WorkflowStep:
         return step.next_step_condition(data)
\ No newline at end of file
@@ -0,0 +1,130 @@
+import pytest
+
+import deus_cache
+from deus_cache import ResponseCache
+from deus_client import LLMClient, LLMRequest, LLMResponse, Transport
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def tick(self, seconds=1.0):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only the cache sees the fake clock
+    monkeypatch.setattr(deus_cache, "time", clock)
+    return clock
+
+
+def make_cache(tmp_path, **options):
+    return ResponseCache(str(tmp_path / "responses.sqlite3"), **options)
+
+
+def test_hits_and_misses_are_counted(tmp_path, clock):
+    cache = make_cache(tmp_path)
+
+    assert cache.get("board") is None
+    cache.put("board", "8x8")
+
+    assert cache.get("board") == "8x8"
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "entries": 1, "bytes": 3}
+
+
+def test_least_recently_used_entry_goes_first(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=2)
+    cache.put("board", "8x8")
+    clock.tick()
+    cache.put("pieces", "32")
+    clock.tick()
+    # Reading the board makes the pieces the least recently used entry
+    cache.get("board")
+    clock.tick()
+
+    cache.put("rules", "FIDE")
+
+    assert cache.get("pieces") is None
+    assert cache.get("board") == "8x8" and cache.get("rules") == "FIDE"
+    assert cache.evictions == 1
+
+
+def test_size_limit_evicts_until_it_fits(tmp_path, clock):
+    cache = make_cache(tmp_path, max_bytes=10)
+    cache.put("board", "8x8")
+    clock.tick()
+    cache.put("pieces", "32")
+    clock.tick()
+
+    cache.put("rules", "FIDE rules")
+
+    assert cache.stats()["entries"] == 1 and cache.stats()["bytes"] == 10
+    assert cache.get("rules") == "FIDE rules"
+    assert cache.evictions == 2
+
+
+def test_expired_entries_are_misses(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=60)
+    cache.put("board", "8x8")
+    cache.put("pieces", "32", ttl=600)
+    clock.tick(61)
+
+    assert cache.get("board") is None
+    assert cache.get("pieces") == "32"
+    assert cache.stats()["entries"] == 1 and cache.misses == 1
+
+
+def test_expired_entries_are_evicted_on_put(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=60)
+    cache.put("board", "8x8")
+    clock.tick(61)
+
+    cache.put("pieces", "32")
+
+    assert cache.stats()["entries"] == 1 and cache.evictions == 1
+
+
+def test_disabled_cache_is_bypassed(tmp_path, clock):
+    cache = make_cache(tmp_path, enabled=False)
+    cache.put("board", "8x8")
+
+    assert cache.get("board") is None
+    assert cache.hits == cache.misses == 0
+    assert cache.stats()["entries"] == 0
+
+
+class CountingTransport(Transport):
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, request):
+        self.sent += 1
+        return LLMResponse(f"answer {self.sent}", {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2})
+
+
+def test_only_deterministic_requests_are_cached():
+    assert LLMRequest("Plan a chess program").cacheable()
+    assert not LLMRequest("Plan a chess program", temperature=0.7).cacheable()
+    assert not LLMRequest("Plan a chess program", use_cache=False).cacheable()
+
+
+def test_client_skips_the_cache_at_non_zero_temperature(tmp_path):
+    transport = CountingTransport()
+    cache = make_cache(tmp_path)
+    client = LLMClient(cache=cache, transport=transport)
+    try:
+        deterministic = [client.complete(LLMRequest("Plan a chess program")) for _ in range(2)]
+        sampled = [client.complete(LLMRequest("Plan a chess program", temperature=0.7)) for _ in range(2)]
+    finally:
+        client.close()
+
+    assert deterministic == ["answer 1", "answer 1"]
+    assert sampled == ["answer 2", "answer 3"]
+    assert transport.sent == 3
+    assert cache.stats()["entries"] == 1
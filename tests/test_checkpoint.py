@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import deus_flow
+from deus_checkpoint import CheckpointError
+from model.feedback_model import Feedback, FeedbackBundle, DataBundle
+from model.workflow_model import Workflow, WorkflowStep, WorkflowExecutor
+
+
+def two_step_workflow(ran):
+    second = WorkflowStep("Second", "The last step", lambda data: ran.append("Second") or Feedback("done", True),
+                          lambda data: None)
+    first = WorkflowStep("First", "The first step", lambda data: ran.append("First") or Feedback("done", True),
+                         lambda data: second)
+    return Workflow([first, second])
+
+
+def test_finished_run_clears_its_checkpoint(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    saved = []
+    executor = WorkflowExecutor()
+    executor.checkpointer = deus_flow.Checkpointer(path, lambda data: saved.append(os.path.exists(path)) or {})
+    ran = []
+
+    executor.execute_workflow(two_step_workflow(ran), DataBundle({}, FeedbackBundle()))
+
+    assert ran == ["First", "Second"]
+    assert saved == [False]
+    assert not os.path.exists(path)
+
+
+def test_resume_after_a_finished_run_starts_over(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    executor = WorkflowExecutor()
+    executor.checkpointer = deus_flow.Checkpointer(path)
+    executor.execute_workflow(two_step_workflow([]), DataBundle({}, FeedbackBundle()))
+    ran = []
+
+    executor.resume_workflow(two_step_workflow(ran), DataBundle({}, FeedbackBundle()))
+
+    assert ran == ["First", "Second"]
+
+
+def save_checkpoint(path, user_query):
+    data = DataBundle({"user_query": user_query}, FeedbackBundle())
+    deus_flow.deus_checkpointer(path).save("1workflow", "Planning", data)
+
+
+def test_checkpoint_for_another_query_is_refused(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    save_checkpoint(path, "Make me a program that can play chess")
+
+    with pytest.raises(CheckpointError, match="sudoku"):
+        deus_flow.deus_checkpointer(path).restore(DataBundle({"user_query": "Write a sudoku solver"}, FeedbackBundle()))
+
+    data = DataBundle({"user_query": None}, FeedbackBundle())
+    deus_flow.deus_checkpointer(path).restore(data)
+    assert data['user_query'] == "Make me a program that can play chess"
+
+
+def test_cli_refuses_a_query_that_does_not_match_the_checkpoint(tmp_path, capsys):
+    path = str(tmp_path / "checkpoint.json")
+    save_checkpoint(path, "Make me a program that can play chess")
+
+    assert deus_flow.main(["Write a sudoku solver", "--checkpoint", path]) == 2
+    assert "Make me a program that can play chess" in capsys.readouterr().err
+    assert os.path.exists(path)
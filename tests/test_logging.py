@@ -0,0 +1,141 @@
+import threading
+
+from deus_logging import LogWriter, Sink, INFO, DROP_NEWEST, DROP_OLDEST, BLOCK
+from model.deus_flow_model import ExecutionLog
+from model.feedback_model import Feedback, DataBundle
+
+
+class ListSink(Sink):
+    def __init__(self, level=INFO):
+        super().__init__(level)
+        self.records = []
+
+    def write(self, records):
+        self.records.extend(records)
+
+
+def test_message_is_text_as_of_the_emit():
+    sink = ListSink()
+    writer = LogWriter([sink])
+    data = DataBundle({"output": "board"})
+
+    writer.emit(INFO, ExecutionLog(None, data, Feedback("Board written", True)))
+    data["output"] = "MUTATED LATER"
+    writer.flush()
+    writer.close()
+
+    assert "'output': 'board'" in sink.records[0].message
+
+
+class GateSink(ListSink):
+    # Holds the writer thread in write until opened, so that the queue can be filled up
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+
+    def write(self, records):
+        self.entered.set()
+        self.gate.wait(5)
+        super().write(records)
+
+
+class FailingSink(Sink):
+    def write(self, records):
+        raise OSError("disk full")
+
+
+def held_writer(policy):
+    # The writer thread is stuck on "held", "first" fills the queue of one
+    sink = GateSink()
+    writer = LogWriter([sink], max_queue=1, batch_size=1, policy=policy)
+    writer.emit(INFO, "held")
+    assert sink.entered.wait(5)
+    assert writer.emit(INFO, "first")
+    return sink, writer
+
+
+def messages(sink):
+    return [record.message for record in sink.records]
+
+
+def test_drop_newest_keeps_the_queue():
+    sink, writer = held_writer(DROP_NEWEST)
+
+    assert not writer.emit(INFO, "second")
+    sink.gate.set()
+    writer.close()
+
+    assert messages(sink) == ["held", "first"]
+    assert writer.dropped == 1
+
+
+def test_drop_oldest_makes_room():
+    sink, writer = held_writer(DROP_OLDEST)
+
+    assert writer.emit(INFO, "second")
+    sink.gate.set()
+    writer.close()
+
+    assert messages(sink) == ["held", "second"]
+    assert writer.dropped == 1
+
+
+def test_block_waits_for_room():
+    sink, writer = held_writer(BLOCK)
+    producer = threading.Thread(target=writer.emit, args=(INFO, "second"))
+    producer.start()
+    producer.join(0.1)
+    assert producer.is_alive()
+
+    sink.gate.set()
+    producer.join(5)
+    writer.close()
+
+    assert messages(sink) == ["held", "first", "second"]
+    assert writer.dropped == 0
+
+
+def test_close_releases_a_blocked_producer():
+    sink, writer = held_writer(BLOCK)
+    results = []
+    producer = threading.Thread(target=lambda: results.append(writer.emit(INFO, "second")))
+    producer.start()
+    producer.join(0.1)
+
+    closer = threading.Thread(target=writer.close)
+    closer.start()
+    producer.join(5)
+    sink.gate.set()
+    closer.join(5)
+
+    assert results == [False]
+    assert writer.flush(1)
+    assert messages(sink) == ["held", "first"]
+    assert not writer.emit(INFO, "after close")
+
+
+def test_flush_waits_for_the_queue():
+    sink = GateSink()
+    writer = LogWriter([sink])
+    for index in range(3):
+        writer.emit(INFO, f"message {index}")
+
+    assert not writer.flush(0.05)
+    sink.gate.set()
+    assert writer.flush(5)
+    assert messages(sink) == ["message 0", "message 1", "message 2"]
+    writer.close()
+
+
+def test_failing_sink_does_not_stop_the_others():
+    sink = ListSink()
+    writer = LogWriter([FailingSink(), sink], batch_size=1)
+
+    writer.emit(INFO, "first")
+    writer.emit(INFO, "second")
+
+    assert writer.flush(5)
+    assert messages(sink) == ["first", "second"]
+    assert writer.emit(INFO, "third") and writer.flush(5)
+    writer.close()
@@ -0,0 +1,36 @@
+from deus_log_store import LogStore
+from model.deus_flow_model import BudgetLog, CandidateToolsLog, ExecutionLog, IterationLog, GoalUpdateLog, Logger
+from deus_budget import LoopBudgetTracker, LoopBudget
+from model.feedback_model import Feedback, DataBundle
+from model.information_model import Step, Action, Tool
+
+
+def test_logs_print_their_content():
+    tool = Tool("python", "python", "Runs a python snippet", print, "python code")
+    action = Action(Step("step_1", "Write the board"), tool, "print('board')")
+    feedback = Feedback("Board written", True)
+    execution = ExecutionLog(action, DataBundle({"board": "8x8"}), feedback)
+    candidates = CandidateToolsLog({0: tool}, feedback)
+    iteration = IterationLog(logs=[candidates, execution], feedback=feedback)
+    budget = BudgetLog(LoopBudgetTracker("planner", LoopBudget()), feedback=feedback)
+
+    assert "python(print('board'))" in str(execution) and "8x8" in str(execution)
+    assert "Candidate tools = python" in str(candidates)
+    assert str(execution) in str(iteration) and str(candidates) in str(iteration)
+    assert "planner used 0 iterations" in str(budget)
+    for log in (execution, candidates, iteration):
+        assert str(feedback) in str(log)
+    for log in (execution, candidates, iteration, budget):
+        assert "object at 0x" not in str(log)
+
+
+def test_logger_close_shuts_down_its_store(tmp_path):
+    path = str(tmp_path / "logs.sqlite3")
+    store = LogStore(path)
+    logger = Logger(store=store)
+    logger.log(GoalUpdateLog("A chess program", "A chess game"))
+
+    logger.close()
+
+    assert not store.writer._thread.is_alive()
+    assert [event["goal"] for event in LogStore(path).query(type="GoalUpdateLog")] == ["A chess game"]
@@ -0,0 +1,117 @@
+import gc
+import json
+
+from deus_ids import register, resolve
+from model.deus_flow_model import ContextManager, Context
+from model.feedback_model import Feedback
+from model.information_model import Scope, Step, Plan, Action, Tool
+
+
+def make_manager():
+    return ContextManager(context=Context(Scope("Make me a chess program", "A chess program")))
+
+
+def live_plan():
+    tool = Tool("python", "python", "Runs a python snippet", print, "python code")
+    done = Step("step_1", "Write the board", accomplished=True, feedback=Feedback("Board written", True))
+    pending = Step("step_2", "Write the move validator", feedback=Feedback("Needs more tests", False))
+    pending.action = Action(pending, tool, "print('moves')")
+    pending.add_blocker(done)
+    return done, pending, Plan([done, pending])
+
+
+def test_frozen_steps_are_untouched():
+    manager = make_manager()
+    done, pending, plan = live_plan()
+    candidate = Plan([Step("step_1", "Rewrite the board"), Step("step_2", "Write the move validator")])
+
+    merged = manager._merge_plan(plan, candidate)
+
+    assert merged.steps[0] is done
+    assert done.goal == "Write the board"
+    assert done.blocking == [pending]
+    assert [step.name for step in merged.steps] == ["step_1", "step_2"]
+
+
+def test_kept_step_carries_over_id_feedback_and_action():
+    manager = make_manager()
+    done, pending, plan = live_plan()
+    replacement = Step("step_2", "Write and test the move validator")
+
+    merged = manager._merge_plan(plan, Plan([replacement]))
+
+    assert merged.steps[1] is replacement
+    assert replacement.id == pending.id
+    assert replacement.feedback is pending.feedback
+    assert replacement.action is pending.action
+    # The blocker on the accomplished step survives even though the planner did not repeat it
+    assert replacement.blocked_by == [done]
+
+
+def test_new_and_dropped_steps():
+    manager = make_manager()
+    done, pending, plan = live_plan()
+    new_step = Step("step_3", "Write the game loop")
+
+    merged = manager._merge_plan(plan, Plan([new_step]))
+
+    # step_2 was dropped by the planner, step_3 is new and keeps its own id
+    assert [step.name for step in merged.steps] == ["step_1", "step_3"]
+    assert new_step.id != pending.id
+    assert new_step.feedback is None
+
+
+def test_blockers_are_rewired_to_the_merged_steps():
+    manager = make_manager()
+    done, pending, plan = live_plan()
+    validator = Step("step_2", "Write the move validator")
+    loop = Step("step_3", "Write the game loop")
+    loop.add_blocker(validator)
+    # A regenerated step named like an accomplished one is dropped, links to it must go too
+    frozen_twin = Step("step_1", "Rewrite the board")
+    loop.add_blocker(frozen_twin)
+
+    merged = manager._merge_plan(plan, Plan([frozen_twin, validator, loop]))
+
+    assert [step.name for step in merged.steps] == ["step_1", "step_2", "step_3"]
+    assert loop.blocked_by == [done, validator]
+    assert validator.blocking == [loop]
+    # Links to accomplished steps only go one way
+    assert loop not in done.blocking
+
+
+def test_rejected_candidate_leaves_the_registry_alone():
+    manager = make_manager()
+    done, pending, plan = live_plan()
+    for step in plan.steps:
+        register(step, replace=True)
+
+    manager._merge_plan(plan, Plan([Step("step_2", "A candidate that fails validation")]))
+    gc.collect()
+
+    assert resolve(pending.id) is pending
+    assert resolve(done.id) is done
+
+
+def test_clash_with_a_hidden_accomplished_step_is_named_and_recorded(monkeypatch):
+    manager = make_manager()
+    manager.max_frozen_steps = 2
+    done = [Step(f"step_{index}", f"Part {index}", accomplished=True) for index in range(1, 5)]
+    plan = Plan(done + [Step("step_5", "Write the move validator")])
+    prompts = []
+
+    def llm_call(self, prompt):
+        prompts.append(prompt)
+        return json.dumps({"plan": {"step_1": "Redo part 1", "step_5": "Write the move validator",
+                                    "step_6": "Write the UI"}})
+    monkeypatch.setattr(ContextManager, "llm_call", llm_call)
+
+    merged = manager._update_plan_llm_call("A chess program", Feedback("Keep going", True), plan)
+
+    # step_1 is not described any more but its name is still in the prompt
+    assert "Part 1" not in str(prompts[0]) and "step_1, step_2" in str(prompts[0])
+    assert [step.name for step in merged.steps] == ["step_1", "step_2", "step_3", "step_4", "step_5", "step_6"]
+    assert merged.steps[0] is done[0]
+    diff = manager.logger.logs[-1].logs[-1].diff
+    assert [step.name for step in diff.dropped] == ["step_1"] and diff.to_dict()["dropped"] == ["step_1"]
+    assert "x step_1: Redo part 1 (dropped)" in str(diff)
@@ -0,0 +1,38 @@
+from deus_router import ModelChoice, ModelRouter, Provider, Route
+
+
+def test_plain_model():
+    choice = ModelChoice.parse("gpt-4")
+    assert (choice.provider, choice.model) == (None, "gpt-4")
+
+
+def test_fine_tuned_model_id_is_not_split():
+    model = "ft:gpt-3.5-turbo-0613:acme::7qTVM5AR"
+    choice = ModelChoice.parse(model, providers={"local": Provider()})
+    assert (choice.provider, choice.model) == (None, model)
+
+
+def test_prefix_naming_a_provider():
+    choice = ModelChoice.parse("local:llama-2-13b", providers={"local": Provider()})
+    assert (choice.provider, choice.model) == ("local", "llama-2-13b")
+
+
+def test_unknown_prefix_stays_part_of_the_model():
+    choice = ModelChoice.parse("local:llama-2-13b")
+    assert (choice.provider, choice.model) == (None, "local:llama-2-13b")
+
+
+def test_router_splits_routes_against_its_providers():
+    fine_tuned = "ft:gpt-3.5-turbo-0613:acme::7qTVM5AR"
+    router = ModelRouter({'planner': [fine_tuned, "local:llama-2-70b"], 'validation': Route("local:llama-2-13b")},
+                         providers={"local": Provider(api_base="http://localhost:8000/v1")})
+
+    planner = router.route_for('create_plan')[1].models
+    assert [(choice.provider, choice.model) for choice in planner] == [(None, fine_tuned), ("local", "llama-2-70b")]
+    validation = router.route_for('validate_goal')[1].models
+    assert [(choice.provider, choice.model) for choice in validation] == [("local", "llama-2-13b")]
+
+
+def test_explicit_provider_is_kept():
+    choice = ModelChoice.parse({"model": "ft:gpt-3.5-turbo-0613:acme::7qTVM5AR", "provider": "azure"})
+    assert (choice.provider, choice.model) == ("azure", "ft:gpt-3.5-turbo-0613:acme::7qTVM5AR")
@@ -0,0 +1,66 @@
+import pytest
+
+from deus_scheduler import TokenBucket, RateLimit, RateLimiter
+
+
+def test_bucket_takes_tokens_and_refills():
+    bucket = TokenBucket(capacity=60, refill_rate=1)
+    start = bucket._updated
+
+    assert bucket.reserve(50, start) == (0.0, 50)
+    # 10 left, 30 more puts the bucket 20 in debt: 20 seconds at one token per second
+    assert bucket.reserve(30, start) == (20.0, 30)
+    assert bucket.reserve(0, start + 25) == (0.0, 0)
+    assert bucket.tokens == pytest.approx(5)
+
+
+def test_bucket_never_holds_more_than_its_capacity():
+    bucket = TokenBucket(capacity=60, refill_rate=1)
+    bucket.reserve(0, bucket._updated + 600)
+    bucket.refund(100)
+
+    assert bucket.tokens == 60
+
+
+def test_bucket_takes_at_most_its_capacity():
+    bucket = TokenBucket(capacity=1000, refill_rate=1000 / 60)
+
+    delay, taken = bucket.reserve(5000, bucket._updated)
+
+    assert (delay, taken) == (0.0, 1000)
+    assert bucket.tokens == 0
+
+
+def test_limiter_without_a_limit_does_not_wait():
+    assert RateLimiter().reserve("gpt-4", 5000) == (0.0, 0)
+
+
+def test_limiter_refunds_only_what_it_took():
+    limiter = RateLimiter({"gpt-4": RateLimit(tokens_per_minute=1000)})
+
+    delay, taken = limiter.reserve("gpt-4", 5000)
+    limiter.adjust("gpt-4", taken, 900)
+
+    assert (delay, taken) == (0.0, 1000)
+    # 900 tokens were really used, only the other 100 are free again
+    assert limiter._buckets["gpt-4"][1].tokens == pytest.approx(100, abs=1)
+
+
+def test_limiter_charges_usage_beyond_the_reservation():
+    limiter = RateLimiter({"gpt-4": RateLimit(tokens_per_minute=1000)})
+
+    _, taken = limiter.reserve("gpt-4", 200)
+    limiter.adjust("gpt-4", taken, 500)
+
+    assert limiter._buckets["gpt-4"][1].tokens == pytest.approx(500, abs=1)
+
+
+def test_limiter_delays_requests_over_the_limit():
+    limiter = RateLimiter(default=RateLimit(requests_per_minute=2))
+
+    assert limiter.reserve("gpt-3.5-turbo", 10)[0] == 0.0
+    assert limiter.reserve("gpt-3.5-turbo", 10)[0] == 0.0
+    # The third request waits for a refill, half a minute at two requests a minute
+    assert limiter.reserve("gpt-3.5-turbo", 10)[0] == pytest.approx(30, abs=0.1)
+    # Models have their own buckets
+    assert limiter.reserve("gpt-4", 10)[0] == 0.0
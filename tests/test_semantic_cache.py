@@ -0,0 +1,68 @@
+import json
+
+from deus_semantic_cache import SemanticCache, HashingEmbedder, QUERY, GOAL
+from model.deus_flow_model import ContextManager, Logger, SemanticCacheLog
+from model.information_model import Requirements
+
+ACCEPTED = json.dumps({"feedback": {"message": "Looks right", "success": True}, "validation_instructions": ""})
+
+
+def scripted_llm(goal):
+    # Answers by prompt key; the scope questions must not be asked when the cache hits
+    answers = {'retrieve_goal': json.dumps({"user_goal": goal}),
+               'validate_goal': ACCEPTED,
+               'describe_scope': "A chess game for two players on one computer",
+               'validate_scope_description': ACCEPTED}
+
+    def llm_call(self, prompt):
+        if prompt.key in ('retrieve_goal', 'validate_goal') and goal is None:
+            raise AssertionError("The goal was extracted again")
+        return answers[prompt.key]
+    return llm_call
+
+
+def refuse(question):
+    raise AssertionError(f"The user was asked again: {question}")
+
+
+def test_reworded_request_reuses_the_scope_through_its_goal(tmp_path, monkeypatch):
+    cache = SemanticCache(str(tmp_path / "semantic.sqlite3"), HashingEmbedder())
+    cache.put("make me a chess program", "A chess game", ["Against a human or the computer?"],
+              ["Two human players", "Standard chess rules"])
+    monkeypatch.setattr(ContextManager, "llm_call", scripted_llm("Create a chess game"))
+
+    manager = ContextManager("build a chess game", logger=Logger(), ask_user=refuse, semantic_cache=cache)
+    manager.set_scope()
+
+    # The wording is too different for the query threshold, the extracted goals are the same
+    assert cache.stats()["query_misses"] == 1 and cache.stats()["goal_hits"] == 1
+    assert manager._questions == ["Against a human or the computer?"]
+    assert manager.context.scope.requirements == Requirements(["Two human players", "Standard chess rules"])
+    assert manager.context.scope.description == "A chess game for two players on one computer"
+    hit = [log for log in manager.logger.logs[-1].logs if isinstance(log, SemanticCacheLog) and log.hit]
+    assert [(log.kind, log.questions, log.requirements) for log in hit] == \
+        [(GOAL, ["Against a human or the computer?"], ["Two human players", "Standard chess rules"])]
+
+
+def test_repeated_request_reuses_goal_questions_and_requirements(tmp_path, monkeypatch):
+    cache = SemanticCache(str(tmp_path / "semantic.sqlite3"), HashingEmbedder())
+    cache.put("make me a chess program", "A chess game", ["Against a human or the computer?"], ["Standard chess rules"])
+    # No goal is scripted: a query hit must not extract it again
+    monkeypatch.setattr(ContextManager, "llm_call", scripted_llm(None))
+
+    manager = ContextManager("Make me a chess program!", logger=Logger(), ask_user=refuse, semantic_cache=cache)
+    manager.set_scope()
+
+    assert cache.stats()["query_hits"] == 1 and cache.stats()["goal_hits"] == 0
+    assert manager.context.scope.user_goal == "A chess game"
+    assert manager._questions == ["Against a human or the computer?"]
+    assert manager.context.scope.requirements == Requirements(["Standard chess rules"])
+
+
+def test_query_threshold_misses_paraphrases(tmp_path):
+    # At the default 0.9 only near-identical wording hits on the query, paraphrases go through the goal
+    cache = SemanticCache(str(tmp_path / "semantic.sqlite3"), HashingEmbedder())
+    cache.put("make me a chess program", "A chess game", [], ["Standard chess rules"])
+
+    assert cache.match(QUERY, "build a chess game").similarity < 0.5
+    assert cache.match(GOAL, "Create a chess game").hit
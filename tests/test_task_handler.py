@@ -0,0 +1,27 @@
+from model.deus_flow_model import ContextManager, Context
+from model.feedback_model import Feedback, FeedbackBundle, DataBundle
+from model.information_model import Scope, Step, Plan
+
+
+def test_failing_step_keeps_the_results_of_its_siblings():
+    manager = ContextManager(context=Context(Scope("Make me a chess program", "A chess program")), max_workers=2)
+    board, validator = Step("step_1", "Write the board"), Step("step_2", "Write the move validator")
+    manager.context.plan = Plan([board, validator])
+    manager.add_iteration()
+
+    def get_candidate_tools(step):
+        if step is validator:
+            raise ValueError("tool index unavailable")
+        return []
+    manager.get_candidate_tools = get_candidate_tools
+    manager.tool_selection = lambda step, tools: (None, FeedbackBundle(Feedback("Board tool", success=True)))
+    manager.turn_to_action = lambda step, tool, feedback: None
+    manager.execute_action = lambda action, feedback: DataBundle("board", FeedbackBundle(Feedback("Board written", success=True)))
+
+    manager.task_handler()
+
+    assert board.accomplished and not validator.accomplished
+    assert "tool index unavailable" in str(validator.feedback.get_last_feedback())
+    assert manager.context.data.data == {board.id: manager.context.data.data[board.id], validator.id: None}
+    assert manager.context.data.data[board.id].data == "board"
+    assert [feedback.success for feedback in manager.context.current_feedback.bundle] == [True, False]
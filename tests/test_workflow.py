@@ -0,0 +1,12 @@
+from deus_metrics import get_monitor
+from model.feedback_model import Feedback, FeedbackBundle, DataBundle
+from model.workflow_model import WorkflowStep, WorkflowExecutor
+
+
+def test_step_executed_outside_a_workflow_is_monitored_under_its_name():
+    step = WorkflowStep("Standalone", "Run on its own", lambda data: Feedback("done", True), lambda data: None)
+
+    feedback = WorkflowExecutor().execute_step(step, DataBundle({}, FeedbackBundle()))
+
+    assert feedback.success
+    assert get_monitor().calls.value(kind="workflow_step", name="Standalone", outcome="success") == 1